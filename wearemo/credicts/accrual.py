@@ -0,0 +1,313 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, models
+from django.utils import timezone
+
+from . import services, sharding
+from .exceptions import ConcurrentUpdateError
+from .models import AccrualRun, LoanAdjustment, Loans
+
+#Kinds of the adjustments
+INTEREST: int = 1
+LATE_INTEREST: int = 2
+LATE_FEE: int = 3
+KINDS: Dict[int, str] = {INTEREST: "interest", LATE_INTEREST: "late_interest", LATE_FEE: "late_fee"}
+
+#Days used to turn the annual rates into daily rates
+DAYS_IN_YEAR: int = 365
+#Precision of the amounts of the loans
+CENTS: Decimal = Decimal("0.01")
+#Columns of a snapshot of the loans
+COLUMNS: List[str] = ["id", "customer_id", "outstanding", "taken_at", "maximum_payment_date", "version"]
+
+
+def current_config() -> Dict[str, Any]:
+
+    """
+        This method return the rates of the accrual from the settings
+
+        :return: Annual interest rate, annual late interest rate, late fee and grace days
+        :rtype: dict
+    """
+
+    return {
+        "interest_rate": settings.CREDICTS_ACCRUAL_INTEREST_RATE,
+        "late_interest_rate": settings.CREDICTS_ACCRUAL_LATE_INTEREST_RATE,
+        "late_fee": str(settings.CREDICTS_ACCRUAL_LATE_FEE),
+        "grace_days": settings.CREDICTS_ACCRUAL_GRACE_DAYS,
+    }
+
+def _ordinals(moments: List[Optional[datetime]]) -> np.ndarray:
+    #The days of the loans are the days of the current time zone, -1 when there is no date
+    zone = timezone.get_current_timezone()
+    return np.array([moment.astimezone(zone).toordinal() if moment is not None else -1 for moment in moments], dtype=np.int64)
+
+def compute(
+    outstanding: np.ndarray,
+    taken: np.ndarray,
+    due: np.ndarray,
+    charged_fee: np.ndarray,
+    day: date,
+    config: Dict[str, Any]
+) -> Dict[int, np.ndarray]:
+
+    """
+        This method calculate the adjustments of a day for a chunk of loans, in cents
+        The interest accrue every day after the loan was taken, the late interest and
+        the late fee start when the grace days after the maximum payment date are over
+        The late fee is charged once by loan
+
+        :param outstanding: Outstanding of the loans, in cents
+        :type outstanding: np.ndarray
+        :param taken: Day the loans were taken, as ordinals
+        :type taken: np.ndarray
+        :param due: Maximum payment day of the loans, as ordinals, -1 without date
+        :type due: np.ndarray
+        :param charged_fee: Loans that already have a late fee
+        :type charged_fee: np.ndarray
+        :param day: Day of the accrual
+        :type day: date
+        :param config: Rates of the run
+        :type config: dict
+
+        :return: Cents of every kind of adjustment by loan
+        :rtype: dict
+    """
+
+    today: int = day.toordinal()
+    accruing: np.ndarray = (taken >= 0) & (taken < today) & (outstanding > 0)
+    overdue: np.ndarray = accruing & (due >= 0) & (today > due + int(config["grace_days"]))
+
+    #The amounts are rounded half to even to the cent
+    interest: np.ndarray = np.rint(outstanding * (float(config["interest_rate"]) / DAYS_IN_YEAR)).astype(np.int64)
+    late_interest: np.ndarray = np.rint(outstanding * (float(config["late_interest_rate"]) / DAYS_IN_YEAR)).astype(np.int64)
+    fee: int = int((Decimal(config["late_fee"]) * 100).to_integral_value())
+
+    return {
+        INTEREST: np.where(accruing, interest, 0),
+        LATE_INTEREST: np.where(overdue, late_interest, 0),
+        LATE_FEE: np.where(overdue & ~charged_fee, fee, 0),
+    }
+
+def _cents(value: int) -> Decimal:
+    return Decimal(int(value)).scaleb(-2)
+
+def write_outstanding(alias: str, loans: List[Tuple[int, int, Decimal]]) -> None:
+
+    """
+        This method write the new outstanding of a chunk of loans with one prepared UPDATE,
+        conditioned on the version of the snapshot
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param loans: Id, version that was read and new outstanding of every loan
+        :type loans: list
+
+        :raises ConcurrentUpdateError: When a loan was updated after the snapshot
+    """
+
+    connection = connections[alias]
+    field: models.Field = Loans._meta.get_field("outstanding")
+    now: Any = Loans._meta.get_field("updated_at").get_db_prep_save(timezone.now(), connection)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {Loans._meta.db_table} SET outstanding = %s, version = version + 1, updated_at = %s "
+            "WHERE id = %s AND version = %s",
+            [[field.get_db_prep_save(outstanding, connection), now, loan_id, version] for loan_id, version, outstanding in loans]
+        )
+        if cursor.rowcount != len(loans):
+            raise ConcurrentUpdateError()
+
+def write_journal(alias: str, run: AccrualRun, adjustments: List[Tuple[int, int, int, Decimal]]) -> None:
+
+    """
+        This method insert the adjustments of a chunk with one prepared INSERT,
+        the columns shared by the chunk are prepared once
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param run: Run of the day
+        :type run: AccrualRun
+        :param adjustments: Loan, customer, kind and amount of every adjustment
+        :type adjustments: list
+    """
+
+    connection = connections[alias]
+    field: models.Field = LoanAdjustment._meta.get_field("amount")
+    day: Any = LoanAdjustment._meta.get_field("day").get_db_prep_save(run.day, connection)
+    now: Any = LoanAdjustment._meta.get_field("created_at").get_db_prep_save(timezone.now(), connection)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {LoanAdjustment._meta.db_table} (loan_id, customer_id, run_id, day, kind, amount, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [
+                [loan_id, customer_id, run.id, day, kind, field.get_db_prep_save(amount, connection), now]
+                for loan_id, customer_id, kind, amount in adjustments
+            ]
+        )
+
+@services.with_retries
+def accrue_chunk(alias: str, run: AccrualRun, after_id: int, chunk_size: int) -> Optional[Dict[str, Any]]:
+
+    """
+        This method accrue a chunk of loans of a shard: the snapshot is read with one query,
+        the adjustments are calculated with arrays, and the journal and the new outstanding
+        are written in bulk in the same transaction
+        The loans that already have adjustments of the day are skipped, a chunk is never applied twice
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param run: Run of the day
+        :type run: AccrualRun
+        :param after_id: Last loan of the previous chunk
+        :type after_id: int
+        :param chunk_size: Loans of the chunk
+        :type chunk_size: int
+
+        :return: Last loan of the chunk and the loans adjusted, None when there are no more loans
+        :rtype: dict
+
+        :raises ConcurrentUpdateError: When the loans keep changing after all the retries
+    """
+
+    rows: List[Tuple] = list(
+        Loans.objects.using(alias).filter(
+            id__gt=after_id,
+            #The loans that the payments can pay, the accrued outstanding is always payable
+            status__in=services.CREDIT_LOAN_STATUS,
+            taken_at__isnull=False,
+            outstanding__gt=0
+        ).order_by("id").values_list(*COLUMNS)[:chunk_size]
+    )
+    if not rows:
+        return None
+
+    ids: List[int] = [row[0] for row in rows]
+    #The journal of the loans of the chunk: the adjustments of the day and the late fees
+    done: Set[int] = set()
+    charged: Set[int] = set()
+    for loan_id, day, kind in LoanAdjustment.objects.using(alias).filter(
+        loan_id__gte=ids[0],
+        loan_id__lte=ids[-1]
+    ).filter(models.Q(day=run.day) | models.Q(kind=LATE_FEE)).values_list("loan_id", "day", "kind"):
+        if day == run.day:
+            done.add(loan_id)
+        if kind == LATE_FEE:
+            charged.add(loan_id)
+
+    outstanding: np.ndarray = np.rint(np.array([row[2] for row in rows], dtype=np.float64) * 100).astype(np.int64)
+    amounts: Dict[int, np.ndarray] = compute(
+        outstanding,
+        _ordinals([row[3] for row in rows]),
+        _ordinals([row[4] for row in rows]),
+        np.array([loan_id in charged for loan_id in ids], dtype=bool),
+        run.day,
+        run.config
+    )
+    totals: np.ndarray = sum(amounts.values())
+    totals[np.array([loan_id in done for loan_id in ids], dtype=bool)] = 0
+
+    adjustments: List[Tuple[int, int, int, Decimal]] = []
+    updates: List[Tuple[int, int, Decimal]] = []
+    for index in np.flatnonzero(totals):
+        loan_id, customer_id, _, _, _, version = rows[index]
+        for kind, values in amounts.items():
+            if values[index]:
+                adjustments.append((loan_id, customer_id, kind, _cents(values[index])))
+        updates.append((loan_id, version, _cents(outstanding[index] + totals[index])))
+
+    if adjustments:
+        write_journal(alias, run, adjustments)
+        write_outstanding(alias, updates)
+
+    return {"last_id": ids[-1], "loans": len(rows), "adjusted": len(updates)}
+
+def accrue_shard(
+    alias: str,
+    run: AccrualRun,
+    chunk_size: int,
+    progress: Optional[Callable[[str, int], None]] = None
+) -> Dict[str, Any]:
+
+    """
+        This method accrue all the loans of a shard in chunks of ids
+        An interrupted run continue after the last loan with adjustments of the day,
+        the chunks are committed in the order of the ids
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param run: Run of the day
+        :type run: AccrualRun
+        :param chunk_size: Loans of every chunk
+        :type chunk_size: int
+        :param progress: Function called with the shard and the loans read after every chunk
+        :type progress: Callable
+
+        :return: Report of the shard
+        :rtype: dict
+    """
+
+    journal: models.QuerySet = LoanAdjustment.objects.using(alias).filter(day=run.day)
+    resumed_after: Optional[int] = journal.aggregate(last=models.Max("loan_id"))["last"]
+
+    report: Dict[str, Any] = {"resumed_after": resumed_after, "chunks": 0, "loans": 0, "adjusted": 0}
+    after_id: int = resumed_after if resumed_after is not None else -1
+    with sharding.use_shard(alias):
+        while True:
+            chunk: Optional[Dict[str, Any]] = accrue_chunk(alias, run, after_id, chunk_size)
+            if chunk is None:
+                break
+            after_id = chunk["last_id"]
+            report["chunks"] += 1
+            report["loans"] += chunk["loans"]
+            report["adjusted"] += chunk["adjusted"]
+            if progress:
+                progress(alias, chunk["loans"])
+
+    #The totals come from the journal, they include the chunks of the interrupted runs
+    for row in journal.order_by().values("kind").annotate(count=models.Count("id"), total=models.Sum("amount")):
+        report[KINDS[row["kind"]]] = {"count": row["count"], "amount": str(Decimal(row["total"]).quantize(CENTS))}
+
+    return report
+
+def accrue(
+    day: Optional[date] = None,
+    chunk_size: Optional[int] = None,
+    progress: Optional[Callable[[str, int], None]] = None
+) -> Dict[str, Any]:
+
+    """
+        This method run the accrual of a day in all the shards in parallel
+        A completed day is not accrued again, an interrupted day is resumed with its rates
+
+        :param day: Day of the accrual, today by default
+        :type day: date
+        :param chunk_size: Loans of every chunk, CREDICTS_ACCRUAL_CHUNK_SIZE by default
+        :type chunk_size: int
+        :param progress: Function called with the shard and the loans read after every chunk
+        :type progress: Callable
+
+        :return: Report of the run
+        :rtype: dict
+    """
+
+    day = day or timezone.localdate()
+    chunk_size = chunk_size or settings.CREDICTS_ACCRUAL_CHUNK_SIZE
+
+    run, _ = AccrualRun.objects.get_or_create(day=day, defaults={"config": current_config()})
+    if run.status == AccrualRun.STATUS_RUN_CHOICES[1][0]:
+        return {"day": day.isoformat(), "already_completed": True, "shards": run.report}
+
+    reports: List[Dict[str, Any]] = sharding.fan_out(lambda alias: accrue_shard(alias, run, chunk_size, progress))
+    run.report = dict(zip(sharding.shards(), reports))
+    run.status = AccrualRun.STATUS_RUN_CHOICES[1][0]
+    run.finished_at = timezone.now()
+    run.save(update_fields=["report", "status", "finished_at", "updated_at"])
+
+    return {"day": day.isoformat(), "already_completed": False, "shards": run.report}
@@ -1,6 +1,194 @@
+from typing import Any, Dict, List, Optional, Tuple
+
 from django.contrib import admin
-from .models import Customers, Loans, Payment
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+
+from . import archive, sharding
+from .models import Customers, CustomerPlacement, Loans, Payment, PaymentDetails
+
+#Query parameter with the last id of the previous page
+CURSOR_VAR: str = "after"
+#Maximum rows counted in a filtered changelist or in a table without statistics
+COUNT_LIMIT: int = 10000
+
+
+def estimated_count(model: type, using: str) -> Optional[int]:
+
+    """
+        This method return the number of rows of a table from the statistics of the database,
+        without scanning the table
+
+        :param model: Model of the table
+        :type model: Model
+        :param using: Alias of the database
+        :type using: str
+
+        :return: Estimated rows, None when the database has no statistics
+        :rtype: int
+    """
+
+    connection = connections[using]
+    table: str = model._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+
+        if connection.vendor == "sqlite":
+            #The statistics are created by ANALYZE
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+
+    return None
+
+class EstimatedCountPaginator(Paginator):
+
+    """
+        This paginator use the statistics of the database for the count of a table without filters
+        and count at most COUNT_LIMIT rows when the changelist is filtered
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset: models.QuerySet = self.object_list
+        if not queryset.query.where:
+            estimate: Optional[int] = estimated_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+
+        return queryset[:COUNT_LIMIT].count()
+
+class KeysetChangeList(ChangeList):
+
+    """
+        This changelist read the pages with the last id of the previous page (id < cursor)
+        instead of an offset, when the rows are ordered by the default ordering (-id)
+        The cost of a page does not depend on its position in the table
+    """
+
+    def __init__(self, request, *args, **kwargs) -> None:
+        try:
+            self.cursor: Optional[int] = int(request.GET[CURSOR_VAR])
+        except (KeyError, ValueError):
+            self.cursor = None
+        self.keyset: bool = ORDER_VAR not in request.GET
+        self.next_cursor: Optional[int] = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        lookup_params: Dict[str, Any] = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params: Optional[Dict[str, Any]] = None, remove: Optional[List[str]] = None) -> str:
+        #The links of the filters and of the ordering start in the first page
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_VAR])
+
+    def get_results(self, request) -> None:
+
+        if not self.keyset:
+            return super().get_results(request)
+
+        queryset: models.QuerySet = self.queryset
+        if self.cursor is not None:
+            queryset = queryset.filter(pk__lt=self.cursor)
+
+        #One row more than the page tell if there is a next page
+        rows: List[models.Model] = list(queryset[:self.list_per_page + 1])
+        if len(rows) > self.list_per_page:
+            rows = rows[:self.list_per_page]
+            self.next_cursor = rows[-1].pk
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = self.cursor is not None or self.next_cursor is not None
+
+    @property
+    def next_page_url(self) -> str:
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+    @property
+    def first_page_url(self) -> str:
+        return self.get_query_string()
+
+class ScalableModelAdmin(admin.ModelAdmin):
+
+    """
+        This admin render the changelist in constant time: estimated counts,
+        keyset pagination and exact searches over indexed columns
+        The admin read the default shard
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count: bool = False
+    ordering: Tuple[str, ...] = ("-id",)
+    list_per_page: int = 100
+
+    def get_changelist(self, request, **kwargs) -> type:
+        return KeysetChangeList
+
+class CustomersAdmin(ScalableModelAdmin):
+
+    list_display: Tuple[str, ...] = ("id", "external_id", "status", "score", "created_at")
+    list_filter: Tuple[str, ...] = ("status",)
+    search_fields: Tuple[str, ...] = ("=external_id",)
+
+    def get_deleted_objects(self, objs, request) -> Tuple[List[str], Dict[str, int], set, List[str]]:
+
+        """
+            This method summarize the customers to delete, without collecting
+            all their loans and payments for the confirmation page
+        """
+
+        customers: List[str] = [str(customer) for customer in objs]
+        perms_needed: set = set() if self.has_delete_permission(request) else {self.opts.verbose_name}
+
+        return customers, {self.opts.verbose_name_plural: len(customers)}, perms_needed, []
+
+    def delete_model(self, request, obj: Customers) -> None:
+        archive.purge_customer(sharding.current_shard(), obj.pk)
+        CustomerPlacement.objects.filter(customer_id=obj.pk).delete()
+
+    def delete_queryset(self, request, queryset: models.QuerySet) -> None:
+        for customer in queryset:
+            self.delete_model(request, customer)
+
+class LoansAdmin(ScalableModelAdmin):
+
+    list_display: Tuple[str, ...] = ("id", "external_id", "customer", "amount", "outstanding", "status", "created_at")
+    list_filter: Tuple[str, ...] = ("status",)
+    list_select_related: Tuple[str, ...] = ("customer",)
+    search_fields: Tuple[str, ...] = ("=external_id",)
+    raw_id_fields: Tuple[str, ...] = ("customer",)
+
+class PaymentAdmin(ScalableModelAdmin):
+
+    list_display: Tuple[str, ...] = ("id", "external_id", "customer", "total_amount", "status", "paid_at")
+    list_select_related: Tuple[str, ...] = ("customer",)
+    search_fields: Tuple[str, ...] = ("=external_id",)
+    raw_id_fields: Tuple[str, ...] = ("customer",)
+
+class PaymentDetailsAdmin(ScalableModelAdmin):
+
+    list_display: Tuple[str, ...] = ("id", "payment", "loan", "amount", "created_at")
+    list_select_related: Tuple[str, ...] = ("payment", "loan")
+    raw_id_fields: Tuple[str, ...] = ("payment", "loan")
 
-admin.site.register(Customers)
-admin.site.register(Loans)
-admin.site.register(Payment)
\ No newline at end of file
+admin.site.register(Customers, CustomersAdmin)
+admin.site.register(Loans, LoansAdmin)
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(PaymentDetails, PaymentDetailsAdmin)
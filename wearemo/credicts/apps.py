@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class CredictsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'credicts'
+
+    def ready(self) -> None:
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        #Register the handlers of the background jobs
+        from . import handlers  # noqa: F401
+        from .sharding import seed_id_sequences
+        from .slow_queries import install
+
+        #Every shard generate the ids in its own range
+        post_migrate.connect(seed_id_sequences, sender=self)
+
+        #Log the slow queries of all the connections
+        connection_created.connect(install)
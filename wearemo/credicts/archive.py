@@ -0,0 +1,303 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from . import rollups, sharding
+from .models import (ArchivedLoan, ArchivedPayment, ArchivedPaymentDetail,
+                     Customers, LoanAdjustment, Loans, Payment,
+                     PaymentDetails, PaymentMonthlySummary)
+
+#Status of the loans that can not receive more payments: rejected and paid
+CLOSED_LOAN_STATUS: List[int] = [3, 4]
+
+#Archive table of every hot table
+ARCHIVES: Dict[Type[models.Model], Type[models.Model]] = {
+    Loans: ArchivedLoan,
+    Payment: ArchivedPayment,
+    PaymentDetails: ArchivedPaymentDetail,
+}
+
+
+def _columns(model: Type[models.Model]) -> str:
+    return ", ".join(field.column for field in model._meta.concrete_fields)
+
+def _ids(ids: List[int]) -> Tuple[str, List[int]]:
+    return ", ".join(["%s"] * len(ids)), list(ids)
+
+def move_rows(cursor, model: Type[models.Model], where: str, params: List[Any], archived_at: Optional[datetime]) -> int:
+
+    """
+        This method copy the rows of a table to its archive table with one INSERT ... SELECT
+        and delete them with one DELETE, without loading the rows
+
+        :param cursor: Cursor of the shard
+        :type cursor: CursorWrapper
+        :param model: Hot model
+        :type model: Model
+        :param where: SQL condition of the rows
+        :type where: str
+        :param params: Parameters of the condition
+        :type params: list
+        :param archived_at: Datetime of the archive, None delete the rows without archiving them
+        :type archived_at: datetime
+
+        :return: Rows moved
+        :rtype: int
+    """
+
+    table: str = model._meta.db_table
+    if archived_at is not None:
+        columns: str = _columns(model)
+        cursor.execute(
+            f"INSERT INTO {ARCHIVES[model]._meta.db_table} ({columns}, archived_at) "
+            f"SELECT {columns}, %s FROM {table} WHERE {where}",
+            [archived_at] + params
+        )
+    cursor.execute(f"DELETE FROM {table} WHERE {where}", params)
+
+    return cursor.rowcount
+
+def archivable_payments(alias: str, cutoff: datetime) -> models.QuerySet:
+
+    """
+        This method return the payments that can be archived:
+        paid before the cutoff and with all their loans closed
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param cutoff: Payments paid before this datetime
+        :type cutoff: datetime
+
+        :return: Queryset of payments
+        :rtype: QuerySet
+    """
+
+    return Payment.objects.using(alias).filter(
+        paid_at__lt=cutoff
+    ).exclude(
+        paymentdetails__loan__status__in=[1, 2]
+    ).order_by("id")
+
+def archivable_loans(alias: str, cutoff: datetime) -> models.QuerySet:
+
+    """
+        This method return the loans that can be archived:
+        closed before the cutoff and without details in the payment details table,
+        so all their payments were archived before
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param cutoff: Loans closed before this datetime
+        :type cutoff: datetime
+
+        :return: Queryset of loans
+        :rtype: QuerySet
+    """
+
+    return Loans.objects.using(alias).filter(
+        status__in=CLOSED_LOAN_STATUS,
+        updated_at__lt=cutoff,
+        paymentdetails__isnull=True
+    ).order_by("id")
+
+def deletable_payments(alias: str, cutoff: datetime, ids: List[int]) -> List[int]:
+
+    """
+        This method return the archivable payments that can be deleted without archiving them:
+        all the loans of the payments are deleted with them, so the paid amounts of the loans
+        (the hot and archived details) never lose a payment
+        A payment is kept when one of its loans was updated after the cutoff or has details
+        of other payments, until those payments can be deleted in the same chunk
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param cutoff: Rows older than this datetime
+        :type cutoff: datetime
+        :param ids: Primary keys of the archivable payments of the chunk
+        :type ids: list
+
+        :return: Primary keys of the payments
+        :rtype: list
+    """
+
+    candidates: set = set(ids)
+    while candidates:
+        loans: models.QuerySet = PaymentDetails.objects.using(alias).filter(payment_id__in=candidates).values("loan_id")
+        #The loans are locked, the details of other payments can not be added while they are checked
+        fresh: set = set(
+            Loans.objects.using(alias).filter(id__in=loans).select_for_update().exclude(
+                updated_at__lt=cutoff
+            ).values_list("id", flat=True)
+        )
+        details: List[Tuple[int, int]] = list(
+            PaymentDetails.objects.using(alias).filter(loan_id__in=loans).values_list("payment_id", "loan_id")
+        )
+        blocked: set = fresh | {loan_id for payment_id, loan_id in details if payment_id not in candidates}
+        kept: set = candidates - {payment_id for payment_id, loan_id in details if loan_id in blocked}
+        if kept == candidates:
+            break
+        candidates = kept
+
+    return sorted(candidates)
+
+def archive_shard(alias: str, cutoff: datetime, delete: bool = False, chunk_size: int = 1000) -> Dict[str, int]:
+
+    """
+        This method move the old payments, with their details, and then the closed loans
+        of a shard to the archive tables, one transaction for every chunk of rows
+        With delete the payments are deleted with their loans in the same transaction,
+        and removed from the monthly summaries, so reconcile keeps adding up
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param cutoff: Rows older than this datetime
+        :type cutoff: datetime
+        :param delete: Delete the rows without archiving them
+        :type delete: bool
+        :param chunk_size: Payments or loans of every transaction
+        :type chunk_size: int
+
+        :return: Rows moved by table
+        :rtype: dict
+    """
+
+    moved: Dict[str, int] = {"payment": 0, "paymentdetails": 0, "loans": 0}
+    details: str = PaymentDetails._meta.db_table
+    #Without archiving, not every archivable payment is deleted, the chunks continue after the last payment
+    after: int = 0
+
+    while True:
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            archived_at: Optional[datetime] = None if delete else timezone.now()
+            ids: List[int] = list(
+                archivable_payments(alias, cutoff).filter(id__gt=after).select_for_update(
+                    of=("self",)
+                ).values_list("id", flat=True)[:chunk_size]
+            )
+            selected: List[int] = deletable_payments(alias, cutoff, ids) if delete else ids
+            if selected:
+                placeholders, params = _ids(selected)
+                loans: List[int] = list(
+                    PaymentDetails.objects.using(alias).filter(payment_id__in=selected).values_list("loan_id", flat=True).order_by().distinct()
+                )
+                if delete:
+                    rollups.record_deletion(alias, selected)
+                moved["paymentdetails"] += move_rows(
+                    cursor, PaymentDetails, f"payment_id IN ({placeholders})", params, archived_at
+                )
+                moved["payment"] += move_rows(cursor, Payment, f"id IN ({placeholders})", params, archived_at)
+                if delete and loans:
+                    placeholders, params = _ids(loans)
+                    moved["loans"] += move_rows(cursor, Loans, f"id IN ({placeholders})", params, None)
+            if ids:
+                after = ids[-1]
+
+        if len(ids) < chunk_size:
+            break
+
+    while True:
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            archived_at = None if delete else timezone.now()
+            ids = list(
+                archivable_loans(alias, cutoff).select_for_update(of=("self",)).values_list("id", flat=True)[:chunk_size]
+            )
+            if ids:
+                placeholders, params = _ids(ids)
+                #The details were moved with their payments, the condition is checked again in the lock
+                moved["loans"] += move_rows(
+                    cursor,
+                    Loans,
+                    f"id IN ({placeholders}) AND NOT EXISTS (SELECT 1 FROM {details} WHERE loan_id = {Loans._meta.db_table}.id)",
+                    params,
+                    archived_at
+                )
+
+        if len(ids) < chunk_size:
+            break
+
+    return moved
+
+def archive(
+    older_than_days: Optional[int] = None,
+    delete: bool = False,
+    chunk_size: Optional[int] = None
+) -> Dict[str, Dict[str, int]]:
+
+    """
+        This method archive the old payments and the closed loans of all the shards
+
+        :param older_than_days: Age of the rows, CREDICTS_ARCHIVE_AFTER_DAYS by default
+        :type older_than_days: int
+        :param delete: Delete the rows without archiving them
+        :type delete: bool
+        :param chunk_size: Rows of every transaction, CREDICTS_ARCHIVE_CHUNK_SIZE by default
+        :type chunk_size: int
+
+        :return: Rows moved by shard and table
+        :rtype: dict
+    """
+
+    days: int = settings.CREDICTS_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff: datetime = timezone.now() - timedelta(days=days)
+
+    return dict(zip(sharding.shards(), sharding.fan_out(lambda alias: archive_shard(
+        alias,
+        cutoff,
+        delete=delete,
+        chunk_size=chunk_size or settings.CREDICTS_ARCHIVE_CHUNK_SIZE
+    ))))
+
+def purge_customer(alias: str, customer_id: int, chunk_size: Optional[int] = None) -> Dict[str, int]:
+
+    """
+        This method delete a customer with all its rows, hot and archived,
+        with chunked DELETE statements instead of the cascade of the ORM
+        The customer is deleted last, if the purge is interrupted it can be run again
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param chunk_size: Rows of every statement, CREDICTS_ARCHIVE_CHUNK_SIZE by default
+        :type chunk_size: int
+
+        :return: Rows deleted by table
+        :rtype: dict
+    """
+
+    chunk_size: int = chunk_size or settings.CREDICTS_ARCHIVE_CHUNK_SIZE
+    payment: str = Payment._meta.db_table
+    archived_payment: str = ArchivedPayment._meta.db_table
+
+    #Tables in the order that they can be deleted, with the condition of the rows of the customer
+    steps: List[Tuple[Type[models.Model], str]] = [
+        (PaymentDetails, f"payment_id IN (SELECT id FROM {payment} WHERE customer_id = %s)"),
+        (ArchivedPaymentDetail, f"payment_id IN (SELECT id FROM {archived_payment} WHERE customer_id = %s)"),
+        (Payment, "customer_id = %s"),
+        (ArchivedPayment, "customer_id = %s"),
+        (Loans, "customer_id = %s"),
+        (ArchivedLoan, "customer_id = %s"),
+        (PaymentMonthlySummary, "customer_id = %s"),
+        (LoanAdjustment, "customer_id = %s"),
+        (Customers, "id = %s"),
+    ]
+
+    deleted: Dict[str, int] = {}
+    for model, where in steps:
+        table: str = model._meta.db_table
+        deleted[model._meta.model_name] = 0
+        while True:
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where} LIMIT %s)",
+                    [customer_id, chunk_size]
+                )
+                rows: int = cursor.rowcount
+            deleted[model._meta.model_name] += rows
+            if rows < chunk_size:
+                break
+
+    return deleted
@@ -0,0 +1,447 @@
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, teardown_databases)
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import archive, fieldsets, pipeline, services, sqlite_store
+from .models import Customers, Loans, Payment, PaymentDetails
+from .serializers import LoansSerializer, parse_fields
+
+#Bandwidth of the mobile networks of the clients, in bits per second, and their round trip
+NETWORKS: Dict[str, Dict[str, float]] = {
+    "3g": {"bits_per_second": 1.6e6, "round_trip_ms": 150},
+    "4g": {"bits_per_second": 12e6, "round_trip_ms": 60},
+}
+#Benchmarks by name, every benchmark receive the options of the command
+SCENARIOS: Dict[str, Callable[..., Dict[str, Any]]] = {}
+
+
+def scenario(name: str) -> Callable:
+
+    def decorator(function: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        SCENARIOS[name] = function
+        return function
+
+    return decorator
+
+@contextmanager
+def isolated_databases() -> Iterator[str]:
+
+    """
+        This context manager create empty file databases for the benchmark,
+        like the test runner, the configured databases are not modified
+
+        :return: Temporary directory of the databases
+        :rtype: str
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        for alias in connections:
+            settings_dict: Dict[str, Any] = connections[alias].settings_dict
+            if settings_dict["ENGINE"].endswith("sqlite3"):
+                #A file database, the in memory databases dont pay the commits
+                settings_dict["TEST"]["NAME"] = os.path.join(directory, f"benchmark_{alias}.sqlite3")
+
+        old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+        try:
+            with override_settings(
+                CREDICTS_PAYMENT_QUEUE_DB=os.path.join(directory, "payment_queue.sqlite3"),
+                CREDICTS_THROTTLE_DB=os.path.join(directory, "throttle.sqlite3"),
+                CREDICTS_EVENTS_DB=os.path.join(directory, "events.sqlite3")
+            ):
+                yield directory
+        finally:
+            sqlite_store.close_all()
+            teardown_databases(old_config, verbosity=0)
+
+def summary(latencies: List[float], elapsed: float) -> Dict[str, float]:
+
+    """
+        This method return the throughput and the percentiles of the latencies
+
+        :param latencies: Seconds of every operation
+        :type latencies: list
+        :param elapsed: Total seconds
+        :type elapsed: float
+
+        :return: Operations per second and latencies in milliseconds
+        :rtype: dict
+    """
+
+    ordered: List[float] = sorted(latencies)
+    return {
+        "operations": len(ordered),
+        "per_second": round(len(ordered) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p99_ms": round(ordered[int(len(ordered) * 0.99) - 1] * 1000, 3),
+    }
+
+def seed_loans(customers: int, amount: int = 10 ** 9) -> List[Loans]:
+
+    """
+        This method create customers with one big active loan
+
+        :param customers: Number of customers
+        :type customers: int
+        :param amount: Amount of every loan
+        :type amount: int
+
+        :return: Loans created
+        :rtype: list
+    """
+
+    created: List[Customers] = Customers.objects.bulk_create([
+        Customers(external_id=f"benchmark-{index}", score=amount) for index in range(customers)
+    ])
+    Loans.objects.bulk_create([
+        Loans(external_id=f"benchmark-{customer.id}", customer=customer, amount=amount, outstanding=amount)
+        for customer in created
+    ])
+
+    return list(Loans.objects.all())
+
+@scenario("payments")
+def payments(count: int, batch_size: int = 200, **options) -> Dict[str, Any]:
+
+    """
+        This method compare the synchronous payments with the payment pipeline
+        The latency of the pipeline is the latency of the acknowledge of the submission
+    """
+
+    loans: List[Loans] = seed_loans(100)
+
+    def payment(index: int) -> Dict[str, Any]:
+        loan: Loans = loans[index % len(loans)]
+        return {
+            "customer": loan.customer_id,
+            "external_id": f"benchmark-{index}",
+            "total_amount": 1,
+            "paymentdetails": [{"loan": loan.id, "amount": 1}],
+        }
+
+    latencies: List[float] = []
+    started_at: float = time.perf_counter()
+    for index in range(count):
+        data: Dict[str, Any] = payment(index)
+        payment_started_at: float = time.perf_counter()
+        services.apply_payment(data["customer"], data["external_id"], data["total_amount"], data["paymentdetails"])
+        latencies.append(time.perf_counter() - payment_started_at)
+    synchronous: Dict[str, float] = summary(latencies, time.perf_counter() - started_at)
+
+    latencies = []
+    started_at = time.perf_counter()
+    for index in range(count):
+        data = payment(index)
+        payment_started_at = time.perf_counter()
+        pipeline.submit(data)
+        latencies.append(time.perf_counter() - payment_started_at)
+    submitted_at: float = time.perf_counter()
+    submissions: Dict[str, float] = summary(latencies, submitted_at - started_at)
+
+    applied: int = pipeline.run_writer(batch_size=batch_size, max_delay=0, once=True)
+    writer_elapsed: float = time.perf_counter() - submitted_at
+
+    return {
+        "synchronous": synchronous,
+        "pipeline": {
+            "submissions": submissions,
+            "batch_size": batch_size,
+            "applied": applied,
+            "applied_per_second": round(applied / writer_elapsed, 1),
+        },
+    }
+
+def table_sizes(models: List[Any]) -> Optional[Dict[str, int]]:
+
+    """
+        This method return the bytes of the tables and of their indexes,
+        from the dbstat table of SQLite or the size functions of PostgreSQL
+
+        :param models: Models of the tables
+        :type models: list
+
+        :return: Bytes by table and by the indexes of the table, None when dbstat is not available
+        :rtype: dict
+    """
+
+    tables: List[str] = [model._meta.db_table for model in models]
+    sizes: Dict[str, int] = {}
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute("SELECT pg_table_size(%s), pg_indexes_size(%s)", [table, table])
+                sizes[table], sizes[f"{table} indexes"] = cursor.fetchone()
+        return sizes
+
+    if connection.vendor != "sqlite":
+        return None
+
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT master.tbl_name, master.type, SUM(stat.pgsize) FROM dbstat AS stat "
+                "JOIN sqlite_master AS master ON master.name = stat.name "
+                f"WHERE master.tbl_name IN ({', '.join(['%s'] * len(tables))}) GROUP BY master.tbl_name, master.type",
+                tables
+            )
+        except Exception:
+            return None
+
+        for table, kind, size in cursor.fetchall():
+            sizes[table if kind == "table" else f"{table} indexes"] = size
+
+    return sizes
+
+@scenario("partitioning")
+def partitioning(count: int, **options) -> Dict[str, Any]:
+
+    """
+        This method compare the size of the hot tables and the time of the queries of the customers,
+        before and after the closed loans and the old payments are moved to the archive tables
+        Every customer has 9 paid loans with an old payment and 1 active loan
+    """
+
+    customers: List[Customers] = Customers.objects.bulk_create([
+        Customers(external_id=f"benchmark-{index}", score=10 ** 6) for index in range(max(count // 10, 1))
+    ])
+    Loans.objects.bulk_create([
+        Loans(
+            external_id=f"benchmark-{customer.id}-{index}",
+            customer=customer,
+            amount=100,
+            outstanding=100 if index == 9 else 0,
+            status=2 if index == 9 else 4
+        )
+        for customer in customers for index in range(10)
+    ])
+    paid: List[Loans] = list(Loans.objects.filter(status=4))
+    payments: List[Payment] = Payment.objects.bulk_create([
+        Payment(external_id=f"benchmark-{loan.id}", total_amount=100, customer_id=loan.customer_id) for loan in paid
+    ])
+    PaymentDetails.objects.bulk_create([
+        PaymentDetails(amount=100, loan=loan, payment=payment) for loan, payment in zip(paid, payments)
+    ])
+    old = timezone.now() - timedelta(days=400)
+    Payment.objects.update(paid_at=old)
+    Loans.objects.update(updated_at=old)
+
+    sample: List[int] = random.Random(0).choices([customer.id for customer in customers], k=500)
+
+    def measure() -> Dict[str, Any]:
+        #Update the statistics of the query planner after the archive
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        latencies: Dict[str, List[float]] = {"total_debt": [], "payments": [], "loads": []}
+        for customer_id in sample:
+            for name, query in [
+                ("total_debt", lambda: services.total_debt(customer_id)),
+                ("payments", lambda: list(Payment.objects.filter(customer_id=customer_id))),
+                ("loads", lambda: list(Loans.objects.filter(customer_id=customer_id))),
+            ]:
+                query_started_at: float = time.perf_counter()
+                query()
+                latencies[name].append(time.perf_counter() - query_started_at)
+
+        return {
+            "sizes": table_sizes([Loans, Payment, PaymentDetails]),
+            "queries": {name: summary(values, sum(values)) for name, values in latencies.items()},
+        }
+
+    before: Dict[str, Any] = measure()
+    moved: Dict[str, Dict[str, int]] = archive.archive()
+
+    return {
+        "before": before,
+        "archived": moved,
+        "after": measure(),
+    }
+
+@scenario("fieldsets")
+def fieldsets_payloads(count: int, **options) -> Dict[str, Any]:
+
+    """
+        This method compare the payload and the queries of the list of loans
+        with all the fields, with sparse fields and with the customer expanded,
+        the expansion is measured with and without the optimization of the queryset
+    """
+
+    seed_loans(count)
+
+    variants: Dict[str, Dict[str, Any]] = {
+        "all_fields": {"fields": None, "expand": None, "optimize": False},
+        "sparse_fields": {"fields": "id,outstanding,status", "expand": None, "optimize": True},
+        "expand_per_row": {"fields": None, "expand": "customer", "optimize": False},
+        "expand": {"fields": None, "expand": "customer", "optimize": True},
+    }
+
+    results: Dict[str, Any] = {}
+    for name, variant in variants.items():
+        fields, expand = parse_fields(variant["fields"]), parse_fields(variant["expand"])
+        serializer: Any = LoansSerializer(Loans.objects.order_by("id"), many=True, fields=fields, expand=expand)
+        if variant["optimize"]:
+            serializer.instance = fieldsets.optimize(serializer.instance, serializer.child)
+
+        started_at: float = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            payload: bytes = JSONRenderer().render(serializer.data)
+        results[name] = {
+            "queries": len(queries.captured_queries),
+            "bytes": len(payload),
+            "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 3),
+        }
+
+    return results
+
+@scenario("compression")
+def compression(count: int, **options) -> Dict[str, Any]:
+
+    """
+        This method compare the size and the time of the loans and the payments of a customer
+        with and without compression and the compact options, through the middlewares of the API
+        The latency of every network is the time of the server, one round trip and the transfer
+    """
+
+    customer: Customers = Customers.objects.create(external_id="benchmark", score=10 ** 9)
+    now = timezone.now()
+    loans: List[Loans] = Loans.objects.bulk_create([
+        Loans(
+            external_id=f"benchmark-{index}", customer=customer, amount=1000 + index, outstanding=1000 + index,
+            taken_at=now - timedelta(days=index % 90), maximum_payment_date=now + timedelta(days=30) if index % 3 else None
+        )
+        for index in range(count)
+    ])
+    payments: List[Payment] = Payment.objects.bulk_create([
+        Payment(external_id=f"benchmark-{index}", customer=customer, total_amount=10, status=2, paid_at=now)
+        for index in range(count)
+    ])
+    PaymentDetails.objects.bulk_create([
+        PaymentDetails(payment=payment, loan=loan, amount=10) for payment, loan in zip(payments, loans)
+    ])
+
+    client: APIClient = APIClient(SERVER_NAME="localhost")
+    client.force_authenticate(User.objects.create_user(username="benchmark"))
+    urls: Dict[str, str] = {
+        "loads": reverse("customers-loads", kwargs={"pk": customer.id}),
+        "payments": reverse("customers-payments", kwargs={"pk": customer.id}) + "?expand=paymentdetails",
+    }
+    variants: Dict[str, Dict[str, str]] = {
+        "identity": {"params": "", "encoding": "identity"},
+        "gzip": {"params": "", "encoding": "gzip"},
+        "br": {"params": "", "encoding": "br"},
+        "compact": {"params": "omit_null=1&decimals=number&layout=columns", "encoding": "identity"},
+        "compact_br": {"params": "omit_null=1&decimals=number&layout=columns", "encoding": "br"},
+    }
+
+    results: Dict[str, Any] = {}
+    for endpoint, url in urls.items():
+        results[endpoint] = {}
+        for name, variant in variants.items():
+            separator: str = "&" if "?" in url else "?"
+            target: str = url + (separator + variant["params"] if variant["params"] else "")
+            latencies: List[float] = []
+            for _ in range(5):
+                started_at: float = time.perf_counter()
+                response = client.get(target, HTTP_ACCEPT_ENCODING=variant["encoding"])
+                latencies.append(time.perf_counter() - started_at)
+            server_ms: float = statistics.median(latencies) * 1000
+            size: int = len(response.content)
+            results[endpoint][name] = {
+                "bytes": size,
+                "server_ms": round(server_ms, 3),
+                **{
+                    f"{network}_ms": round(server_ms + link["round_trip_ms"] + size * 8 / link["bits_per_second"] * 1000, 1)
+                    for network, link in NETWORKS.items()
+                },
+            }
+
+    return results
+
+def _pay(loans: List[Loans], prefix: str, start: Any, results: Any) -> None:
+
+    """
+        This method apply one payment to every loan, in a forked process
+
+        :param loans: Loans of the process
+        :type loans: list
+        :param prefix: Prefix of the external ids of the payments
+        :type prefix: str
+        :param start: Event that start all the processes at the same time
+        :type start: Event
+        :param results: Queue of the payments applied and the errors by every process
+        :type results: Queue
+    """
+
+    applied: int = 0
+    errors: Dict[str, int] = {}
+    start.wait()
+    for index, loan in enumerate(loans):
+        try:
+            services.apply_payment(loan.customer_id, f"{prefix}-{index}", 1, [{"loan": loan.id, "amount": 1}])
+            applied += 1
+        except Exception as error:
+            errors[str(error)] = errors.get(str(error), 0) + 1
+    connections.close_all()
+    results.put((applied, errors))
+
+@scenario("workers")
+def workers(count: int, workers: str = "1,2,4,8", **options) -> Dict[str, Any]:
+
+    """
+        This method measure the throughput of the payments with several processes writing at the same time,
+        like the workers of gunicorn, every process pay the loans of its own customers
+        SQLite has one writer at a time, PostgreSQL lock only the rows of the payment
+    """
+
+    loans: List[Loans] = seed_loans(max(count, 1))
+    context = multiprocessing.get_context("fork")
+
+    results: Dict[str, Any] = {"vendor": connection.vendor}
+    for processes in [int(value) for value in workers.split(",")]:
+        #The forked processes open their own connections
+        connections.close_all()
+        sqlite_store.close_all()
+
+        start = context.Event()
+        queue = context.Queue()
+        children: List[Any] = [
+            context.Process(target=_pay, args=(loans[index::processes], f"workers-{processes}-{index}", start, queue))
+            for index in range(processes)
+        ]
+        for child in children:
+            child.start()
+
+        started_at: float = time.perf_counter()
+        start.set()
+        totals: List[tuple] = [queue.get() for _ in children]
+        elapsed: float = time.perf_counter() - started_at
+        for child in children:
+            child.join()
+
+        applied: int = sum(total[0] for total in totals)
+        errors: Dict[str, int] = {}
+        for _, process_errors in totals:
+            for error, times in process_errors.items():
+                errors[error] = errors.get(error, 0) + times
+        results[str(processes)] = {
+            "applied": applied,
+            "per_second": round(applied / elapsed, 1),
+            "errors": errors,
+        }
+
+    return results
@@ -0,0 +1,256 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from . import events, services, sharding
+from .exceptions import ConcurrentUpdateError, LoanError
+from .models import Customers, Loans
+from .serializers import BulkLoanSerializer, BulkStatusSerializer
+
+#Result of a row of a bulk request: the index of the row with the id of the loan or the errors
+Result = Dict[str, Any]
+#Valid row of a bulk request: the index and the validated data
+Row = Tuple[int, Dict[str, Any]]
+
+
+def _error(index: int, field: str, message: str) -> Result:
+    return {"index": index, "errors": {field: [message]}}
+
+def _validate(rows: List[Any], serializer_class: type) -> Tuple[List[Row], Dict[int, Result]]:
+
+    """
+        This method validate the fields of every row, without queries
+
+        :param rows: Rows of the request
+        :type rows: list
+        :param serializer_class: Serializer of a row
+        :type serializer_class: Serializer
+
+        :return: Valid rows and the errors of the invalid rows
+        :rtype: tuple
+    """
+
+    valid: List[Row] = []
+    errors: Dict[int, Result] = {}
+    for index, row in enumerate(rows):
+        serializer = serializer_class(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            errors[index] = {"index": index, "errors": serializer.errors}
+
+    return valid, errors
+
+@services.with_retries
+def _create_in_shard(rows: List[Row]) -> Dict[int, Result]:
+
+    """
+        This method create the loans of the current shard with one insert,
+        the credit limit of every customer is checked in memory with the amounts
+        read by one grouped query, in the order of the rows
+
+        :param rows: Valid rows of the shard
+        :type rows: list
+
+        :return: Result by index
+        :rtype: dict
+    """
+
+    results: Dict[int, Result] = {}
+    customers: Dict[int, Customers] = Customers.objects.select_for_update().in_bulk(
+        {data["customer"] for _, data in rows}
+    )
+    in_use: Dict[int, Decimal] = services.credit_in_use(customers)
+    now = timezone.now()
+
+    loans: List[Loans] = []
+    indexes: List[int] = []
+    for index, data in rows:
+        customer: Customers = customers.get(data["customer"])
+        if customer is None:
+            results[index] = _error(index, "customer", "The customer does not exist")
+            continue
+
+        status: int = data.get("status", Loans.STATUS_LOAD_CHOICES[0][0])
+        try:
+            taken: bool = services.check_transition(None, status)
+        except LoanError as error:
+            results[index] = _error(index, "non_field_errors", error.message)
+            continue
+
+        if in_use[customer.id] + data["amount"] > customer.score:
+            results[index] = _error(index, "amount", "Dont cant create a loan with this amount")
+            continue
+        #The next loans of the customer see this loan, like the loans created one by one
+        if status in services.CREDIT_LOAN_STATUS:
+            in_use[customer.id] += data["amount"]
+
+        fields: Dict[str, Any] = {name: value for name, value in data.items() if name not in ["customer", "status"]}
+        loans.append(Loans(
+            **fields,
+            customer=customer,
+            status=status,
+            outstanding=data["amount"],
+            taken_at=now if taken else None
+        ))
+        indexes.append(index)
+
+    for index, loan in zip(indexes, Loans.objects.bulk_create(loans, batch_size=settings.CREDICTS_BULK_BATCH_SIZE)):
+        results[index] = {"index": index, "id": loan.id}
+    for customer_id in {loan.customer_id for loan in loans}:
+        events.notify(customer_id)
+
+    return results
+
+def create_loans(rows: List[Any]) -> List[Result]:
+
+    """
+        This method create many loans with the rules of the loans created one by one:
+        the fields, the initial status and the credit limit of the customer
+        The valid loans are created and the invalid loans are returned with their errors
+
+        :param rows: Loans to create
+        :type rows: list
+
+        :return: Result of every row, in the order of the rows
+        :rtype: list
+    """
+
+    valid, results = _validate(rows, BulkLoanSerializer)
+
+    #The loans are created in the shard of their customer
+    placements: Dict[int, str] = sharding.shards_for_customers(data["customer"] for _, data in valid)
+    by_shard: Dict[str, List[Row]] = defaultdict(list)
+    for index, data in valid:
+        by_shard[placements[data["customer"]]].append((index, data))
+
+    for alias, shard_rows in by_shard.items():
+        with sharding.use_shard(alias):
+            results.update(_create_in_shard(shard_rows))
+
+    return [results[index] for index in range(len(rows))]
+
+@services.with_retries
+def _transition_in_shard(rows: List[Row]) -> Dict[int, Result]:
+
+    """
+        This method change the status of the loans of the current shard,
+        with one update for every pair of current and new status
+        The updates are conditioned on the current status, a loan changed
+        by another request after the read make the shard retry
+
+        :param rows: Valid rows of the request, the loans of other shards are ignored
+        :type rows: list
+
+        :return: Result by index of the loans of the shard
+        :rtype: dict
+
+        :raises ConcurrentUpdateError: When the loans keep changing after all the retries
+    """
+
+    results: Dict[int, Result] = {}
+    loans: Dict[int, Loans] = Loans.objects.select_for_update().only(
+        "id", "status", "version", "customer"
+    ).in_bulk([data["id"] for _, data in rows])
+    if not loans:
+        return results
+
+    groups: Dict[Tuple[int, int, bool], List[Tuple[int, Loans]]] = defaultdict(list)
+    for index, data in rows:
+        loan: Loans = loans.get(data["id"])
+        if loan is None:
+            continue
+
+        if data.get("version", loan.version) != loan.version:
+            results[index] = _error(index, "version", "The loan was updated by another request, retry with the new version")
+            continue
+        try:
+            taken: bool = services.check_transition(loan.status, data["status"])
+        except LoanError as error:
+            results[index] = _error(index, "status", error.message)
+            continue
+
+        groups[(loan.status, data["status"], taken)].append((index, loan))
+
+    now = timezone.now()
+    for (current, status, taken), members in groups.items():
+        values: Dict[str, Any] = {"status": status, "version": models.F("version") + 1, "updated_at": now}
+        if taken:
+            values["taken_at"] = now
+
+        updated: int = Loans.objects.filter(
+            id__in=[loan.id for _, loan in members],
+            status=current
+        ).update(**values)
+        if updated != len(members):
+            raise ConcurrentUpdateError()
+
+        for index, loan in members:
+            results[index] = {"index": index, "id": loan.id, "version": loan.version + 1}
+
+    for customer_id in {loan.customer_id for members in groups.values() for _, loan in members}:
+        events.notify(customer_id)
+
+    return results
+
+def _transition_or_conflict(rows: List[Row]) -> Dict[int, Result]:
+
+    """
+        This method change the status of the loans of the current shard, the loans of a shard
+        that keep changing after all the retries are returned with an error, like the invalid rows,
+        the other shards commit their loans
+
+        :param rows: Valid rows of the request, the loans of other shards are ignored
+        :type rows: list
+
+        :return: Result by index of the loans of the shard
+        :rtype: dict
+    """
+
+    try:
+        return _transition_in_shard(rows)
+    except ConcurrentUpdateError as error:
+        found: set = set(Loans.objects.filter(id__in=[data["id"] for _, data in rows]).values_list("id", flat=True))
+        return {
+            index: _error(index, "non_field_errors", str(error.detail))
+            for index, data in rows if data["id"] in found
+        }
+
+def transition_loans(rows: List[Any]) -> List[Result]:
+
+    """
+        This method move many loans to a new status with the rules
+        of the loans updated one by one, the loans are searched in all the shards
+        Every shard is a transaction, a shard in conflict does not undo the other shards
+
+        :param rows: Id, new status and optionally the version of every loan
+        :type rows: list
+
+        :return: Result of every row, in the order of the rows
+        :rtype: list
+    """
+
+    valid, results = _validate(rows, BulkStatusSerializer)
+
+    #A loan can only be moved once by request
+    seen: Dict[int, int] = {}
+    unique: List[Row] = []
+    for index, data in valid:
+        if data["id"] in seen:
+            results[index] = _error(index, "id", "The loan is repeated in the request")
+        else:
+            seen[data["id"]] = index
+            unique.append((index, data))
+
+    if unique:
+        for partial in sharding.fan_out(lambda alias: _transition_or_conflict(unique)):
+            results.update(partial)
+
+    for index, _ in unique:
+        results.setdefault(index, _error(index, "id", "The loan does not exist"))
+
+    return [results[index] for index in range(len(rows))]
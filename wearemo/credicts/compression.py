@@ -0,0 +1,184 @@
+import re
+import zlib
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional
+
+import brotli
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+#Encodings supported, in order of preference when the client accept them with the same weight
+ENCODINGS: tuple = ("br", "gzip")
+#Status of the responses that have no body to compress
+WITHOUT_BODY: tuple = (204, 206, 304)
+
+_ACCEPTED: re.Pattern = re.compile(r"^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+
+    """
+        This method choose the encoding of a response from the Accept-Encoding header,
+        the encoding with the highest weight, brotli before gzip with the same weight
+
+        :param accept_encoding: Value of the Accept-Encoding header
+        :type accept_encoding: str
+
+        :return: Encoding, None when the client does not accept any encoding
+        :rtype: str
+    """
+
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        match = _ACCEPTED.match(item)
+        if not match:
+            continue
+        try:
+            weights[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+
+    wildcard: float = weights.get("*", 0.0)
+    best: Optional[str] = None
+    for encoding in ENCODINGS:
+        weight: float = weights.get(encoding, wildcard)
+        if weight > 0 and (best is None or weight > weights.get(best, wildcard)):
+            best = encoding
+
+    return best
+
+class Compressor:
+
+    """
+        This class compress a stream with brotli or gzip,
+        flush return the data compressed so far so the client can read it
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding: str = encoding
+        if encoding == "br":
+            self.brotli = brotli.Compressor(mode=brotli.MODE_TEXT, quality=settings.CREDICTS_COMPRESSION_BROTLI_QUALITY)
+        else:
+            #31 write the gzip header and trailer
+            self.zlib = zlib.compressobj(settings.CREDICTS_COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.brotli.process(data) if self.encoding == "br" else self.zlib.compress(data)
+
+    def flush(self) -> bytes:
+        return self.brotli.flush() if self.encoding == "br" else self.zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.brotli.finish() if self.encoding == "br" else self.zlib.flush(zlib.Z_FINISH)
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor: Compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+def compress_stream(pieces: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+
+    """
+        This method compress the pieces of a streamed response
+        The compressed data is sent every CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES of content,
+        the small pieces of the streams are compressed together
+
+        :param pieces: Pieces of the response
+        :type pieces: Iterable
+        :param encoding: Encoding of the response
+        :type encoding: str
+
+        :return: Compressed pieces
+        :rtype: Iterator
+    """
+
+    compressor: Compressor = Compressor(encoding)
+    pending: int = 0
+    for piece in pieces:
+        output: bytes = compressor.compress(piece)
+        pending += len(piece)
+        if pending >= settings.CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES:
+            output += compressor.flush()
+            pending = 0
+        if output:
+            yield output
+
+    yield compressor.finish()
+
+async def compress_async_stream(pieces: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+
+    #Same as compress_stream, for the responses of the async views
+    compressor: Compressor = Compressor(encoding)
+    pending: int = 0
+    async for piece in pieces:
+        output: bytes = compressor.compress(piece)
+        pending += len(piece)
+        if pending >= settings.CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES:
+            output += compressor.flush()
+            pending = 0
+        if output:
+            yield output
+
+    yield compressor.finish()
+
+def compressible(response) -> bool:
+    content_type: str = response.get("Content-Type", "").split(";")[0].strip().lower()
+    return (
+        response.status_code not in WITHOUT_BODY
+        and not response.has_header("Content-Encoding")
+        and "no-transform" not in response.get("Cache-Control", "")
+        and content_type in settings.CREDICTS_COMPRESSION_TYPES
+    )
+
+class CompressionMiddleware:
+
+    """
+        This middleware compress the responses with brotli or gzip, as negotiated with Accept-Encoding
+        The responses smaller than CREDICTS_COMPRESSION_MIN_BYTES are sent as they are,
+        the streamed responses are compressed while they are sent
+
+        Only the types of CREDICTS_COMPRESSION_TYPES are compressed, the event streams are not
+        in the list: a compressor for every open stream cost memory and the events are small
+        The pages are not in the list either, the CSRF token of a compressed page can be read
+        from the size of the responses (BREACH)
+        The middleware is disabled with the CREDICTS_COMPRESSION setting
+    """
+
+    def __init__(self, get_response) -> None:
+        if not settings.CREDICTS_COMPRESSION:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        response = self.get_response(request)
+        if not compressible(response):
+            return response
+
+        #The caches must keep a response for every encoding
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding: Optional[str] = negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response["Content-Length"]
+        else:
+            if len(response.content) < settings.CREDICTS_COMPRESSION_MIN_BYTES:
+                return response
+            compressed: bytes = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        #The compressed body is not byte for byte the body of a strong ETag
+        etag: Optional[str] = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+
+        return response
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 
 class DocRejectedPaymentDataSerializer(serializers.Serializer):
@@ -5,13 +7,12 @@ class DocRejectedPaymentDataSerializer(serializers.Serializer):
 
 class DocPaymentDetailsSerializer(serializers.Serializer):
     loan: int = serializers.IntegerField(min_value=1)
-    amount: float = serializers.FloatField(min_value=0)
+    amount: Decimal = serializers.DecimalField(max_digits=20, decimal_places=10, min_value=0)
 
 class DocCreatePaymentDataSerializer(serializers.Serializer):
     customer: int = serializers.IntegerField(min_value=1)
-    total_amount: float = serializers.FloatField(min_value=0)
     external_id: str = serializers.CharField(max_length=60)
-    total_amount: float = serializers.FloatField(min_value=0)
+    total_amount: Decimal = serializers.DecimalField(max_digits=20, decimal_places=10, min_value=0)
     paymentdetails: list = serializers.ListField(
         child=DocPaymentDetailsSerializer()
     )
\ No newline at end of file
@@ -0,0 +1,344 @@
+import asyncio
+import itertools
+import json
+import logging
+import re
+import secrets
+import sqlite3
+import time
+from collections import defaultdict
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import services, sharding, sqlite_store
+from .models import Customers
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+#Feed of the customers whose balance changed, shared by all the processes
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    ticket TEXT PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+#Seconds that a change is kept in the feed
+RETENTION_SECONDS: int = 60
+#Changes recorded by the process between two prunes of the feed
+PRUNE_EVERY: int = 1000
+#Paths served by the event streams, the requests are cancelled when the client disconnects
+STREAM_PATH: re.Pattern = re.compile(r"^/api/customer/\d+/events/?$")
+
+_recorded: Iterator[int] = itertools.count(1)
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite_store.connect(settings.CREDICTS_EVENTS_DB, SCHEMA)
+
+def notify(customer_id: int) -> None:
+
+    """
+        This method publish a change of the balance of a customer
+        when the transaction of the current shard is committed
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+    """
+
+    if settings.CREDICTS_EVENTS:
+        transaction.on_commit(lambda: record(customer_id), using=sharding.current_shard())
+
+def record(customer_id: int) -> None:
+
+    """
+        This method save a change of the balance of a customer in the feed
+        The change was committed, an error of the feed is only logged
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+    """
+
+    try:
+        connection: sqlite3.Connection = _connect()
+        connection.execute(
+            "INSERT INTO changes (customer_id, created_at) VALUES (?, ?)",
+            (int(customer_id), time.time())
+        )
+        if next(_recorded) % PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM changes WHERE created_at < ?", (time.time() - RETENTION_SECONDS,))
+    except sqlite3.Error:
+        logger.warning("The change of the customer %s was not published", customer_id, exc_info=True)
+
+def last_change() -> int:
+    return _connect().execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+def changes_after(change_id: int) -> Tuple[int, Set[int]]:
+
+    """
+        This method return the customers changed after a change of the feed
+
+        :param change_id: Last change read
+        :type change_id: int
+
+        :return: Last change of the feed and the customers changed
+        :rtype: tuple
+    """
+
+    rows = _connect().execute(
+        "SELECT id, customer_id FROM changes WHERE id > ? ORDER BY id",
+        (change_id,)
+    ).fetchall()
+
+    return (rows[-1][0] if rows else change_id), {row[1] for row in rows}
+
+def balances(customer_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+
+    """
+        This method return the balance of some customers, read in the shard of every customer
+
+        :param customer_ids: Primary keys of the customers
+        :type customer_ids: Iterable
+
+        :return: Balance by customer, the customers that do not exist are omitted
+        :rtype: dict
+    """
+
+    result: Dict[int, Dict[str, Any]] = {}
+    for customer_id in customer_ids:
+        with sharding.use_shard(sharding.shard_for_customer(customer_id)):
+            customer: Optional[Customers] = Customers.objects.filter(pk=customer_id).first()
+            if customer is not None:
+                result[customer_id] = {"customer": customer_id, **services.balance(customer)}
+
+    return result
+
+def issue_ticket(customer_id: int, user_id: int) -> str:
+
+    """
+        This method create a ticket that open the stream of a customer once,
+        for the clients that can not send the Authorization header, like EventSource
+        The ticket expires after CREDICTS_EVENTS_TICKET_SECONDS
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param user_id: Primary key of the user that asked the ticket
+        :type user_id: int
+
+        :return: Ticket
+        :rtype: str
+    """
+
+    ticket: str = secrets.token_urlsafe(32)
+    now: float = time.time()
+
+    connection: sqlite3.Connection = _connect()
+    connection.execute("DELETE FROM tickets WHERE expires_at < ?", (now,))
+    connection.execute(
+        "INSERT INTO tickets (ticket, customer_id, user_id, expires_at) VALUES (?, ?, ?, ?)",
+        (ticket, int(customer_id), int(user_id), now + settings.CREDICTS_EVENTS_TICKET_SECONDS)
+    )
+
+    return ticket
+
+def redeem_ticket(ticket: str, customer_id: int) -> Optional[int]:
+
+    """
+        This method use a ticket of the stream of a customer, the ticket is deleted
+
+        :param ticket: Ticket
+        :type ticket: str
+        :param customer_id: Primary key of the customer of the stream
+        :type customer_id: int
+
+        :return: Primary key of the user of the ticket, None when the ticket is not valid
+        :rtype: int
+    """
+
+    connection: sqlite3.Connection = _connect()
+    #Lock the file for writing, only one request can use the ticket
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute(
+            "SELECT user_id FROM tickets WHERE ticket = ? AND customer_id = ? AND expires_at >= ?",
+            (ticket, int(customer_id), time.time())
+        ).fetchone()
+        connection.execute("DELETE FROM tickets WHERE ticket = ?", (ticket,))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    return row[0] if row else None
+
+def format_event(data: Dict[str, Any]) -> str:
+    return f"event: balance\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+class Subscription:
+
+    """
+        This class represent a client of the stream of a customer
+        Only the last balance is kept, a slow client skip the intermediate balances
+    """
+
+    def __init__(self, customer_id: int) -> None:
+        self.customer_id: int = customer_id
+        self.latest: Optional[Dict[str, Any]] = None
+        self.changed: asyncio.Event = asyncio.Event()
+
+    def push(self, data: Dict[str, Any]) -> None:
+        self.latest = data
+        self.changed.set()
+
+    async def next(self, timeout: float) -> Optional[Dict[str, Any]]:
+
+        """
+            This method wait for the next balance of the customer
+
+            :param timeout: Maximum seconds to wait
+            :type timeout: float
+
+            :return: Last balance, None when the timeout expires
+            :rtype: dict
+        """
+
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        self.changed.clear()
+        data, self.latest = self.latest, None
+
+        return data
+
+class Broker:
+
+    """
+        This class fan out the changes of the balances to the subscriptions of the process
+        One task poll the feed for all the subscriptions and read the balance once per change
+    """
+
+    def __init__(self) -> None:
+        self.subscriptions: Dict[int, Set[Subscription]] = defaultdict(set)
+        self.poller: Optional[asyncio.Task] = None
+
+    def subscribe(self, customer_id: int) -> Subscription:
+        subscription: Subscription = Subscription(customer_id)
+        self.subscriptions[customer_id].add(subscription)
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.poller is None or self.poller.done() or self.poller.get_loop() is not loop:
+            self.poller = loop.create_task(self.poll())
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions: Set[Subscription] = self.subscriptions.get(subscription.customer_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self.subscriptions.pop(subscription.customer_id, None)
+
+    def publish(self, customer_id: int, data: Dict[str, Any]) -> None:
+        for subscription in list(self.subscriptions.get(customer_id, [])):
+            subscription.push(data)
+
+    async def poll(self) -> None:
+
+        """
+            This method read the feed while the process has subscriptions
+        """
+
+        change_id: int = await sync_to_async(last_change)()
+        while self.subscriptions:
+            await asyncio.sleep(settings.CREDICTS_EVENTS_POLL_SECONDS)
+            try:
+                change_id, changed = await sync_to_async(changes_after)(change_id)
+                watched: Set[int] = changed & set(self.subscriptions)
+                if watched:
+                    for customer_id, data in (await sync_to_async(balances)(watched)).items():
+                        self.publish(customer_id, data)
+            except Exception:
+                logger.exception("The changes of the balances could not be read")
+
+#Broker of the process
+broker: Broker = Broker()
+
+async def stream(customer_id: int, initial: Dict[str, Any]):
+
+    """
+        This method generate the events of a customer: the current balance,
+        the new balances and a heartbeat when the balance does not change
+        The client is subscribed while the stream is consumed
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param initial: Balance when the client subscribed
+        :type initial: dict
+    """
+
+    subscription: Subscription = broker.subscribe(customer_id)
+    try:
+        yield format_event(initial)
+        while True:
+            data: Optional[Dict[str, Any]] = await subscription.next(settings.CREDICTS_EVENTS_HEARTBEAT_SECONDS)
+            yield format_event(data) if data is not None else ": heartbeat\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+def cancel_on_disconnect(application: Callable[..., Awaitable[None]]) -> Callable[..., Awaitable[None]]:
+
+    """
+        This ASGI middleware cancel the requests of the event streams when the client disconnects,
+        the streams never finish by themselves
+
+        :param application: ASGI application
+        :type application: Callable
+
+        :return: ASGI application
+        :rtype: Callable
+    """
+
+    async def wrapper(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+
+        if scope["type"] != "http" or not STREAM_PATH.match(scope["path"]):
+            return await application(scope, receive, send)
+
+        #The streams are GET requests, the body is read before the application starts
+        request: Dict[str, Any] = await receive()
+        messages: Iterator[Dict[str, Any]] = iter([request])
+
+        async def receive_request() -> Dict[str, Any]:
+            return next(messages, None) or await receive()
+
+        async def wait_disconnect() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        handler: asyncio.Task = asyncio.ensure_future(application(scope, receive_request, send))
+        disconnect: asyncio.Task = asyncio.ensure_future(
+            asyncio.sleep(0) if request["type"] == "http.disconnect" else wait_disconnect()
+        )
+        await asyncio.wait({handler, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+
+        if handler.done():
+            disconnect.cancel()
+            return handler.result()
+
+        handler.cancel()
+        with suppress(asyncio.CancelledError):
+            await handler
+
+    return wrapper
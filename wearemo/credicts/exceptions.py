@@ -0,0 +1,41 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ConcurrentUpdateError(APIException):
+
+    """
+        This exception is raised when a row was updated by another writer
+        between the read and the compare-and-swap update
+    """
+
+    status_code: int = status.HTTP_409_CONFLICT
+    default_detail: str = "The resource was updated by another request, retry with the new version"
+    default_code: str = "conflict"
+
+class PaymentError(Exception):
+
+    """
+        This exception is raised when a payment can not be applied or rejected
+    """
+
+    @property
+    def message(self) -> str:
+        return str(self)
+
+class LoanError(Exception):
+
+    """
+        This exception is raised when a loan can not be created or moved to a status
+    """
+
+    @property
+    def message(self) -> str:
+        return str(self)
+
+class LeaseLostError(Exception):
+
+    """
+        This exception is raised when a worker lost the lease of a job,
+        the job expired and was claimed by another worker
+    """
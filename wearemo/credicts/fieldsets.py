@@ -0,0 +1,233 @@
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+from django.conf import settings
+from django.db import models
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from .serializers import parse_fields
+
+#Requested fields and expanded relations of a request
+Fieldsets = Tuple[Optional[Dict[str, Dict]], Optional[Dict[str, Dict]]]
+
+
+def requested(request) -> Fieldsets:
+
+    """
+        This method return the fields and the relations requested with the query params
+        fields and expand, the writes always return all the fields
+
+        :param request: Request object
+        :type request: Request
+
+        :return: Tree of the fields and tree of the expanded relations, None when they are not sent
+        :rtype: tuple
+    """
+
+    if request.method not in SAFE_METHODS:
+        return None, None
+
+    return parse_fields(request.query_params.get("fields")), parse_fields(request.query_params.get("expand"))
+
+def shared(
+    request,
+    serializer_class: Type[serializers.ModelSerializer],
+    required: Optional[List[str]] = None
+) -> Optional[Dict[str, Dict]]:
+
+    """
+        This method return the requested fields that a serializer has,
+        the archived rows have the columns of the hot rows but not their relations
+
+        :param request: Request object
+        :type request: Request
+        :param serializer_class: Serializer of the rows
+        :type serializer_class: ModelSerializer
+        :param required: Fields included even when they are not requested
+        :type required: list
+
+        :return: Tree of the fields, None when the fields are not sent
+        :rtype: dict
+    """
+
+    fields, _ = requested(request)
+    if fields is None:
+        return None
+
+    return {name: {} for name in [*fields, *(required or [])] if name in serializer_class.Meta.fields}
+
+def _plan(
+    serializer: serializers.Serializer,
+    model: Type[models.Model],
+    prefix: str = ""
+) -> Tuple[Optional[Set[str]], List[str], List[models.Prefetch]]:
+
+    """
+        This method return the columns read by a serializer, the relations to join
+        and the relations to prefetch
+
+        :param serializer: Serializer of the rows
+        :type serializer: Serializer
+        :param model: Model of the rows
+        :type model: Model
+        :param prefix: Path of the model from the model of the queryset
+        :type prefix: str
+
+        :return: Columns, None when a field is not a column, joined relations and prefetches
+        :rtype: tuple
+    """
+
+    concrete: Dict[str, models.Field] = {field.name: field for field in model._meta.concrete_fields}
+    reverse: Dict[str, models.ForeignObjectRel] = {
+        relation.get_accessor_name(): relation for relation in model._meta.related_objects
+    }
+
+    columns: Optional[Set[str]] = {prefix + model._meta.pk.name}
+    joins: List[str] = []
+    prefetches: List[models.Prefetch] = []
+
+    for field in serializer.fields.values():
+        nested: serializers.Field = field.child if isinstance(field, serializers.ListSerializer) else field
+
+        if isinstance(nested, serializers.Serializer) and field.source in concrete:
+            #A foreign key is joined, its columns are read in the same query
+            joins.append(prefix + field.source)
+            if columns is not None:
+                columns.add(prefix + field.source)
+            related_columns, related_joins, related_prefetches = _plan(
+                nested, concrete[field.source].related_model, f"{prefix}{field.source}__"
+            )
+            columns = columns | related_columns if columns is not None and related_columns is not None else None
+            joins.extend(related_joins)
+            prefetches.extend(related_prefetches)
+
+        elif isinstance(nested, serializers.Serializer) and field.source in reverse:
+            #A reverse relation is read with one query for all the rows
+            relation: models.ForeignObjectRel = reverse[field.source]
+            related_columns, related_joins, related_prefetches = _plan(nested, relation.related_model)
+            if related_columns is not None:
+                #The prefetch match the rows with the foreign key
+                related_columns.add(relation.field.name)
+            prefetches.append(models.Prefetch(
+                prefix + field.source,
+                queryset=_apply(
+                    relation.related_model.objects.order_by("pk"), related_columns, related_joins, related_prefetches
+                )
+            ))
+
+        elif field.source in concrete and columns is not None:
+            columns.add(prefix + field.source)
+
+        else:
+            #The field is computed, all the columns are read
+            columns = None
+
+    return columns, joins, prefetches
+
+def _apply(
+    queryset: models.QuerySet,
+    columns: Optional[Set[str]],
+    joins: List[str],
+    prefetches: List[models.Prefetch]
+) -> models.QuerySet:
+
+    if joins:
+        queryset = queryset.select_related(*joins)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    if columns is not None:
+        queryset = queryset.only(*columns)
+
+    return queryset
+
+def optimize(queryset: models.QuerySet, serializer: serializers.Serializer) -> models.QuerySet:
+
+    """
+        This method narrow the columns of a queryset to the fields of a serializer,
+        join the expanded foreign keys and prefetch the expanded lists,
+        so the rows are serialized without a query per row
+
+        :param queryset: Queryset of the rows
+        :type queryset: QuerySet
+        :param serializer: Serializer of a row, with the requested fields
+        :type serializer: Serializer
+
+        :return: Optimized queryset
+        :rtype: QuerySet
+    """
+
+    return _apply(queryset, *_plan(serializer, queryset.model))
+
+def serializer_for(
+    serializer_class: Type[serializers.Serializer],
+    queryset: models.QuerySet,
+    request,
+    iterator: bool = False,
+    required: Optional[List[str]] = None,
+    **kwargs
+) -> serializers.ListSerializer:
+
+    """
+        This method return the serializer of a list of rows with the fields
+        and the relations requested, and its queryset optimized
+        With iterator, the rows are read in chunks, in PostgreSQL with a server-side cursor,
+        so the models of all the rows are not kept in memory with the serialized rows
+
+        :param serializer_class: Serializer of the rows
+        :type serializer_class: Serializer
+        :param queryset: Queryset of the rows
+        :type queryset: QuerySet
+        :param request: Request object
+        :type request: Request
+        :param iterator: Read the rows with an iterator
+        :type iterator: bool
+        :param required: Fields included even when they are not requested
+        :type required: list
+
+        :return: List serializer
+        :rtype: ListSerializer
+    """
+
+    fields, expand = requested(request)
+    if fields is not None and required:
+        fields = {**{name: {} for name in required}, **fields}
+    serializer: serializers.ListSerializer = serializer_class(queryset, many=True, fields=fields, expand=expand, **kwargs)
+    if fields is not None or expand is not None:
+        serializer.instance = optimize(queryset, serializer.child)
+    if iterator:
+        #The prefetches are read once per chunk
+        serializer.instance = serializer.instance.iterator(chunk_size=settings.CREDICTS_LIST_CHUNK_SIZE)
+
+    return serializer
+
+class SparseFieldsetsMixin:
+
+    """
+        This mixin serialize the rows of a viewset with the query params fields and expand
+        (?fields=id,score,loans.outstanding&expand=loans), the queryset read only the columns
+        of the requested fields and the expanded relations without a query per row
+    """
+
+    #Actions that return the rows with the serializer of the viewset
+    sparse_actions: List[str] = ["list", "retrieve", "external"]
+
+    def requested_fieldsets(self) -> Fieldsets:
+        if self.action not in self.sparse_actions:
+            return None, None
+        return requested(self.request)
+
+    def get_serializer(self, *args, **kwargs) -> serializers.Serializer:
+        fields, expand = self.requested_fieldsets()
+        kwargs.setdefault("fields", fields)
+        kwargs.setdefault("expand", expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def optimize_queryset(self, queryset: models.QuerySet) -> models.QuerySet:
+        fields, expand = self.requested_fieldsets()
+        if fields is None and expand is None:
+            return queryset
+
+        return optimize(queryset, self.get_serializer_class()(fields=fields, expand=expand))
+
+    def get_queryset(self) -> models.QuerySet:
+        return self.optimize_queryset(super().get_queryset())
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List
+
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+#Lookups allowed for the range filters, all of them can use a btree index
+RANGE_LOOKUPS: List[str] = ["gte", "gt", "lte", "lt"]
+
+
+class QueryParamsFilterMixin:
+
+    """
+        This mixin filter the list action of a viewset with the query params
+
+        Equality filters accept repeated values (?status=1&status=2)
+        Range filters use the django lookups (?score__gte=100&score__lt=500)
+        All the filtered fields must be backed by an index of the model
+    """
+
+    #Fields that can be filtered, with the serializer field that parse the value
+    filter_fields: Dict[str, serializers.Field] = {}
+    #Fields of filter_fields that can be filtered by range
+    range_fields: List[str] = []
+
+    def get_filters(self) -> Dict[str, Any]:
+
+        """
+            This method build the filters of the queryset from the query params
+
+            :return: Keyword arguments for the filter of the queryset
+            :rtype: dict
+        """
+
+        filters: Dict[str, Any] = {}
+        errors: Dict[str, List[str]] = {}
+
+        for name, field in self.filter_fields.items():
+
+            params: List[str] = [name]
+            if name in self.range_fields:
+                params.extend(f"{name}__{lookup}" for lookup in RANGE_LOOKUPS)
+
+            for param in params:
+                values: List[str] = self.request.query_params.getlist(param)
+                if not values:
+                    continue
+
+                try:
+                    parsed: List[Any] = [field.to_internal_value(value) for value in values]
+                except serializers.ValidationError as error:
+                    errors[param] = error.detail
+                    continue
+
+                if param == name and len(parsed) > 1:
+                    filters[f"{name}__in"] = parsed
+                else:
+                    filters[param] = parsed[-1]
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return filters
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+
+        """
+            This method apply the filters of the query params to the list action
+
+            :param queryset: Queryset of the viewset
+            :type queryset: QuerySet
+
+            :return: Filtered queryset
+            :rtype: QuerySet
+        """
+
+        queryset: QuerySet = super().filter_queryset(queryset)
+
+        #The detail actions use the query params for other purposes
+        if self.action != "list":
+            return queryset
+
+        return queryset.filter(**self.get_filters())
@@ -0,0 +1,107 @@
+from typing import Any, Dict, List
+
+from django.utils.dateparse import parse_date
+
+from . import accrual, archive, jobs, reconcile, services
+from .exceptions import PaymentError
+from .models import Job, Payment
+
+#Items processed between two reports of progress
+PROGRESS_EVERY: int = 100
+
+
+@jobs.register("reject_payments")
+def reject_payments(job: Job) -> Dict[str, Any]:
+
+    """
+        This method reject a list of payments
+        Payload: {"payments": [1, 2, 3]}
+
+        :param job: Job claimed
+        :type job: Job
+
+        :return: Payments rejected and the errors by payment
+        :rtype: dict
+    """
+
+    payments: List[int] = job.payload["payments"]
+    job.report_progress(0, len(payments))
+
+    rejected: int = 0
+    errors: Dict[str, str] = {}
+    for index, payment_pk in enumerate(payments, start=1):
+        try:
+            services.reject_payment(payment_pk)
+            rejected += 1
+        except Payment.DoesNotExist:
+            errors[str(payment_pk)] = "The payment does not exist"
+        except PaymentError as error:
+            errors[str(payment_pk)] = error.message
+
+        if index % PROGRESS_EVERY == 0:
+            job.report_progress(index)
+
+    return {
+        "rejected": rejected,
+        "errors": errors
+    }
+
+@jobs.register("reconcile")
+def reconcile_balances(job: Job) -> Dict[str, Any]:
+
+    """
+        This method verify the outstanding of the loans and the totals of the payments
+        Payload: {"repair": false, "chunk_size": 50000, "processes": 1}
+
+        :param job: Job claimed
+        :type job: Job
+
+        :return: Report of the discrepancies
+        :rtype: dict
+    """
+
+    return reconcile.reconcile(
+        repair=job.payload.get("repair", False),
+        chunk_size=job.payload.get("chunk_size", 50000),
+        processes=job.payload.get("processes", 1),
+        progress=job.report_progress
+    )
+
+@jobs.register("archive")
+def archive_history(job: Job) -> Dict[str, Any]:
+
+    """
+        This method move the old payments and the closed loans to the archive tables
+        Payload: {"older_than_days": 365, "delete": false}
+
+        :param job: Job claimed
+        :type job: Job
+
+        :return: Rows moved by shard and table
+        :rtype: dict
+    """
+
+    return archive.archive(
+        older_than_days=job.payload.get("older_than_days"),
+        delete=job.payload.get("delete", False),
+        chunk_size=job.payload.get("chunk_size")
+    )
+
+@jobs.register("accrue")
+def accrue_loans(job: Job) -> Dict[str, Any]:
+
+    """
+        This method add the interest and the late fees of a day to the active loans
+        Payload: {"day": "2024-05-01", "chunk_size": 10000}, today by default
+
+        :param job: Job claimed
+        :type job: Job
+
+        :return: Report of the run by shard
+        :rtype: dict
+    """
+
+    return accrual.accrue(
+        day=parse_date(job.payload["day"]) if job.payload.get("day") else None,
+        chunk_size=job.payload.get("chunk_size")
+    )
@@ -0,0 +1,265 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import connection, connections, models
+from django.utils import timezone
+
+from .exceptions import LeaseLostError
+from .models import Job
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+#Handlers of the jobs, by kind
+HANDLERS: Dict[str, Callable[[Job], Any]] = {}
+
+
+def register(kind: str) -> Callable:
+
+    """
+        This decorator register the handler of a kind of job
+        The handler receive the job and return a json serializable result
+
+        :param kind: Kind of the job
+        :type kind: str
+
+        :return: Decorator
+        :rtype: Callable
+    """
+
+    def decorator(handler: Callable[[Job], Any]) -> Callable[[Job], Any]:
+        HANDLERS[kind] = handler
+        return handler
+
+    return decorator
+
+def enqueue(kind: str, payload: Optional[Dict[str, Any]] = None) -> Job:
+
+    """
+        This method create a pending job
+
+        :param kind: Kind of the job
+        :type kind: str
+        :param payload: Arguments of the handler
+        :type payload: dict
+
+        :return: Job created
+        :rtype: Job
+    """
+
+    if kind not in HANDLERS:
+        raise ValueError(f"The kind of job {kind} does not exist")
+
+    return Job.objects.create(kind=kind, payload=payload or {})
+
+def claim(owner: str) -> Optional[Job]:
+
+    """
+        This method claim the oldest pending job, or a running job whose lease expired
+
+        :param owner: Name of the worker
+        :type owner: str
+
+        :return: Job claimed, None when there are not jobs
+        :rtype: Job
+    """
+
+    now = timezone.now()
+
+    #The jobs that expired too many times are not retried
+    Job.objects.filter(
+        status=2,
+        lease_expires_at__lt=now,
+        attempts__gte=models.F("max_attempts")
+    ).update(status=4, error="The lease expired too many times", finished_at=now, updated_at=now)
+
+    while True:
+        candidate: Optional[Dict[str, Any]] = Job.objects.filter(
+            models.Q(status=1) | models.Q(status=2, lease_expires_at__lt=now)
+        ).order_by("id").values("id", "status", "attempts").first()
+
+        if candidate is None:
+            return None
+
+        #Only one worker can move the job with this status and attempts
+        claimed: int = Job.objects.filter(**candidate).update(
+            status=2,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=settings.CREDICTS_JOB_LEASE_SECONDS),
+            attempts=models.F("attempts") + 1,
+            started_at=now,
+            updated_at=now
+        )
+
+        if claimed:
+            return Job.objects.get(pk=candidate["id"])
+
+def renew_lease(job: Job, stop: threading.Event) -> None:
+
+    """
+        This method extend the lease of a job every third of the lease until it is stopped,
+        so a handler that does not report progress keep the job while its worker is alive
+        The renewal stops when the job was claimed by another worker
+
+        :param job: Job claimed
+        :type job: Job
+        :param stop: Event set when the handler finish
+        :type stop: threading.Event
+    """
+
+    try:
+        while not stop.wait(settings.CREDICTS_JOB_LEASE_SECONDS / 3):
+            now = timezone.now()
+            renewed: int = Job.objects.filter(
+                pk=job.pk,
+                status=2,
+                lease_owner=job.lease_owner
+            ).update(
+                lease_expires_at=now + timedelta(seconds=settings.CREDICTS_JOB_LEASE_SECONDS),
+                updated_at=now
+            )
+            if not renewed:
+                break
+    except Exception:
+        logger.exception("The lease of the job %s was not renewed", job.pk)
+    finally:
+        #The thread has its own connection
+        connection.close()
+
+def run(job: Job) -> Job:
+
+    """
+        This method run the handler of a claimed job and save the result
+        The lease is renewed in a thread while the handler runs
+        When the handler fail the job is retried until the maximum of attempts
+
+        :param job: Job claimed
+        :type job: Job
+
+        :return: Job finished
+        :rtype: Job
+    """
+
+    stop: threading.Event = threading.Event()
+    renewal: threading.Thread = threading.Thread(target=renew_lease, args=(job, stop), daemon=True)
+    renewal.start()
+
+    values: Dict[str, Any] = {}
+    try:
+        result: Any = HANDLERS[job.kind](job)
+        values = {"status": 3, "result": result, "error": None, "progress": job.total or job.progress}
+    except LeaseLostError:
+        logger.warning("The job %s was claimed by another worker", job.pk)
+        return job
+    except Exception:
+        logger.exception("The job %s failed", job.pk)
+        values = {
+            "status": 1 if job.attempts < job.max_attempts else 4,
+            "error": traceback.format_exc(),
+        }
+    finally:
+        stop.set()
+        renewal.join()
+
+    now = timezone.now()
+    if values["status"] != 1:
+        values["finished_at"] = now
+
+    Job.objects.filter(pk=job.pk, lease_owner=job.lease_owner).update(
+        lease_owner=None,
+        lease_expires_at=None,
+        updated_at=now,
+        **values
+    )
+    job.refresh_from_db()
+
+    return job
+
+def work(owner: str, once: bool = False, stop: Optional[threading.Event] = None) -> int:
+
+    """
+        This method claim and run jobs until it is stopped
+
+        :param owner: Name of the worker
+        :type owner: str
+        :param once: Exit when there are not more jobs
+        :type once: bool
+        :param stop: Event that stop the worker
+        :type stop: threading.Event
+
+        :return: Number of jobs processed
+        :rtype: int
+    """
+
+    stop: threading.Event = stop or threading.Event()
+    processed: int = 0
+
+    while not stop.is_set():
+        job: Optional[Job] = claim(owner)
+        if job is None:
+            if once:
+                break
+            stop.wait(settings.CREDICTS_JOB_POLL_SECONDS)
+            continue
+
+        run(job)
+        processed += 1
+
+    return processed
+
+def _worker_main(owner: str, once: bool, stop: Optional[threading.Event] = None) -> None:
+    try:
+        work(owner, once=once, stop=stop)
+    finally:
+        #Every thread and process has its own connection
+        connection.close()
+
+def run_workers(concurrency: int, mode: str = "thread", once: bool = False, stop: Optional[threading.Event] = None) -> None:
+
+    """
+        This method run a pool of workers, with threads or processes
+
+        :param concurrency: Number of workers
+        :type concurrency: int
+        :param mode: thread or process
+        :type mode: str
+        :param once: Exit when there are not more jobs
+        :type once: bool
+        :param stop: Event that stop the thread workers
+        :type stop: threading.Event
+    """
+
+    prefix: str = f"{socket.gethostname()}:{os.getpid()}"
+    stop: threading.Event = stop or threading.Event()
+
+    if mode == "process":
+        #The connections of the parent can not be shared with the children
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=_worker_main, args=(f"{prefix}:{index}", once), daemon=True)
+            for index in range(concurrency)
+        ]
+    else:
+        workers = [
+            threading.Thread(target=_worker_main, args=(f"{prefix}:{index}", once, stop), daemon=True)
+            for index in range(concurrency)
+        ]
+
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        #The running jobs are finished, the pending ones stay in the queue
+        stop.set()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from credicts import accrual
+
+
+class Command(BaseCommand):
+
+    help: str = "Add the interest and the late fees of a day to the active loans of all the shards"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--day", help="Day of the accrual (YYYY-MM-DD), today by default")
+        parser.add_argument("--chunk-size", type=int, help="Loans of every transaction, CREDICTS_ACCRUAL_CHUNK_SIZE by default")
+
+    def handle(self, *args, **options) -> None:
+
+        day = None
+        if options["day"]:
+            day = parse_date(options["day"])
+            if day is None:
+                raise CommandError("The day must have the format YYYY-MM-DD")
+
+        report = accrual.accrue(day=day, chunk_size=options["chunk_size"])
+
+        self.stdout.write(json.dumps(report, indent=4))
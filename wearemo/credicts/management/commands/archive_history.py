@@ -0,0 +1,35 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from credicts import archive
+
+
+class Command(BaseCommand):
+
+    help: str = "Move the old payments and the closed loans of all the shards to the archive tables"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--older-than-days", type=int, help="Age of the rows, CREDICTS_ARCHIVE_AFTER_DAYS by default")
+        parser.add_argument("--delete", action="store_true", help="Delete the rows without archiving them")
+        parser.add_argument("--chunk-size", type=int, help="Rows of every transaction")
+        parser.add_argument("--every", type=float, help="Run the archive again every these seconds, until it is stopped")
+
+    def handle(self, *args, **options) -> None:
+
+        while True:
+            moved = archive.archive(
+                older_than_days=options["older_than_days"],
+                delete=options["delete"],
+                chunk_size=options["chunk_size"]
+            )
+            self.stdout.write(json.dumps(moved, indent=4))
+
+            if not options["every"]:
+                break
+
+            try:
+                time.sleep(options["every"])
+            except KeyboardInterrupt:
+                break
@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from credicts import rollups
+
+
+class Command(BaseCommand):
+
+    help: str = "Rebuild the monthly payment summaries of all the customers from their payments"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Customers rebuilt in every transaction")
+
+    def handle(self, *args, **options) -> None:
+
+        report = rollups.backfill(chunk_size=options["chunk_size"])
+
+        self.stdout.write(json.dumps(report, indent=4))
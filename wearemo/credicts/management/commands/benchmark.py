@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from credicts.benchmarks import SCENARIOS, isolated_databases
+
+
+class Command(BaseCommand):
+
+    help: str = "Run a benchmark of the credicts app in temporary databases"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("scenario", choices=sorted(SCENARIOS))
+        parser.add_argument("--count", type=int, default=1000, help="Operations of the benchmark")
+        parser.add_argument("--batch-size", type=int, default=200, help="Payments of a batch of the payment pipeline")
+        parser.add_argument("--workers", default="1,2,4,8", help="Numbers of processes of the workers benchmark, separated by commas")
+
+    def handle(self, *args, **options) -> None:
+
+        with isolated_databases():
+            result = SCENARIOS[options["scenario"]](**options)
+
+        self.stdout.write(json.dumps(result, indent=4))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from credicts import scores
+
+
+class Command(BaseCommand):
+
+    help: str = "Update the scores of the customers from a file of the risk model (external_id, score, preapproved_at)"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("path", help="CSV file of the risk model")
+        parser.add_argument("--all", action="store_true", help="Include all the lines in the report")
+        parser.add_argument("--dry-run", action="store_true", help="Compare the scores without updating the customers")
+
+    def handle(self, *args, **options) -> None:
+
+        with open(options["path"], encoding="utf-8-sig", newline="") as file:
+            for line in scores.report(file, include_all=options["all"], dry_run=options["dry_run"]):
+                self.stdout.write(line, ending="")
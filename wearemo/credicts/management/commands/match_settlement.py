@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from credicts import settlement
+
+
+class Command(BaseCommand):
+
+    help: str = "Match a settlement file of the bank (external_id, amount, date) against the payments"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("path", help="CSV file of the bank")
+        parser.add_argument("--all", action="store_true", help="Include the matched lines in the diff")
+
+    def handle(self, *args, **options) -> None:
+
+        with open(options["path"], encoding="utf-8-sig", newline="") as file:
+            for line in settlement.diff(file, include_matched=options["all"]):
+                self.stdout.write(line, ending="")
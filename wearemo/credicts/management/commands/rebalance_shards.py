@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from credicts import rebalance, sharding
+from credicts.models import Customers
+
+
+class Command(BaseCommand):
+
+    help: str = "Move customers, with all their loans and payments, between the shards"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--customer", type=int, help="Customer to move")
+        parser.add_argument("--to", dest="target", help="Alias of the target shard")
+        parser.add_argument(
+            "--auto",
+            action="store_true",
+            help="Move customers until all the shards have the same number of customers"
+        )
+        parser.add_argument("--max-moves", type=int, default=1000, help="Maximum customers moved with --auto")
+
+    def handle(self, *args, **options) -> None:
+
+        if options["auto"]:
+            moves = rebalance.balance(options["max_moves"])
+            for customer_id, source, target in moves:
+                self.stdout.write(f"Customer {customer_id}: {source} -> {target}")
+            self.stdout.write(f"{len(moves)} customers moved")
+            return
+
+        if not options["customer"] or not options["target"]:
+            raise CommandError("Use --customer and --to, or --auto")
+
+        source: str = sharding.shard_for_customer(options["customer"])
+        try:
+            copied = rebalance.move_customer(options["customer"], options["target"])
+        except (ValueError, Customers.DoesNotExist) as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(f"Customer {options['customer']}: {source} -> {options['target']} {copied}")
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from credicts import reconcile
+
+
+class Command(BaseCommand):
+
+    help: str = "Verify the outstanding of the loans and the totals of the payments and the customers of all the shards"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--repair", action="store_true", help="Fix the outstanding and the status of the loans")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Rows of every range of ids")
+        parser.add_argument("--processes", type=int, default=1, help="Processes that check the ranges in parallel")
+
+    def handle(self, *args, **options) -> None:
+
+        report = reconcile.reconcile(
+            repair=options["repair"],
+            chunk_size=options["chunk_size"],
+            processes=options["processes"]
+        )
+
+        self.stdout.write(json.dumps(report, indent=4))
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from credicts import pipeline
+
+
+class Command(BaseCommand):
+
+    help: str = "Apply the payments queued by the payment pipeline in micro-batches, run only one writer"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.CREDICTS_PAYMENT_BATCH_SIZE,
+            help="Maximum payments applied in a transaction"
+        )
+        parser.add_argument(
+            "--max-delay-ms",
+            type=int,
+            default=settings.CREDICTS_PAYMENT_BATCH_DELAY_MS,
+            help="Maximum milliseconds that a payment wait for its batch"
+        )
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options) -> None:
+
+        self.stdout.write(
+            f"Applying payments in batches of {options['batch_size']} or every {options['max_delay_ms']} ms"
+        )
+
+        try:
+            processed: int = pipeline.run_writer(
+                batch_size=options["batch_size"],
+                max_delay=options["max_delay_ms"] / 1000,
+                once=options["once"]
+            )
+        except KeyboardInterrupt:
+            return
+
+        self.stdout.write(f"{processed} payments processed")
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from credicts import jobs
+
+
+class Command(BaseCommand):
+
+    help: str = "Process the background jobs of the credicts app"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.CREDICTS_JOB_CONCURRENCY,
+            help="Number of jobs processed at the same time"
+        )
+        parser.add_argument(
+            "--mode",
+            choices=["thread", "process"],
+            default="thread",
+            help="Run the workers in threads or in processes"
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are not more pending jobs"
+        )
+
+    def handle(self, *args, **options) -> None:
+
+        self.stdout.write(
+            f"Processing jobs with {options['concurrency']} {options['mode']} workers"
+        )
+
+        jobs.run_workers(
+            concurrency=options["concurrency"],
+            mode=options["mode"],
+            once=options["once"]
+        )
@@ -0,0 +1,43 @@
+import json
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from credicts import slow_queries
+
+
+class Command(BaseCommand):
+
+    help: str = "Rank the slow queries of the log by their total time, grouped by normalized SQL"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--hours", type=float, help="Only the queries of the last hours")
+        parser.add_argument("--limit", type=int, default=20, help="Groups of queries shown")
+        parser.add_argument("--json", action="store_true", help="Write the groups as JSON")
+        parser.add_argument("--clear", action="store_true", help="Delete the log")
+
+    def handle(self, *args, **options) -> None:
+
+        if options["clear"]:
+            self.stdout.write(f"{slow_queries.clear()} slow queries deleted")
+            return
+
+        since = time.time() - options["hours"] * 3600 if options["hours"] else None
+        groups = slow_queries.ranking(since=since, limit=options["limit"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(groups, indent=4))
+            return
+
+        for rank, group in enumerate(groups, start=1):
+            slowest = group["slowest"]
+            self.stdout.write(
+                f"#{rank} total {group['total_ms']:.1f} ms, {group['count']} queries, "
+                f"mean {group['mean_ms']:.1f} ms, max {group['max_ms']:.1f} ms, "
+                f"last {datetime.fromtimestamp(group['last_at']).isoformat(timespec='seconds')}"
+            )
+            self.stdout.write(f"    {group['fingerprint']}")
+            self.stdout.write(f"    slowest in {slowest['view'] or '-'} at {slowest['frame'] or '-'}")
+            for line in slowest["plan"]:
+                self.stdout.write(f"        {line}")
@@ -0,0 +1,171 @@
+import hmac
+import os
+import threading
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, List
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, transaction
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import sharding
+
+#Label of the requests that do not match a route
+UNMATCHED: str = "unmatched"
+#Buckets of the queries of a request
+QUERY_BUCKETS: List[float] = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+#The values are written in memory, or in the files of PROMETHEUS_MULTIPROC_DIR
+#when it is defined, so the metrics of all the workers are aggregated
+REQUEST_SECONDS: Histogram = Histogram(
+    "credicts_request_duration_seconds",
+    "Time to build the response of a request",
+    ["route", "method", "status"]
+)
+DB_QUERIES: Histogram = Histogram(
+    "credicts_db_queries_per_request",
+    "Queries of a request in all the databases",
+    ["route"],
+    buckets=QUERY_BUCKETS
+)
+DB_SECONDS: Histogram = Histogram(
+    "credicts_db_query_duration_seconds",
+    "Aggregate time of the queries of a request",
+    ["route"]
+)
+PAYMENTS_CREATED: Counter = Counter("credicts_payments_created", "Payments applied to the loans")
+PAYMENTS_REJECTED: Counter = Counter("credicts_payments_rejected", "Payments rejected")
+LOANS_PAID: Counter = Counter("credicts_loans_paid", "Loans paid off by a payment")
+
+
+def count_on_commit(counter: Counter, amount: int = 1) -> None:
+
+    """
+        This method increment a counter when the transaction of the current shard
+        is committed, the attempts rolled back by a retry are not counted
+
+        :param counter: Counter to increment
+        :type counter: Counter
+        :param amount: Amount of the increment
+        :type amount: int
+    """
+
+    if amount:
+        transaction.on_commit(lambda: counter.inc(amount), using=sharding.current_shard())
+
+class QueryTimer:
+
+    """
+        This class measure the queries executed by a request,
+        it is installed in the connections of the thread of the request
+        and in the threads of sharding.fan_out
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.seconds: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Any) -> Any:
+        started_at: float = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.count += 1
+                self.seconds += time.perf_counter() - started_at
+
+def route(request) -> str:
+    #The name of the route keep the labels bounded, the ids of the urls are not labels
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match and match.view_name else UNMATCHED
+
+class MetricsMiddleware:
+
+    """
+        This middleware observe the latency of every request by route, method and status,
+        and the number and the aggregate time of its queries
+        The histograms are observed once per request, the queries only increment two numbers
+
+        The streamed responses are measured until their first byte
+        The middleware is disabled with the CREDICTS_METRICS setting
+    """
+
+    def __init__(self, get_response) -> None:
+        if not settings.CREDICTS_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        timer: QueryTimer = QueryTimer()
+        started_at: float = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+
+        name: str = route(request)
+        REQUEST_SECONDS.labels(name, request.method, str(response.status_code)).observe(time.perf_counter() - started_at)
+        DB_QUERIES.labels(name).observe(timer.count)
+        DB_SECONDS.labels(name).observe(timer.seconds)
+
+        return response
+
+def registry() -> CollectorRegistry:
+
+    """
+        This method return the registry of the metrics, in multiprocess mode
+        a new registry that read the files of all the workers
+
+        :return: Registry
+        :rtype: CollectorRegistry
+    """
+
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+
+    collected: CollectorRegistry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+def allowed(request) -> bool:
+
+    """
+        This method check that the request can read the metrics: Prometheus send the token
+        of CREDICTS_METRICS_TOKEN in the header Authorization: Bearer <token>,
+        and the staff users can read them with their token of the API
+
+        :param request: Request
+        :type request: HttpRequest
+
+        :return: If the metrics can be returned
+        :rtype: bool
+    """
+
+    token: str = settings.CREDICTS_METRICS_TOKEN
+    if token and hmac.compare_digest(request.META.get("HTTP_AUTHORIZATION", "").encode(), f"Bearer {token}".encode()):
+        return True
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+def metrics_view(request) -> HttpResponse:
+
+    """
+        This method return the metrics in the Prometheus text format
+    """
+
+    if not allowed(request):
+        return HttpResponseForbidden()
+
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
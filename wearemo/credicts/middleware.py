@@ -0,0 +1,122 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+
+from . import sqlite_store
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS pending_writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+"""
+
+
+class LoadSheddingMiddleware:
+
+    """
+        This middleware reject the write requests when the workers already have
+        too many writes in progress, instead of queueing them behind the database lock
+
+        The writes in progress are counted in a local SQLite file shared by all the workers,
+        a write left by a worker that stopped is released after CREDICTS_LOAD_SHEDDING_SLOT_SECONDS
+        The streamed responses keep their slot until the content is sent
+        The limit is configured in the CREDICTS_MAX_PENDING_WRITES setting, 0 disable it
+    """
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if request.method in SAFE_METHODS or not settings.CREDICTS_MAX_PENDING_WRITES:
+            return self.get_response(request)
+
+        try:
+            slot: Optional[int] = self.acquire(settings.CREDICTS_MAX_PENDING_WRITES)
+        except sqlite3.Error:
+            #The load shedding must not take down the api, the request is allowed
+            logger.exception("The load shedding store is not available")
+            return self.get_response(request)
+
+        if slot is None:
+            response: JsonResponse = JsonResponse(
+                {
+                    "message": "The server is overloaded, retry later"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response["Retry-After"] = str(settings.CREDICTS_LOAD_SHEDDING_RETRY_AFTER)
+            return response
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(slot)
+            raise
+
+        if response.streaming:
+            #The streamed writes (settlements, scores) work while the content is sent,
+            #the slot is released when the server close the response
+            response._resource_closers.append(lambda: self.release(slot))
+        else:
+            self.release(slot)
+
+        return response
+
+    def acquire(self, limit: int) -> Optional[int]:
+
+        """
+            This method count the writes in progress of all the workers and save a new one,
+            in a single transaction
+
+            :param limit: Maximum writes in progress
+            :type limit: int
+
+            :return: Id of the write, None when there are too many writes in progress
+            :rtype: int
+        """
+
+        connection: sqlite3.Connection = sqlite_store.connect(settings.CREDICTS_LOAD_SHEDDING_DB, SCHEMA)
+
+        now: float = time.time()
+        #Lock the file for writing, the count and the insert are atomic between workers
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "DELETE FROM pending_writes WHERE started_at < ?",
+                (now - settings.CREDICTS_LOAD_SHEDDING_SLOT_SECONDS,)
+            )
+            pending: int = connection.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+            slot: Optional[int] = None
+            if pending < limit:
+                slot = connection.execute(
+                    "INSERT INTO pending_writes (pid, started_at) VALUES (?, ?)", (os.getpid(), now)
+                ).lastrowid
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return slot
+
+    def release(self, slot: int) -> None:
+
+        try:
+            sqlite_store.connect(settings.CREDICTS_LOAD_SHEDDING_DB, SCHEMA).execute(
+                "DELETE FROM pending_writes WHERE id = ?", (slot,)
+            )
+        except sqlite3.Error:
+            #The write is released when its slot expires
+            logger.exception("The load shedding store is not available")
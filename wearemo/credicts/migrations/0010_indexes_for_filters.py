@@ -0,0 +1,53 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0009_alter_payment_paid_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customers',
+            index=models.Index(fields=['status'], name='customers_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customers',
+            index=models.Index(fields=['score'], name='customers_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customers',
+            index=models.Index(fields=['created_at'], name='customers_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['customer', 'status'], name='loans_customer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['status'], name='loans_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['external_id'], name='loans_external_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['created_at'], name='loans_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['taken_at'], name='loans_taken_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['maximum_payment_date'], name='loans_max_payment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['external_id'], name='payment_external_id_idx'),
+        ),
+    ]
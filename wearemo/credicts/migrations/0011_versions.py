@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0010_indexes_for_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customers',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loans',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0012_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerPlacement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer_id', models.BigIntegerField(unique=True)),
+                ('shard', models.CharField(max_length=30)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0013_customer_placement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.BigIntegerField(unique=True)),
+                ('payment_id', models.BigIntegerField()),
+            ],
+        ),
+    ]
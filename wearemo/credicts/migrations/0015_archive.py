@@ -0,0 +1,66 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0014_applied_submission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPaymentDetail',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('loan_id', models.BigIntegerField()),
+                ('payment_id', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['loan_id'], name='archiveddetail_loan_idx'), models.Index(fields=['payment_id'], name='archiveddetail_payment_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('external_id', models.CharField(max_length=60)),
+                ('total_amount', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('status', models.SmallIntegerField(choices=[(0, 'Completed'), (1, 'Rejected')])),
+                ('paid_at', models.DateTimeField()),
+                ('customer_id', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer_id'], name='archivedpayment_customer_idx'), models.Index(fields=['external_id'], name='archivedpayment_external_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('external_id', models.CharField(max_length=60)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('contract_version', models.CharField(blank=True, max_length=30, null=True)),
+                ('status', models.SmallIntegerField(choices=[(1, 'Pending'), (2, 'Active'), (3, 'Rejected'), (4, 'Paid')])),
+                ('maximum_payment_date', models.DateTimeField(blank=True, null=True)),
+                ('taken_at', models.DateTimeField(blank=True, null=True)),
+                ('outstanding', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('customer_id', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer_id'], name='archivedloan_customer_idx')],
+            },
+        ),
+    ]
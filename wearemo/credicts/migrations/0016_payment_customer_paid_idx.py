@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0015_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'paid_at'], name='payment_customer_paid_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.2 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0016_payment_customer_paid_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer_id', models.BigIntegerField()),
+                ('month', models.DateField()),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=10, default=0, max_digits=24)),
+                ('rejected', models.PositiveIntegerField(default=0)),
+                ('rejected_amount', models.DecimalField(decimal_places=10, default=0, max_digits=24)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentmonthlysummary',
+            constraint=models.UniqueConstraint(fields=('customer_id', 'month'), name='paymentsummary_customer_month_uniq'),
+        ),
+    ]
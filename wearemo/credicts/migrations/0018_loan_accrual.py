@@ -0,0 +1,49 @@
+# Generated by Django 4.2.2 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('credicts', '0017_payment_monthly_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccrualRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('day', models.DateField(unique=True)),
+                ('status', models.SmallIntegerField(choices=[(1, 'Running'), (2, 'Completed')], default=1)),
+                ('config', models.JSONField(default=dict)),
+                ('report', models.JSONField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanAdjustment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loan_id', models.BigIntegerField()),
+                ('customer_id', models.BigIntegerField()),
+                ('run_id', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('kind', models.SmallIntegerField(choices=[(1, 'Interest'), (2, 'Late interest'), (3, 'Late fee')])),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['loan_id', 'kind'], name='adjustment_loan_kind_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='loanadjustment',
+            constraint=models.UniqueConstraint(fields=('day', 'loan_id', 'kind'), name='adjustment_day_loan_kind_uniq'),
+        ),
+    ]
@@ -1,7 +1,12 @@
-from typing import List, Tuple
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
+from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+from .exceptions import ConcurrentUpdateError, LeaseLostError
 
 
 class BaseModel(models.Model):
@@ -15,7 +20,46 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
-class Customers(BaseModel):
+class VersionedModel(BaseModel):
+
+    """
+        This model add a version to detect concurrent updates
+        The updates are made with a compare-and-swap over the version
+    """
+
+    #Version of the row, incremented in every update
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def cas_save(self, update_fields: List[str]) -> None:
+
+        """
+            This method save only the given fields when the version of the row
+            is the same that was read, and increment the version
+
+            :param update_fields: Fields to update
+            :type update_fields: list
+
+            :raises ConcurrentUpdateError: When the row was updated by another writer
+        """
+
+        self.updated_at = timezone.now()
+        values: Dict[str, Any] = {field: getattr(self, field) for field in update_fields}
+        values["updated_at"] = self.updated_at
+
+        updated: int = type(self)._default_manager.filter(
+            pk=self.pk,
+            version=self.version
+        ).update(version=models.F("version") + 1, **values)
+
+        if not updated:
+            raise ConcurrentUpdateError()
+
+        self.version += 1
+
+class Customers(VersionedModel):
 
     """
         This model represent the information of the customers
@@ -47,7 +91,14 @@ class Customers(BaseModel):
         blank=True
     )
 
-class Loans(BaseModel):
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["status"], name="customers_status_idx"),
+            models.Index(fields=["score"], name="customers_score_idx"),
+            models.Index(fields=["created_at"], name="customers_created_at_idx"),
+        ]
+
+class Loans(VersionedModel):
 
     """
         This model represent all the credict that have been approved for a customer
@@ -90,6 +141,16 @@ class Loans(BaseModel):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["customer", "status"], name="loans_customer_status_idx"),
+            models.Index(fields=["status"], name="loans_status_idx"),
+            models.Index(fields=["external_id"], name="loans_external_id_idx"),
+            models.Index(fields=["created_at"], name="loans_created_at_idx"),
+            models.Index(fields=["taken_at"], name="loans_taken_at_idx"),
+            models.Index(fields=["maximum_payment_date"], name="loans_max_payment_date_idx"),
+        ]
+
 class Payment(BaseModel):
 
     """
@@ -121,6 +182,13 @@ class Payment(BaseModel):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["external_id"], name="payment_external_id_idx"),
+            #Payments of a customer in a range of days, used by the statements
+            models.Index(fields=["customer", "paid_at"], name="payment_customer_paid_idx"),
+        ]
+
 class PaymentDetails(BaseModel):
 
     """
@@ -142,4 +210,255 @@ class PaymentDetails(BaseModel):
     payment = models.ForeignKey(
         Payment,
         on_delete=models.CASCADE
-    )
\ No newline at end of file
+    )
+
+class Job(BaseModel):
+
+    """
+        This model represent a background job, processed by the run_worker command
+        A worker claim a job with a lease, if the worker dies the lease expires
+        and another worker claim the job again
+    """
+
+    STATUS_JOB_CHOICES: List[Tuple[int, str]] = [
+        (1, 'Pending'),
+        (2, 'Running'),
+        (3, 'Completed'),
+        (4, 'Failed'),
+    ]
+
+    #Name of the handler that process the job
+    kind = models.CharField(max_length=60)
+    #Arguments of the handler
+    payload = models.JSONField(default=dict, blank=True)
+    #Status of the job
+    status = models.SmallIntegerField(
+        choices=STATUS_JOB_CHOICES,
+        default=STATUS_JOB_CHOICES[0][0]
+    )
+    #Items processed and total items of the job
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    #Result returned by the handler
+    result = models.JSONField(null=True, blank=True)
+    #Error of the last attempt
+    error = models.TextField(null=True, blank=True)
+    #Number of times that the job was claimed
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    #Worker that is processing the job and until when
+    lease_owner = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["status", "id"], name="job_status_idx"),
+        ]
+
+    def report_progress(self, progress: int, total: Optional[int] = None) -> None:
+
+        """
+            This method save the progress of the job and extend the lease of the worker
+
+            :param progress: Items processed
+            :type progress: int
+            :param total: Total items of the job
+            :type total: int
+
+            :raises LeaseLostError: When the job was claimed by another worker
+        """
+
+        self.progress = progress
+        self.total = total if total is not None else self.total
+        self.lease_expires_at = timezone.now() + timedelta(seconds=settings.CREDICTS_JOB_LEASE_SECONDS)
+
+        updated: int = Job.objects.filter(
+            pk=self.pk,
+            status=2,
+            lease_owner=self.lease_owner
+        ).update(
+            progress=self.progress,
+            total=self.total,
+            lease_expires_at=self.lease_expires_at,
+            updated_at=timezone.now()
+        )
+
+        if not updated:
+            raise LeaseLostError()
+
+class CustomerPlacement(BaseModel):
+
+    """
+        This model represent the shard of a customer moved by the rebalance,
+        the customers without placement live in the shard where they were created
+    """
+
+    customer_id = models.BigIntegerField(unique=True)
+    #Alias of the database of the shard
+    shard = models.CharField(max_length=30)
+
+class AppliedSubmission(models.Model):
+
+    """
+        This model represent a payment submission applied by the payment writer,
+        saved in the same transaction that the payment to never apply a submission twice
+    """
+
+    #Id of the submission in the payment queue
+    submission_id = models.BigIntegerField(unique=True)
+    payment_id = models.BigIntegerField()
+
+class PaymentMonthlySummary(BaseModel):
+
+    """
+        This model represent the payments of a customer in a month, maintained with every
+        payment and rejection, the archived payments are still counted
+        The month is the month of the payment, a rejection is counted in the month of its payment
+    """
+
+    customer_id = models.BigIntegerField()
+    #First day of the month
+    month = models.DateField()
+    #Payments made in the month and their total amount, including the rejected payments
+    payments = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=24, decimal_places=10, default=0)
+    #Payments of the month that were rejected and their total amount
+    rejected = models.PositiveIntegerField(default=0)
+    rejected_amount = models.DecimalField(max_digits=24, decimal_places=10, default=0)
+
+    class Meta:
+        constraints: List[models.UniqueConstraint] = [
+            models.UniqueConstraint(fields=["customer_id", "month"], name="paymentsummary_customer_month_uniq"),
+        ]
+
+class AccrualRun(BaseModel):
+
+    """
+        This model represent the daily accrual of the interest and the late fees of the loans,
+        a run that was interrupted is resumed by the next run of the same day
+    """
+
+    STATUS_RUN_CHOICES: List[Tuple[int, str]] = [
+        (1, 'Running'),
+        (2, 'Completed'),
+    ]
+
+    #Day of the accrual, only one run by day
+    day = models.DateField(unique=True)
+    status = models.SmallIntegerField(
+        choices=STATUS_RUN_CHOICES,
+        default=STATUS_RUN_CHOICES[0][0]
+    )
+    #Rates used by the run, a resumed run use the rates of its start
+    config = models.JSONField(default=dict)
+    #Totals of the adjustments by shard
+    report = models.JSONField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+class LoanAdjustment(models.Model):
+
+    """
+        This model represent the journal of the amounts added to the outstanding of the loans
+        by the accrual, saved in the same transaction that the new outstanding
+        The rows keep the ids of the loan and the customer without foreign keys, they outlive the archive
+    """
+
+    KIND_ADJUSTMENT_CHOICES: List[Tuple[int, str]] = [
+        (1, 'Interest'),
+        (2, 'Late interest'),
+        (3, 'Late fee'),
+    ]
+
+    loan_id = models.BigIntegerField()
+    customer_id = models.BigIntegerField()
+    #Run of the default database that created the adjustment
+    run_id = models.BigIntegerField()
+    #Day of the accrual
+    day = models.DateField()
+    kind = models.SmallIntegerField(choices=KIND_ADJUSTMENT_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints: List[models.UniqueConstraint] = [
+            #A loan accrue once a day, the index also find where an interrupted run stopped
+            models.UniqueConstraint(fields=["day", "loan_id", "kind"], name="adjustment_day_loan_kind_uniq"),
+        ]
+        indexes: List[models.Index] = [
+            models.Index(fields=["loan_id", "kind"], name="adjustment_loan_kind_idx"),
+        ]
+
+class ArchivedLoan(models.Model):
+
+    """
+        This model represent a closed loan moved out of the loans table by the archive
+        The rows keep the id and the columns of the loan, without foreign keys
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    version = models.PositiveIntegerField(default=0)
+    external_id = models.CharField(max_length=60)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    contract_version = models.CharField(max_length=30, null=True, blank=True)
+    status = models.SmallIntegerField(choices=Loans.STATUS_LOAD_CHOICES)
+    maximum_payment_date = models.DateTimeField(null=True, blank=True)
+    taken_at = models.DateTimeField(null=True, blank=True)
+    outstanding = models.DecimalField(max_digits=12, decimal_places=2)
+    customer_id = models.BigIntegerField()
+    #Datetime that the row was archived
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["customer_id"], name="archivedloan_customer_idx"),
+        ]
+
+class ArchivedPayment(models.Model):
+
+    """
+        This model represent an old payment moved out of the payment table by the archive
+        The rows keep the id and the columns of the payment, without foreign keys
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    external_id = models.CharField(max_length=60)
+    total_amount = models.DecimalField(max_digits=20, decimal_places=10)
+    status = models.SmallIntegerField(choices=Payment.STATUS_PAYMENT_CHOICES)
+    paid_at = models.DateTimeField()
+    customer_id = models.BigIntegerField()
+    #Datetime that the row was archived
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["customer_id"], name="archivedpayment_customer_idx"),
+            models.Index(fields=["external_id"], name="archivedpayment_external_idx"),
+        ]
+
+class ArchivedPaymentDetail(models.Model):
+
+    """
+        This model represent the details of an archived payment
+        The rows keep the id and the columns of the detail, without foreign keys
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    amount = models.DecimalField(max_digits=20, decimal_places=10)
+    loan_id = models.BigIntegerField()
+    payment_id = models.BigIntegerField()
+    #Datetime that the row was archived
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes: List[models.Index] = [
+            models.Index(fields=["loan_id"], name="archiveddetail_loan_idx"),
+            models.Index(fields=["payment_id"], name="archiveddetail_payment_idx"),
+        ]
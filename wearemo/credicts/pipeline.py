@@ -0,0 +1,271 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import services, sharding, sqlite_store
+from .exceptions import ConcurrentUpdateError, PaymentError
+from .models import AppliedSubmission, Customers
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    payment_id INTEGER,
+    message TEXT,
+    created_at REAL NOT NULL,
+    applied_at REAL
+);
+CREATE INDEX IF NOT EXISTS submissions_status_idx ON submissions (status, id);
+"""
+
+#Fields of the request saved in the queue
+PAYMENT_FIELDS: List[str] = ["customer", "external_id", "total_amount", "paymentdetails"]
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite_store.connect(settings.CREDICTS_PAYMENT_QUEUE_DB, SCHEMA)
+
+def submit(data: Dict[str, Any]) -> int:
+
+    """
+        This method save a validated payment in the queue of the payment writer
+        The queue is a local SQLite file in WAL mode, the commit does not wait for a fsync
+
+        :param data: Data of the payment, as validated by the payment/add endpoint
+        :type data: dict
+
+        :return: Id of the submission
+        :rtype: int
+    """
+
+    #The amounts are saved as strings, without the rounding of a float
+    payload: str = json.dumps({field: data[field] for field in PAYMENT_FIELDS}, cls=DjangoJSONEncoder)
+    cursor: sqlite3.Cursor = _connect().execute(
+        "INSERT INTO submissions (payload, created_at) VALUES (?, ?)",
+        (payload, time.time())
+    )
+
+    return cursor.lastrowid
+
+def get_submission(submission_id: int) -> Optional[Dict[str, Any]]:
+
+    """
+        This method return the status of a submission
+
+        :param submission_id: Id of the submission
+        :type submission_id: int
+
+        :return: Status, payment created and message of the submission
+        :rtype: dict
+    """
+
+    row = _connect().execute(
+        "SELECT id, status, payment_id, message FROM submissions WHERE id = ?",
+        (submission_id,)
+    ).fetchone()
+
+    if row is None:
+        return None
+
+    return {
+        "id": row[0],
+        "status": row[1],
+        "payment": row[2],
+        "message": row[3],
+    }
+
+def pending_count() -> int:
+    return _connect().execute("SELECT COUNT(*) FROM submissions WHERE status = 'pending'").fetchone()[0]
+
+def claim_batch(size: int) -> List[Tuple[int, Dict[str, Any]]]:
+
+    """
+        This method mark the oldest pending submissions as applying
+
+        :param size: Maximum number of submissions
+        :type size: int
+
+        :return: Ids and data of the submissions
+        :rtype: list
+    """
+
+    connection: sqlite3.Connection = _connect()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute(
+            "SELECT id, payload FROM submissions WHERE status = 'pending' ORDER BY id LIMIT ?",
+            (size,)
+        ).fetchall()
+        connection.executemany(
+            "UPDATE submissions SET status = 'applying' WHERE id = ?",
+            [(row[0],) for row in rows]
+        )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    return [(row[0], json.loads(row[1])) for row in rows]
+
+def apply_batch(batch: List[Tuple[int, Dict[str, Any]]]) -> Dict[int, Tuple[str, Optional[int], Optional[str]]]:
+
+    """
+        This method apply a batch of submissions with one transaction per shard
+        Every submission runs in a savepoint, an invalid payment or an unexpected error
+        does not roll back the others
+
+        :param batch: Ids and data of the submissions
+        :type batch: list
+
+        :return: Status, payment created and message of every submission
+        :rtype: dict
+    """
+
+    by_shard: Dict[str, List[Tuple[int, Dict[str, Any]]]] = defaultdict(list)
+    for submission_id, data in batch:
+        by_shard[sharding.shard_for_customer(data["customer"])].append((submission_id, data))
+
+    results: Dict[int, Tuple[str, Optional[int], Optional[str]]] = {}
+    for shard, submissions in by_shard.items():
+        with sharding.use_shard(shard), transaction.atomic(using=shard):
+            for submission_id, data in submissions:
+                try:
+                    with transaction.atomic(using=shard):
+                        payment = services.apply_payment(
+                            customer_id=data["customer"],
+                            external_id=data["external_id"],
+                            total_amount=data["total_amount"],
+                            paymentdetails=data["paymentdetails"]
+                        )
+                        AppliedSubmission.objects.create(submission_id=submission_id, payment_id=payment.id)
+                    results[submission_id] = ("applied", payment.id, None)
+                except PaymentError as error:
+                    results[submission_id] = ("failed", None, error.message)
+                except Customers.DoesNotExist:
+                    results[submission_id] = ("failed", None, "The customer does not exist")
+                except ConcurrentUpdateError:
+                    #The loans keep changing, the submission is retried in the next batch
+                    results[submission_id] = ("pending", None, None)
+                except Exception as error:
+                    #The savepoint was rolled back, an unexpected error does not stop the other submissions
+                    logger.exception("The submission %s failed", submission_id)
+                    results[submission_id] = ("failed", None, str(error))
+
+    return results
+
+def finish(results: Dict[int, Tuple[str, Optional[int], Optional[str]]]) -> None:
+
+    """
+        This method save the result of the applied submissions in the queue
+
+        :param results: Status, payment created and message of every submission
+        :type results: dict
+    """
+
+    connection: sqlite3.Connection = _connect()
+    now: float = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.executemany(
+            "UPDATE submissions SET status = ?, payment_id = ?, message = ?, applied_at = ? WHERE id = ?",
+            [
+                (result[0], result[1], result[2], now if result[0] != "pending" else None, submission_id)
+                for submission_id, result in results.items()
+            ]
+        )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+def recover() -> int:
+
+    """
+        This method resolve the submissions left as applying by a writer that stopped,
+        the submissions saved in the database are applied and the others are pending again
+
+        :return: Number of submissions recovered
+        :rtype: int
+    """
+
+    submission_ids: List[int] = [
+        row[0] for row in _connect().execute("SELECT id FROM submissions WHERE status = 'applying'")
+    ]
+    if not submission_ids:
+        return 0
+
+    applied: Dict[int, int] = {}
+    for rows in sharding.fan_out(lambda alias: list(
+        AppliedSubmission.objects.using(alias).filter(
+            submission_id__in=submission_ids
+        ).values_list("submission_id", "payment_id")
+    )):
+        applied.update(rows)
+
+    finish({
+        submission_id: ("applied", applied[submission_id], None) if submission_id in applied else ("pending", None, None)
+        for submission_id in submission_ids
+    })
+
+    return len(submission_ids)
+
+def run_writer(
+    batch_size: int,
+    max_delay: float,
+    once: bool = False,
+    stop: Optional[threading.Event] = None
+) -> int:
+
+    """
+        This method apply the queued payments in micro-batches, a batch is applied
+        when it has batch_size payments or when its oldest payment waited max_delay seconds
+        Only one writer must run for every queue
+
+        :param batch_size: Maximum payments of a transaction
+        :type batch_size: int
+        :param max_delay: Maximum seconds that a payment wait for the batch
+        :type max_delay: float
+        :param once: Exit when the queue is empty
+        :type once: bool
+        :param stop: Event that stop the writer
+        :type stop: threading.Event
+
+        :return: Number of payments processed
+        :rtype: int
+    """
+
+    stop: threading.Event = stop or threading.Event()
+    processed: int = recover()
+    first_seen_at: Optional[float] = None
+
+    while not stop.is_set():
+        pending: int = pending_count()
+        now: float = time.monotonic()
+
+        if pending and first_seen_at is None:
+            first_seen_at = now
+
+        if pending >= batch_size or (pending and (once or now - first_seen_at >= max_delay)):
+            batch: List[Tuple[int, Dict[str, Any]]] = claim_batch(batch_size)
+            finish(apply_batch(batch))
+            processed += len(batch)
+            first_seen_at = None
+            continue
+
+        if not pending and once:
+            break
+
+        stop.wait(max_delay / 4 if pending else max_delay)
+
+    return processed
@@ -0,0 +1,272 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .metrics import UNMATCHED
+
+#Header and query param that ask for the profile of a request
+HEADER: str = "HTTP_X_CREDICTS_PROFILE"
+PARAM: str = "profile"
+#Header of the response with the id of the profile
+RESPONSE_HEADER: str = "X-Credicts-Profile-Id"
+#Ids of the profiles, they are used as file names
+#The first profiles were saved with the seconds of the request, the new ones with the microseconds
+PROFILE_ID: re.Pattern = re.compile(r"^\d{8}T\d{6}(?:\d{6})?-[0-9a-f]{8}$")
+#Queries and functions kept in the summary of a profile
+MAX_QUERIES: int = 1000
+MAX_FUNCTIONS: int = 40
+
+
+class QueryTimeline:
+
+    """
+        This class record the queries of a profiled request,
+        with their start and their duration from the start of the request
+    """
+
+    def __init__(self, started_at: float) -> None:
+        self.started_at: float = started_at
+        self.queries: List[Dict[str, Any]] = []
+        self.truncated: int = 0
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        started_at: float = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({
+                    "start_ms": round((started_at - self.started_at) * 1000, 3),
+                    "duration_ms": round((time.perf_counter() - started_at) * 1000, 3),
+                    "alias": context["connection"].alias,
+                    "sql": sql,
+                    "many": many,
+                })
+            else:
+                self.truncated += 1
+
+def _path(profile_id: str, extension: str) -> str:
+    return os.path.join(str(settings.CREDICTS_PROFILE_DIR), f"{profile_id}.{extension}")
+
+def _functions(profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+
+    """
+        This method return the functions of a profile with the most cumulative time
+
+        :param profiler: Profiler of the request
+        :type profiler: cProfile.Profile
+
+        :return: Functions with their calls, own time and cumulative time
+        :rtype: list
+    """
+
+    root: str = str(settings.BASE_DIR) + os.sep
+    stats: Dict[tuple, tuple] = pstats.Stats(profiler).stats
+    functions: List[Dict[str, Any]] = [
+        {
+            "function": f"{path[len(root):] if path.startswith(root) else path}:{line} {name}",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        }
+        for (path, line, name), (_, calls, own, cumulative, _) in stats.items()
+    ]
+
+    return sorted(functions, key=lambda function: function["cumulative_ms"], reverse=True)[:MAX_FUNCTIONS]
+
+def prune() -> None:
+
+    """
+        This method delete the oldest profiles when the directory has more than
+        CREDICTS_PROFILE_MAX_FILES profiles or more than CREDICTS_PROFILE_MAX_BYTES
+    """
+
+    directory: str = str(settings.CREDICTS_PROFILE_DIR)
+    profiles: Dict[str, List[os.DirEntry]] = defaultdict(list)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            profile_id, _, _ = entry.name.partition(".")
+            if PROFILE_ID.match(profile_id):
+                profiles[profile_id].append(entry)
+
+    #The ids start with the moment of the request, the oldest profiles are the first ones
+    #An id with seconds is sorted before the ids with microseconds of the same second, "-" is before the digits
+    ordered: List[str] = sorted(profiles)
+    sizes: Dict[str, int] = {
+        profile_id: sum(entry.stat().st_size for entry in profiles[profile_id]) for profile_id in ordered
+    }
+    total: int = sum(sizes.values())
+    while ordered and (len(ordered) > settings.CREDICTS_PROFILE_MAX_FILES or total > settings.CREDICTS_PROFILE_MAX_BYTES):
+        profile_id: str = ordered.pop(0)
+        for entry in profiles[profile_id]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                #Another worker removed it
+                pass
+        total -= sizes[profile_id]
+
+def save(profiler: cProfile.Profile, timeline: QueryTimeline, summary: Dict[str, Any]) -> str:
+
+    """
+        This method save a profile: the stats of cProfile, readable with pstats or snakeviz,
+        and a summary with the slowest functions and the timeline of the queries
+
+        :param profiler: Profiler of the request
+        :type profiler: cProfile.Profile
+        :param timeline: Queries of the request
+        :type timeline: QueryTimeline
+        :param summary: Route, method, status, user and duration of the request
+        :type summary: dict
+
+        :return: Id of the profile
+        :rtype: str
+    """
+
+    os.makedirs(str(settings.CREDICTS_PROFILE_DIR), exist_ok=True)
+    profile_id: str = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+    profiler.dump_stats(_path(profile_id, "prof"))
+    with open(_path(profile_id, "json"), "w") as file:
+        json.dump(
+            {
+                "id": profile_id,
+                **summary,
+                "queries": len(timeline.queries) + timeline.truncated,
+                "query_ms": round(sum(query["duration_ms"] for query in timeline.queries), 3),
+                "functions": _functions(profiler),
+                "timeline": timeline.queries,
+                "truncated_queries": timeline.truncated,
+            },
+            file
+        )
+
+    prune()
+    return profile_id
+
+def profiles() -> List[Dict[str, Any]]:
+
+    """
+        This method return the saved profiles without their functions and timeline, the newest first
+
+        :return: Profiles
+        :rtype: list
+    """
+
+    results: List[Dict[str, Any]] = []
+    directory: str = str(settings.CREDICTS_PROFILE_DIR)
+    names: List[str] = sorted(os.listdir(directory), reverse=True) if os.path.isdir(directory) else []
+    for name in names:
+        if name.endswith(".json") and PROFILE_ID.match(name[:-5]):
+            profile: Optional[Dict[str, Any]] = load(name[:-5])
+            if profile is not None:
+                results.append({key: value for key, value in profile.items() if key not in ["functions", "timeline"]})
+
+    return results
+
+def load(profile_id: str) -> Optional[Dict[str, Any]]:
+    if not PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(_path(profile_id, "json")) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def stats_path(profile_id: str) -> Optional[str]:
+    if not PROFILE_ID.match(profile_id) or not os.path.exists(_path(profile_id, "prof")):
+        return None
+    return _path(profile_id, "prof")
+
+class ProfilingMiddleware:
+
+    """
+        This middleware profile a request with cProfile and record the timeline of its queries
+        A staff user ask for the profile with the header X-Credicts-Profile: 1 or the param ?profile=1,
+        and the profile id is returned in the header X-Credicts-Profile-Id
+
+        With CREDICTS_PROFILE_SAMPLE_EVERY, one of every N requests of every route is profiled
+        Only one request of the process is profiled at a time, the others run normally
+    """
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.counters_lock: threading.Lock = threading.Lock()
+
+    def requested(self, request) -> Optional[str]:
+        #Only the staff can profile a request, the token is checked only when the profile is asked
+        if request.META.get(HEADER) != "1" and request.GET.get(PARAM) != "1":
+            return None
+        try:
+            authenticated = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if authenticated is None or not authenticated[0].is_staff:
+            return None
+        return authenticated[0].username
+
+    def sampled(self, request) -> bool:
+        every: int = settings.CREDICTS_PROFILE_SAMPLE_EVERY
+        if not every:
+            return False
+        try:
+            route: str = resolve(request.path_info).view_name or UNMATCHED
+        except Resolver404:
+            route = UNMATCHED
+        with self.counters_lock:
+            self.counters[route] += 1
+            return self.counters[route] % every == 0
+
+    def __call__(self, request):
+
+        user: Optional[str] = self.requested(request)
+        if user is None and not self.sampled(request):
+            return self.get_response(request)
+        if not self.lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            started_at: float = time.perf_counter()
+            timeline: QueryTimeline = QueryTimeline(started_at)
+            profiler: cProfile.Profile = cProfile.Profile()
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timeline))
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+
+            match = getattr(request, "resolver_match", None)
+            response[RESPONSE_HEADER] = save(profiler, timeline, {
+                "route": match.view_name if match and match.view_name else UNMATCHED,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "user": user,
+                "sampled": user is None,
+                "created_at": time.time(),
+                "duration_ms": round((time.perf_counter() - started_at) * 1000, 3),
+            })
+        finally:
+            self.lock.release()
+
+        return response
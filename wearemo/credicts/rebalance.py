@@ -0,0 +1,184 @@
+from typing import Any, Dict, List, Tuple, Type
+
+from django.db import models, transaction
+
+from . import archive, sharding
+from .models import (ArchivedLoan, ArchivedPayment, ArchivedPaymentDetail,
+                     Customers, CustomerPlacement, LoanAdjustment, Loans,
+                     Payment, PaymentDetails, PaymentMonthlySummary)
+
+#Rows copied in every insert
+COPY_BATCH: int = 1000
+
+
+def _customer_rows(customer_id: int) -> List[Tuple[Type[models.Model], Dict[str, Any]]]:
+
+    """
+        This method return the models and filters of all the rows of a customer,
+        in the order that they can be inserted
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+
+        :return: Models and filters
+        :rtype: list
+    """
+
+    return [
+        (Customers, {"pk": customer_id}),
+        (Loans, {"customer_id": customer_id}),
+        (Payment, {"customer_id": customer_id}),
+        (PaymentDetails, {"payment__customer_id": customer_id}),
+        (ArchivedLoan, {"customer_id": customer_id}),
+        (ArchivedPayment, {"customer_id": customer_id}),
+        (ArchivedPaymentDetail, {
+            "payment_id__in": ArchivedPayment.objects.filter(customer_id=customer_id).values("id")
+        }),
+        (PaymentMonthlySummary, {"customer_id": customer_id}),
+        (LoanAdjustment, {"customer_id": customer_id}),
+    ]
+
+def _copy(model: Type[models.Model], filters: Dict[str, Any], source: str, target: str) -> int:
+
+    """
+        This method copy the rows of a model between two shards, keeping the ids
+
+        :return: Number of rows copied
+        :rtype: int
+    """
+
+    copied: int = 0
+    batch: List[models.Model] = []
+    for row in model._default_manager.using(source).filter(**filters).order_by("pk").iterator(chunk_size=COPY_BATCH):
+        batch.append(row)
+        if len(batch) == COPY_BATCH:
+            copied += len(model._default_manager.using(target).bulk_create(batch))
+            batch = []
+
+    if batch:
+        copied += len(model._default_manager.using(target).bulk_create(batch))
+
+    return copied
+
+def delete_customer_rows(alias: str, customer_id: int) -> None:
+
+    """
+        This method delete all the rows of a customer with set-based statements,
+        without loading the rows for the cascade of the ORM
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+    """
+
+    archive.purge_customer(alias, customer_id)
+
+def fence_customer(alias: str, customer_id: int) -> None:
+
+    """
+        This method stop the writes of a customer in a shard until the transaction ends
+        The customer, its loans and its payments are locked, the writes that update them
+        or insert rows that reference them wait for the move. The version of the customer
+        is increased, the write lock of SQLite is taken for the whole file
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+    """
+
+    Customers.objects.using(alias).filter(pk=customer_id).update(version=models.F("version") + 1)
+    list(Customers.objects.using(alias).select_for_update().filter(pk=customer_id).values_list("pk", flat=True))
+    list(Loans.objects.using(alias).select_for_update().filter(customer_id=customer_id).values_list("pk", flat=True))
+    list(Payment.objects.using(alias).select_for_update().filter(customer_id=customer_id).values_list("pk", flat=True))
+
+def move_customer(customer_id: int, target: str) -> Dict[str, int]:
+
+    """
+        This method move a customer and all its rows to another shard
+        The writes of the customer in the old shard are fenced during the whole move,
+        the rows are copied, then the placement is changed and finally the rows
+        of the old shard are deleted, in the transaction that hold the fence
+        If the move is interrupted it can be run again and the rows left in the old shard are deleted
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param target: Alias of the new shard
+        :type target: str
+
+        :return: Rows copied by model
+        :rtype: dict
+    """
+
+    if target not in sharding.shards():
+        raise ValueError(f"The shard {target} does not exist")
+
+    source: str = sharding.shard_for_customer(customer_id)
+    if source == target:
+        #The placement was changed by a move interrupted before the delete, the rows left
+        #in the other shards are removed when the customer is in the target
+        if Customers.objects.using(target).filter(pk=customer_id).exists():
+            for alias in sharding.shards():
+                if alias != target:
+                    with transaction.atomic(using=alias):
+                        delete_customer_rows(alias, customer_id)
+        return {}
+
+    copied: Dict[str, int] = {}
+    with transaction.atomic(using=source):
+        #The writes committed in the old shard after the copy would be deleted with its rows
+        fence_customer(source, customer_id)
+
+        with transaction.atomic(using=target):
+            #Remove the rows of a previous interrupted move
+            delete_customer_rows(target, customer_id)
+            for model, filters in _customer_rows(customer_id):
+                copied[model._meta.model_name] = _copy(model, filters, source, target)
+
+            if not copied["customers"]:
+                raise Customers.DoesNotExist(f"The customer {customer_id} does not exist")
+
+        if target == sharding.shard_of_id(customer_id):
+            CustomerPlacement.objects.filter(customer_id=customer_id).delete()
+        else:
+            CustomerPlacement.objects.update_or_create(customer_id=customer_id, defaults={"shard": target})
+
+        delete_customer_rows(source, customer_id)
+
+    return copied
+
+def balance(max_moves: int, tolerance: int = 1) -> List[Tuple[int, str, str]]:
+
+    """
+        This method move customers from the shard with more customers
+        to the shard with less customers, until the difference is in the tolerance
+
+        :param max_moves: Maximum number of customers moved
+        :type max_moves: int
+        :param tolerance: Difference of customers allowed between shards
+        :type tolerance: int
+
+        :return: Customers moved, with the source and the target shard
+        :rtype: list
+    """
+
+    counts: Dict[str, int] = dict(zip(
+        sharding.shards(),
+        sharding.fan_out(lambda alias: Customers.objects.using(alias).count())
+    ))
+
+    moves: List[Tuple[int, str, str]] = []
+    while len(moves) < max_moves:
+        source: str = max(counts, key=counts.get)
+        target: str = min(counts, key=counts.get)
+        if counts[source] - counts[target] <= tolerance:
+            break
+
+        customer_id: int = Customers.objects.using(source).order_by("-id").values_list("id", flat=True).first()
+        move_customer(customer_id, target)
+        moves.append((customer_id, source, target))
+        counts[source] -= 1
+        counts[target] += 1
+
+    return moves
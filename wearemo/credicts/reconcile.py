@@ -0,0 +1,396 @@
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import services, sharding
+from .models import (ArchivedPayment, ArchivedPaymentDetail, Customers,
+                     LoanAdjustment, Loans, Payment, PaymentMonthlySummary)
+
+#Precision of the amounts of the loans
+CENTS: Decimal = Decimal("0.01")
+#Discrepancies included in the report, the others are only counted
+MAX_SAMPLES: int = 100
+
+#A chunk is the shard, the first id and the last id (inclusive) of a range of rows
+Chunk = Tuple[str, int, int]
+
+
+def key_ranges(model: Type[models.Model], alias: str, chunk_size: int) -> List[Chunk]:
+
+    """
+        This method split the ids of a table in ranges of chunk_size rows,
+        walking the primary key index instead of assuming that the ids are contiguous
+
+        :param model: Model of the table
+        :type model: Model
+        :param alias: Alias of the shard
+        :type alias: str
+        :param chunk_size: Rows of every range
+        :type chunk_size: int
+
+        :return: Ranges of ids
+        :rtype: list
+    """
+
+    ids = model._default_manager.using(alias).order_by("id").values_list("id", flat=True)
+    chunks: List[Chunk] = []
+
+    first: Optional[int] = ids.first()
+    while first is not None:
+        last: Optional[int] = ids.filter(id__gte=first)[chunk_size - 1:chunk_size].first()
+        if last is None:
+            chunks.append((alias, first, ids.last()))
+            break
+        chunks.append((alias, first, last))
+        first = ids.filter(id__gt=last).first()
+
+    return chunks
+
+def _new_report() -> Dict[str, Any]:
+    return {
+        "loans_checked": 0,
+        "payments_checked": 0,
+        "customers_checked": 0,
+        "discrepancies": {
+            "outstanding": 0, "status": 0, "payment_total": 0,
+            "customer_debt": 0, "customer_payments": 0, "credit_limit": 0,
+        },
+        "repaired": 0,
+        "samples": [],
+    }
+
+def _merge(report: Dict[str, Any], partial: Dict[str, Any]) -> None:
+    report["loans_checked"] += partial["loans_checked"]
+    report["payments_checked"] += partial["payments_checked"]
+    report["customers_checked"] += partial["customers_checked"]
+    report["repaired"] += partial["repaired"]
+    for kind, count in partial["discrepancies"].items():
+        report["discrepancies"][kind] += count
+    report["samples"].extend(partial["samples"][:MAX_SAMPLES - len(report["samples"])])
+
+def annotate_paid(loans: models.QuerySet) -> models.QuerySet:
+
+    """
+        This method annotate the amount paid of the loans:
+        the completed payment details, hot and archived
+
+        :param loans: Queryset of loans
+        :type loans: QuerySet
+
+        :return: Queryset with the paid annotation
+        :rtype: QuerySet
+    """
+
+    amount = models.DecimalField(max_digits=20, decimal_places=10)
+    #The details of an archived payment are archived with it, even when the loan is still hot
+    archived = ArchivedPaymentDetail.objects.filter(
+        loan_id=models.OuterRef("id"),
+        payment_id__in=ArchivedPayment.objects.filter(status=0).values("id")
+    ).values("loan_id").annotate(total=models.Sum("amount")).values("total")
+
+    return loans.annotate(
+        paid=Coalesce(
+            models.Sum("paymentdetails__amount", filter=models.Q(paymentdetails__payment__status=0)),
+            models.Value(Decimal(0)),
+            output_field=amount
+        ) + Coalesce(models.Subquery(archived, output_field=amount), models.Value(Decimal(0)), output_field=amount),
+    )
+
+def annotate_adjusted(loans: models.QuerySet) -> models.QuerySet:
+
+    """
+        This method annotate the amount added to the loans by the accrual
+
+        :param loans: Queryset of loans
+        :type loans: QuerySet
+
+        :return: Queryset with the adjusted annotation
+        :rtype: QuerySet
+    """
+
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    adjustments = LoanAdjustment.objects.filter(
+        loan_id=models.OuterRef("id")
+    ).order_by().values("loan_id").annotate(total=models.Sum("amount")).values("total")
+
+    return loans.annotate(
+        adjusted=Coalesce(models.Subquery(adjustments, output_field=amount), models.Value(Decimal(0)), output_field=amount)
+    )
+
+def check_loans(chunk: Chunk, repair: bool) -> Dict[str, Any]:
+
+    """
+        This method verify the outstanding and the status of a range of loans
+        with one grouped query, and repair the loans with a compare-and-swap
+
+        :param chunk: Shard and range of ids of the loans
+        :type chunk: tuple
+        :param repair: Fix the loans with discrepancies
+        :type repair: bool
+
+        :return: Partial report
+        :rtype: dict
+    """
+
+    alias, first, last = chunk
+    report: Dict[str, Any] = _new_report()
+
+    rows = annotate_adjusted(annotate_paid(
+        Loans.objects.using(alias).filter(id__gte=first, id__lte=last)
+    )).values_list("id", "customer_id", "amount", "outstanding", "status", "version", "paid", "adjusted")
+
+    fixes: List[Dict[str, Any]] = []
+    for loan_id, customer_id, amount, outstanding, status, version, paid, adjusted in rows:
+        report["loans_checked"] += 1
+
+        #The accrual add to the outstanding, the payments subtract from it
+        expected: Decimal = (amount + Decimal(adjusted) - Decimal(paid)).quantize(CENTS)
+        expected_status: int = status
+        if expected == 0 and status in [1, 2]:
+            expected_status = 4
+        elif expected > 0 and status == 4:
+            expected_status = 1
+
+        kinds: List[str] = []
+        if outstanding.quantize(CENTS) != expected:
+            kinds.append("outstanding")
+        if expected_status != status:
+            kinds.append("status")
+        if not kinds:
+            continue
+
+        for kind in kinds:
+            report["discrepancies"][kind] += 1
+        if len(report["samples"]) < MAX_SAMPLES:
+            report["samples"].append({
+                "shard": alias,
+                "loan": loan_id,
+                "customer": customer_id,
+                "kinds": kinds,
+                "outstanding": str(outstanding),
+                "expected_outstanding": str(expected),
+                "status": status,
+                "expected_status": expected_status,
+            })
+        fixes.append({"id": loan_id, "version": version, "outstanding": expected, "status": expected_status})
+
+    if repair and fixes:
+        now = timezone.now()
+        #One transaction for the chunk, the loans updated since the read are skipped
+        with transaction.atomic(using=alias):
+            for fix in fixes:
+                report["repaired"] += Loans.objects.using(alias).filter(
+                    id=fix["id"],
+                    version=fix["version"]
+                ).update(
+                    outstanding=fix["outstanding"],
+                    status=fix["status"],
+                    version=models.F("version") + 1,
+                    updated_at=now
+                )
+
+    return report
+
+def check_payments(chunk: Chunk, repair: bool) -> Dict[str, Any]:
+
+    """
+        This method verify that the total amount of a range of payments
+        is the sum of their details, with one grouped query
+
+        :param chunk: Shard and range of ids of the payments
+        :type chunk: tuple
+        :param repair: The payments are not repaired, the details are the source of truth of the loans
+        :type repair: bool
+
+        :return: Partial report
+        :rtype: dict
+    """
+
+    alias, first, last = chunk
+    report: Dict[str, Any] = _new_report()
+
+    rows = Payment.objects.using(alias).filter(id__gte=first, id__lte=last).annotate(
+        details_total=Coalesce(
+            models.Sum("paymentdetails__amount"),
+            models.Value(Decimal(0)),
+            output_field=models.DecimalField(max_digits=20, decimal_places=10)
+        )
+    ).values_list("id", "customer_id", "total_amount", "details_total")
+
+    for payment_id, customer_id, total_amount, details_total in rows:
+        report["payments_checked"] += 1
+        if Decimal(total_amount).quantize(CENTS) == Decimal(details_total).quantize(CENTS):
+            continue
+
+        report["discrepancies"]["payment_total"] += 1
+        if len(report["samples"]) < MAX_SAMPLES:
+            report["samples"].append({
+                "shard": alias,
+                "payment": payment_id,
+                "customer": customer_id,
+                "kinds": ["payment_total"],
+                "total_amount": str(total_amount),
+                "details_total": str(details_total),
+            })
+
+    return report
+
+def check_customers(chunk: Chunk, repair: bool) -> Dict[str, Any]:
+
+    """
+        This method verify the totals of a range of customers with one grouped query by table:
+        the total debt is the amount, the accrual and the payments of the open loans,
+        the payment summaries add up to the completed payments, hot and archived,
+        and the loans in use are inside the credit limit
+
+        :param chunk: Shard and range of ids of the customers
+        :type chunk: tuple
+        :param repair: The customers are not repaired, the loans are repaired by check_loans
+                       and the summaries by the backfill_payment_summaries command
+        :type repair: bool
+
+        :return: Partial report
+        :rtype: dict
+    """
+
+    alias, first, last = chunk
+    report: Dict[str, Any] = _new_report()
+    in_range: Dict[str, int] = {"customer_id__gte": first, "customer_id__lte": last}
+
+    scores: Dict[int, Decimal] = dict(
+        Customers.objects.using(alias).filter(id__gte=first, id__lte=last).values_list("id", "score")
+    )
+
+    debts: Dict[int, Decimal] = defaultdict(Decimal)
+    expected_debts: Dict[int, Decimal] = defaultdict(Decimal)
+    in_use: Dict[int, Decimal] = defaultdict(Decimal)
+    rows = annotate_adjusted(annotate_paid(
+        Loans.objects.using(alias).filter(status__in=services.CREDIT_LOAN_STATUS, **in_range)
+    )).values_list("customer_id", "amount", "outstanding", "paid", "adjusted")
+    for customer_id, amount, outstanding, paid, adjusted in rows:
+        debts[customer_id] += outstanding
+        expected_debts[customer_id] += amount + Decimal(adjusted) - Decimal(paid)
+        in_use[customer_id] += amount
+
+    paid: Dict[int, Decimal] = defaultdict(Decimal)
+    for model in [Payment, ArchivedPayment]:
+        rows = model.objects.using(alias).filter(status=0, **in_range).order_by().values(
+            "customer_id"
+        ).annotate(total=models.Sum("total_amount")).values_list("customer_id", "total")
+        for customer_id, total in rows:
+            paid[customer_id] += Decimal(total)
+
+    summarized: Dict[int, Decimal] = defaultdict(Decimal)
+    rows = PaymentMonthlySummary.objects.using(alias).filter(**in_range).order_by().values("customer_id").annotate(
+        total=models.Sum(
+            models.F("total_amount") - models.F("rejected_amount"),
+            output_field=models.DecimalField(max_digits=24, decimal_places=10)
+        )
+    ).values_list("customer_id", "total")
+    for customer_id, total in rows:
+        summarized[customer_id] += Decimal(total)
+
+    for customer_id, score in scores.items():
+        report["customers_checked"] += 1
+
+        kinds: List[str] = []
+        if debts[customer_id].quantize(CENTS) != expected_debts[customer_id].quantize(CENTS):
+            kinds.append("customer_debt")
+        if paid[customer_id].quantize(CENTS) != summarized[customer_id].quantize(CENTS):
+            kinds.append("customer_payments")
+        if in_use[customer_id] > score:
+            kinds.append("credit_limit")
+        if not kinds:
+            continue
+
+        for kind in kinds:
+            report["discrepancies"][kind] += 1
+        if len(report["samples"]) < MAX_SAMPLES:
+            report["samples"].append({
+                "shard": alias,
+                "customer": customer_id,
+                "kinds": kinds,
+                "total_debt": str(debts[customer_id].quantize(CENTS)),
+                "expected_total_debt": str(expected_debts[customer_id].quantize(CENTS)),
+                "payments_total": str(paid[customer_id].quantize(CENTS)),
+                "summaries_total": str(summarized[customer_id].quantize(CENTS)),
+                "credit_in_use": str(in_use[customer_id].quantize(CENTS)),
+                "score": str(score),
+            })
+
+    return report
+
+CHECKS: Dict[str, Tuple[Type[models.Model], Callable[[Chunk, bool], Dict[str, Any]]]] = {
+    "loans": (Loans, check_loans),
+    "payments": (Payment, check_payments),
+    "customers": (Customers, check_customers),
+}
+
+def _run_check(check: str, chunk: Chunk, repair: bool) -> Dict[str, Any]:
+    try:
+        return CHECKS[check][1](chunk, repair)
+    finally:
+        connections.close_all()
+
+def reconcile(
+    repair: bool = False,
+    chunk_size: int = 50000,
+    processes: int = 1,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
+
+    """
+        This method verify the loans, the payments and the customers of all the shards,
+        the ranges of ids are processed in parallel by a pool of processes
+
+        :param repair: Fix the outstanding and the status of the loans
+        :type repair: bool
+        :param chunk_size: Rows of every range
+        :type chunk_size: int
+        :param processes: Number of processes, 1 run the checks in this process
+        :type processes: int
+        :param progress: Function called with the chunks processed and the total of chunks
+        :type progress: Callable
+
+        :return: Report of the discrepancies
+        :rtype: dict
+    """
+
+    started_at: float = time.perf_counter()
+    tasks: List[Tuple[str, Chunk]] = [
+        (check, chunk)
+        for alias in sharding.shards()
+        for check, (model, _) in CHECKS.items()
+        for chunk in key_ranges(model, alias, chunk_size)
+    ]
+
+    report: Dict[str, Any] = _new_report()
+    if progress:
+        progress(0, len(tasks))
+
+    if processes > 1:
+        #The connections of the parent can not be shared with the children
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork")) as executor:
+            partials = executor.map(_run_check, *zip(*tasks), [repair] * len(tasks)) if tasks else []
+            for done, partial in enumerate(partials, start=1):
+                _merge(report, partial)
+                if progress:
+                    progress(done, len(tasks))
+    else:
+        for done, (check, chunk) in enumerate(tasks, start=1):
+            _merge(report, CHECKS[check][1](chunk, repair))
+            if progress:
+                progress(done, len(tasks))
+
+    report["chunks"] = len(tasks)
+    report["elapsed_seconds"] = round(time.perf_counter() - started_at, 3)
+
+    return report
@@ -0,0 +1,104 @@
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from rest_framework.renderers import JSONRenderer
+
+from .serializers import DecimalString
+
+#Query params of the compact output
+OMIT_NULL_PARAM: str = "omit_null"
+DECIMALS_PARAM: str = "decimals"
+LAYOUT_PARAM: str = "layout"
+
+
+def options(request) -> Dict[str, bool]:
+
+    """
+        This method return the compact output requested with the query params:
+        omit_null=1 remove the null fields, decimals=number write the decimals as numbers
+        and layout=columns write the lists of objects as columns and rows
+
+        :param request: Request object
+        :type request: Request
+
+        :return: Options of the output
+        :rtype: dict
+    """
+
+    params: Dict[str, str] = request.query_params if request is not None else {}
+    return {
+        "omit_null": params.get(OMIT_NULL_PARAM) in ["1", "true"],
+        "numbers": params.get(DECIMALS_PARAM) == "number",
+        "columns": params.get(LAYOUT_PARAM) == "columns",
+    }
+
+def compact(data: Any, omit_null: bool, numbers: bool) -> Any:
+
+    """
+        This method remove the null fields of the objects and convert the decimals to numbers,
+        in all the levels of the data
+
+        :param data: Serialized data
+        :type data: Any
+        :param omit_null: Remove the null fields
+        :type omit_null: bool
+        :param numbers: Convert the decimals to numbers
+        :type numbers: bool
+
+        :return: Data
+        :rtype: Any
+    """
+
+    if isinstance(data, dict):
+        return {
+            key: compact(value, omit_null, numbers)
+            for key, value in data.items()
+            if not (omit_null and value is None)
+        }
+    if isinstance(data, list):
+        return [compact(item, omit_null, numbers) for item in data]
+    if numbers and isinstance(data, DecimalString):
+        return Decimal(data)
+    return data
+
+def columns(rows: List[Dict[str, Any]]) -> Dict[str, List]:
+
+    """
+        This method write a list of objects as the names of their fields and a list of values by object,
+        the names are written once instead of once by object
+        The fields missing in an object are null
+
+        :param rows: Objects
+        :type rows: list
+
+        :return: Columns and rows
+        :rtype: dict
+    """
+
+    names: Dict[str, None] = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+
+    return {
+        "columns": list(names),
+        "rows": [[row.get(name) for name in names] for row in rows],
+    }
+
+class CompactJSONRenderer(JSONRenderer):
+
+    """
+        This renderer write the JSON of the API with the compact options of the request,
+        without options the output is the output of the JSON renderer
+        The decimals are written as numbers by the JSON encoder
+    """
+
+    def render(self, data: Any, accepted_media_type: Optional[str] = None, renderer_context: Optional[Dict] = None) -> bytes:
+
+        requested: Dict[str, bool] = options((renderer_context or {}).get("request"))
+        if requested["omit_null"] or requested["numbers"]:
+            data = compact(data, requested["omit_null"], requested["numbers"])
+        if requested["columns"] and isinstance(data, list) and all(isinstance(row, dict) for row in data):
+            #The values are matched by position, the null fields of a row are written as null
+            data = columns(data)
+
+        return super().render(data, accepted_media_type, renderer_context)
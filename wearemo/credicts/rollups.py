@@ -0,0 +1,260 @@
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import sharding
+from .exceptions import ConcurrentUpdateError
+from .models import ArchivedPayment, Customers, Payment, PaymentMonthlySummary
+
+#Columns added by the rollups
+COUNTERS: List[str] = ["payments", "total_amount", "rejected", "rejected_amount"]
+
+
+def month_of(moment: datetime) -> date:
+    #The months are the months of the current time zone, like TruncMonth
+    return timezone.localtime(moment).date().replace(day=1)
+
+def _add(customer_id: int, month: date, **increments: Any) -> None:
+
+    """
+        This method add some amounts to the summary of a month of a customer,
+        the summary is created by the first payment of the month
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param month: First day of the month
+        :type month: date
+
+        :raises ConcurrentUpdateError: When another payment created the summary at the same time
+    """
+
+    #The lock of the customer wait for the rebuild of its summaries by the backfill, in PostgreSQL
+    list(Customers.objects.select_for_update(no_key=True).filter(pk=customer_id).values_list("pk", flat=True))
+    updated: int = PaymentMonthlySummary.objects.filter(customer_id=customer_id, month=month).update(
+        **{name: models.F(name) + value for name, value in increments.items()},
+        updated_at=timezone.now()
+    )
+    if updated:
+        return
+
+    try:
+        PaymentMonthlySummary.objects.create(customer_id=customer_id, month=month, **increments)
+    except IntegrityError:
+        #The payment is retried and will find the summary
+        raise ConcurrentUpdateError()
+
+def record_payment(payment: Payment) -> None:
+
+    """
+        This method count a new payment in the summary of its month,
+        in the transaction of the payment
+
+        :param payment: Payment created
+        :type payment: Payment
+    """
+
+    _add(payment.customer_id, month_of(payment.paid_at), payments=1, total_amount=Decimal(str(payment.total_amount)))
+
+def record_rejection(payment: Payment) -> None:
+
+    """
+        This method count a rejected payment in the summary of the month of the payment,
+        in the transaction of the rejection
+
+        :param payment: Payment rejected
+        :type payment: Payment
+    """
+
+    _add(payment.customer_id, month_of(payment.paid_at), rejected=1, rejected_amount=Decimal(str(payment.total_amount)))
+
+def _totals(payments: models.QuerySet) -> Dict[Tuple[int, date], Dict[str, Any]]:
+
+    """
+        This method add up the payments by customer and month with one grouped query
+
+        :param payments: Queryset of payments, hot or archived
+        :type payments: QuerySet
+
+        :return: Counters by customer and month
+        :rtype: dict
+    """
+
+    totals: Dict[Tuple[int, date], Dict[str, Any]] = defaultdict(lambda: {name: 0 for name in COUNTERS})
+    rejected = models.Q(status=1)
+
+    rows = payments.annotate(
+        month=TruncMonth("paid_at")
+    ).order_by().values("customer_id", "month").annotate(
+        #The aggregates can not have the names of the columns
+        sum_payments=models.Count("id"),
+        sum_total_amount=models.Sum("total_amount"),
+        sum_rejected=models.Count("id", filter=rejected),
+        sum_rejected_amount=Coalesce(models.Sum("total_amount", filter=rejected), models.Value(Decimal(0))),
+    )
+    for row in rows:
+        month: date = row["month"].date() if isinstance(row["month"], datetime) else row["month"]
+        summary: Dict[str, Any] = totals[(row["customer_id"], month)]
+        for name in COUNTERS:
+            summary[name] += row[f"sum_{name}"]
+
+    return totals
+
+def summarize(alias: str, customer_ids: List[int]) -> List[PaymentMonthlySummary]:
+
+    """
+        This method calculate the summaries of some customers from their payments,
+        the hot payments and the archived payments, with one grouped query for every table
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param customer_ids: Primary keys of the customers
+        :type customer_ids: list
+
+        :return: Summaries, without saving
+        :rtype: list
+    """
+
+    totals: Dict[Tuple[int, date], Dict[str, Any]] = defaultdict(lambda: {name: 0 for name in COUNTERS})
+    for model in [Payment, ArchivedPayment]:
+        for key, values in _totals(model.objects.using(alias).filter(customer_id__in=customer_ids)).items():
+            for name in COUNTERS:
+                totals[key][name] += values[name]
+
+    return [
+        PaymentMonthlySummary(customer_id=customer_id, month=month, **values)
+        for (customer_id, month), values in sorted(totals.items())
+    ]
+
+def record_deletion(alias: str, payment_ids: List[int]) -> None:
+
+    """
+        This method remove some payments from the summaries of their months, before they are deleted
+        without archiving them, in the transaction of the delete
+        The summaries keep adding up to the payments, like after a backfill
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param payment_ids: Primary keys of the payments
+        :type payment_ids: list
+    """
+
+    for (customer_id, month), values in _totals(Payment.objects.using(alias).filter(id__in=payment_ids)).items():
+        PaymentMonthlySummary.objects.using(alias).filter(customer_id=customer_id, month=month).update(
+            **{name: models.F(name) - values[name] for name in COUNTERS},
+            updated_at=timezone.now()
+        )
+
+def backfill_shard(alias: str, chunk_size: int = 1000) -> Dict[str, int]:
+
+    """
+        This method rebuild the summaries of all the customers of a shard,
+        a chunk of customers at a time, every chunk in its own transaction
+        The customers of the chunk are locked and their old summaries are deleted first,
+        so the payments of the chunk wait for the rebuild instead of being counted twice
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param chunk_size: Customers of every chunk
+        :type chunk_size: int
+
+        :return: Customers and summaries of the shard
+        :rtype: dict
+    """
+
+    report: Dict[str, int] = {"customers": 0, "summaries": 0}
+    last_id: int = -1
+    while True:
+        customer_ids: List[int] = list(
+            Customers.objects.using(alias).filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size]
+        )
+        if not customer_ids:
+            return report
+
+        with transaction.atomic(using=alias):
+            #The payments of the chunk wait for the lock of their customer, in READ COMMITTED a payment
+            #could create a summary between the delete and the insert and be counted twice
+            list(Customers.objects.using(alias).select_for_update().filter(id__in=customer_ids).order_by("id").values_list("id", flat=True))
+            PaymentMonthlySummary.objects.using(alias).filter(customer_id__in=customer_ids).delete()
+            summaries: List[PaymentMonthlySummary] = summarize(alias, customer_ids)
+            PaymentMonthlySummary.objects.using(alias).bulk_create(summaries, batch_size=chunk_size)
+
+        report["customers"] += len(customer_ids)
+        report["summaries"] += len(summaries)
+        last_id = customer_ids[-1]
+
+def backfill(chunk_size: int = 1000) -> Dict[str, Dict[str, int]]:
+
+    """
+        This method rebuild the summaries of all the shards in parallel
+
+        :param chunk_size: Customers of every chunk
+        :type chunk_size: int
+
+        :return: Report by shard
+        :rtype: dict
+    """
+
+    reports: List[Dict[str, int]] = sharding.fan_out(lambda alias: backfill_shard(alias, chunk_size))
+    return dict(zip(sharding.shards(), reports))
+
+def parse_months(params: Dict[str, str]) -> Tuple[Optional[date], Optional[date]]:
+
+    """
+        This method parse the range of the summary: from and to (YYYY-MM), both inclusive
+
+        :param params: Query params of the request
+        :type params: dict
+
+        :return: First day of the first and the last month, None when the param is not sent
+        :rtype: tuple
+
+        :raises ValidationError: When a month is invalid or the range is empty
+    """
+
+    months: Dict[str, Optional[date]] = {}
+    errors: Dict[str, List[str]] = {}
+    for name in ["from", "to"]:
+        months[name] = None
+        if params.get(name):
+            try:
+                months[name] = datetime.strptime(params[name], "%Y-%m").date()
+            except ValueError:
+                errors[name] = ["The month must have the format YYYY-MM"]
+
+    if not errors and months["from"] and months["to"] and months["from"] > months["to"]:
+        errors["to"] = ["The end of the range must be after its start"]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    return months["from"], months["to"]
+
+def summaries(customer_id: int, first: Optional[date], last: Optional[date]) -> models.QuerySet:
+
+    """
+        This method return the summaries of a customer in a range of months,
+        read with the unique index of the customer and the month
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param first: First month, inclusive
+        :type first: date
+        :param last: Last month, inclusive
+        :type last: date
+
+        :return: Queryset of summaries
+        :rtype: QuerySet
+    """
+
+    queryset: models.QuerySet = PaymentMonthlySummary.objects.filter(customer_id=customer_id)
+    if first:
+        queryset = queryset.filter(month__gte=first)
+    if last:
+        queryset = queryset.filter(month__lte=last)
+
+    return queryset.order_by("month")
@@ -0,0 +1,42 @@
+from typing import Optional
+
+from . import sharding
+
+
+class CustomerShardRouter:
+
+    """
+        This router store the rows of the customers, loans and payments in the shard
+        of the customer, the other models live in the default database
+
+        The shard of the queries is the shard of the current context,
+        see sharding.use_shard, or the database of the instance
+    """
+
+    def _route(self, model, **hints) -> Optional[str]:
+
+        if not sharding.is_sharded(model):
+            return None
+
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        return sharding.current_shard()
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+
+        if sharding.is_sharded(type(obj1)) and sharding.is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, model_name: Optional[str] = None, **hints) -> bool:
+
+        if app_label == "credicts" and model_name in sharding.SHARDED_MODELS:
+            return db in sharding.shards()
+
+        return db == "default"
@@ -0,0 +1,250 @@
+import csv
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import events, services, sharding
+from .exceptions import ConcurrentUpdateError
+from .models import Customers
+
+#Precision of the scores
+CENTS: Decimal = Decimal("0.01")
+
+#Results of a line of the file
+UPDATED: str = "updated"
+UNCHANGED: str = "unchanged"
+MISSING: str = "missing"
+INVALID: str = "invalid"
+
+
+def _parse_preapproved(value: str) -> Optional[datetime]:
+
+    """
+        This method parse the preapproved date of a line, a datetime or a date (YYYY-MM-DD)
+
+        :param value: Value of the column
+        :type value: str
+
+        :return: Aware datetime, None when the value is empty
+        :rtype: datetime
+
+        :raises ValueError: When the value is not a date
+    """
+
+    if not value:
+        return None
+
+    parsed: Optional[datetime] = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.min)
+
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+def parse(rows: Iterable[List[str]]) -> Iterator[Dict[str, Any]]:
+
+    """
+        This method read the lines of a score file: external_id, score and preapproved_at
+        The header is optional. Without the third column the preapproved date is not changed,
+        an empty preapproved date remove it
+
+        :param rows: Rows of the CSV file
+        :type rows: Iterable
+
+        :return: Lines of the file, the invalid lines have an error
+        :rtype: Iterator
+    """
+
+    for number, row in enumerate(rows, start=1):
+        if not row or (number == 1 and row[0].strip().lower() == "external_id"):
+            continue
+
+        line: Dict[str, Any] = {"line": number, "external_id": row[0].strip()}
+        try:
+            line["score"] = Decimal(row[1].strip()).quantize(CENTS)
+            if line["score"] < 0:
+                raise ValueError(row[1])
+            if len(row) > 2:
+                line["preapproved_at"] = _parse_preapproved(row[2].strip())
+        except (IndexError, ValueError, InvalidOperation):
+            line["error"] = "The line must have an external id, a positive score and optionally a preapproved date"
+        yield line
+
+def write_changes(alias: str, columns: Tuple[str, ...], customers: List[Customers]) -> None:
+
+    """
+        This method write the changed columns of some customers with one prepared
+        UPDATE executed for all the rows, conditioned on the version that was read
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param columns: Changed columns
+        :type columns: tuple
+        :param customers: Customers with the new values, and the version that was read
+        :type customers: list
+
+        :raises ConcurrentUpdateError: When a customer was updated after the read
+    """
+
+    connection = connections[alias]
+    table: str = Customers._meta.db_table
+    fields: List[Any] = [Customers._meta.get_field(column) for column in columns]
+    assignments: str = ", ".join(f"{field.column} = %s" for field in fields)
+    #The values are adapted like the ORM save them
+    now: Any = Customers._meta.get_field("updated_at").get_db_prep_save(timezone.now(), connection)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {table} SET {assignments}, version = version + 1, updated_at = %s WHERE id = %s AND version = %s",
+            [
+                [
+                    *(field.get_db_prep_save(getattr(customer, field.attname), connection) for field in fields),
+                    now,
+                    customer.id,
+                    customer.version
+                ]
+                for customer in customers
+            ]
+        )
+        if cursor.rowcount != len(customers):
+            raise ConcurrentUpdateError()
+
+@services.with_retries
+def update_shard(alias: str, lines: Dict[str, Dict[str, Any]], dry_run: bool = False) -> Dict[str, Dict[str, Any]]:
+
+    """
+        This method update the customers of a batch that live in a shard
+        The customers are read with one query, and written with one statement
+        for every set of changed columns, a customer changed after the read make the batch retry
+
+        :param alias: Alias of the shard
+        :type alias: str
+        :param lines: Lines of the batch by external id
+        :type lines: dict
+        :param dry_run: Compare the scores without updating the customers
+        :type dry_run: bool
+
+        :return: Result by external id of the customers of the shard
+        :rtype: dict
+
+        :raises ConcurrentUpdateError: When the customers keep changing after all the retries
+    """
+
+    results: Dict[str, Dict[str, Any]] = {}
+    customers: List[Customers] = list(
+        Customers.objects.using(alias).select_for_update().filter(
+            external_id__in=list(lines)
+        ).only("id", "external_id", "score", "preapproved_at", "version")
+    )
+    if not customers:
+        return results
+
+    debts: Dict[int, Decimal] = services.total_debts([customer.id for customer in customers])
+    changed: Dict[Tuple[str, ...], List[Customers]] = defaultdict(list)
+
+    for customer in customers:
+        line: Dict[str, Any] = lines[customer.external_id]
+        columns: List[str] = []
+        if customer.score != line["score"]:
+            customer.score = line["score"]
+            columns.append("score")
+        if "preapproved_at" in line and customer.preapproved_at != line["preapproved_at"]:
+            customer.preapproved_at = line["preapproved_at"]
+            columns.append("preapproved_at")
+
+        result: Dict[str, Any] = {"customer": customer.id, "result": UPDATED if columns else UNCHANGED}
+        if line["score"] < debts[customer.id]:
+            result.update(below_debt=True, debt=str(Decimal(debts[customer.id]).quantize(CENTS)))
+        results[customer.external_id] = result
+
+        if columns:
+            changed[tuple(columns)].append(customer)
+
+    if not dry_run:
+        #Only the changed columns are written
+        for columns, group in changed.items():
+            for start in range(0, len(group), settings.CREDICTS_BULK_BATCH_SIZE):
+                write_changes(alias, columns, group[start:start + settings.CREDICTS_BULK_BATCH_SIZE])
+        for group in changed.values():
+            for customer in group:
+                events.notify(customer.id)
+
+    return results
+
+def ingest(rows: Iterable[List[str]], batch_size: int = 1000, dry_run: bool = False) -> Iterator[Dict[str, Any]]:
+
+    """
+        This method apply a score file in batches of lines, only one batch is kept in memory
+        Every batch is looked up with one query by shard
+
+        :param rows: Rows of the CSV file
+        :type rows: Iterable
+        :param batch_size: Lines of every batch
+        :type batch_size: int
+        :param dry_run: Compare the scores without updating the customers
+        :type dry_run: bool
+
+        :return: Result of every line
+        :rtype: Iterator
+    """
+
+    lines: Iterator[Dict[str, Any]] = parse(rows)
+    while True:
+        batch: List[Dict[str, Any]] = list(islice(lines, batch_size))
+        if not batch:
+            return
+
+        #The last line of a customer in the batch wins, like the lines of different batches
+        latest: Dict[str, Dict[str, Any]] = {line["external_id"]: line for line in batch if "error" not in line}
+        updates: Dict[str, Dict[str, Any]] = {}
+        for partial in sharding.fan_out(lambda alias: update_shard(alias, latest, dry_run)):
+            updates.update(partial)
+
+        for line in batch:
+            result: Dict[str, Any] = {"line": line["line"], "external_id": line["external_id"]}
+            if "error" in line:
+                result.update(result=INVALID, error=line["error"])
+            elif latest[line["external_id"]] is not line:
+                result.update(result=INVALID, error="The customer is repeated in a later line")
+            elif line["external_id"] not in updates:
+                result["result"] = MISSING
+            else:
+                result.update(score=str(line["score"]), **updates[line["external_id"]])
+            yield result
+
+def report(lines: Iterable[str], include_all: bool = False, dry_run: bool = False) -> Iterator[str]:
+
+    """
+        This method apply a score file and return the report as JSON lines:
+        the missing and invalid lines and the customers whose new score is below their debt
+        The last line is the summary of the results
+
+        :param lines: Lines of the CSV file
+        :type lines: Iterable
+        :param include_all: Include all the lines in the report
+        :type include_all: bool
+        :param dry_run: Compare the scores without updating the customers
+        :type dry_run: bool
+
+        :return: JSON lines
+        :rtype: Iterator
+    """
+
+    summary: Counter = Counter({UPDATED: 0, UNCHANGED: 0, MISSING: 0, INVALID: 0, "below_debt": 0})
+    for result in ingest(csv.reader(lines), batch_size=settings.CREDICTS_SCORE_BATCH_SIZE, dry_run=dry_run):
+        summary[result["result"]] += 1
+        summary["below_debt"] += 1 if result.get("below_debt") else 0
+        if include_all or result.get("below_debt") or result["result"] in [MISSING, INVALID]:
+            yield json.dumps(result) + "\n"
+
+    yield json.dumps({"summary": dict(summary), "dry_run": dry_run}) + "\n"
@@ -1,11 +1,177 @@
 from rest_framework import serializers
-from .models import Customers, Loans, Payment, PaymentDetails
-from typing import List, Dict, Any
+from . import services
+from .exceptions import ConcurrentUpdateError, LoanError
+from .jobs import HANDLERS
+from .models import (ArchivedLoan, ArchivedPayment, Customers, Job, Loans,
+                     Payment, PaymentDetails, PaymentMonthlySummary,
+                     VersionedModel)
+from typing import List, Dict, Any, Optional, Tuple
+from django.conf import settings
 from django.db import models
 from datetime import datetime
 
 
-class CustomersSerializer(serializers.ModelSerializer):
+def restrict_fields(serializer: serializers.Serializer, fields: Dict[str, Dict]) -> None:
+
+    """
+        This method remove the fields of a serializer that are not requested,
+        the nested serializers are restricted with their own fields
+
+        :param serializer: Serializer, or the child of a list serializer
+        :type serializer: Serializer
+        :param fields: Tree of the requested fields, an empty tree keep all the fields
+        :type fields: dict
+
+        :raises ValidationError: When a requested field does not exist
+    """
+
+    unknown: List[str] = sorted(set(fields) - set(serializer.fields))
+    if unknown:
+        raise serializers.ValidationError({"fields": f"The fields {', '.join(unknown)} do not exist"})
+
+    for name in list(serializer.fields):
+        if name not in fields:
+            serializer.fields.pop(name)
+            continue
+
+        field: serializers.Field = serializer.fields[name]
+        nested: serializers.Field = field.child if isinstance(field, serializers.ListSerializer) else field
+        if fields[name] and isinstance(nested, serializers.Serializer):
+            restrict_fields(nested, fields[name])
+
+def parse_fields(value: Optional[str]) -> Optional[Dict[str, Dict]]:
+
+    """
+        This method parse the fields parameter, a list of dotted paths
+        Example: "id,loans.outstanding,payments.paymentdetails.amount"
+
+        :param value: Value of the fields parameter
+        :type value: str
+
+        :return: Tree of the requested fields, None when the parameter is not sent
+        :rtype: dict
+    """
+
+    if not value:
+        return None
+
+    tree: Dict[str, Dict] = {}
+    for path in value.split(","):
+        node: Dict[str, Dict] = tree
+        for name in path.strip().split("."):
+            if name:
+                node = node.setdefault(name, {})
+
+    return tree
+
+class DecimalString(str):
+
+    """
+        This class mark the decimals serialized as strings,
+        the compact renderer write them as numbers when the client ask for it
+    """
+
+class DecimalField(serializers.DecimalField):
+
+    def to_representation(self, value) -> Any:
+        representation: Any = super().to_representation(value)
+        return DecimalString(representation) if isinstance(representation, str) else representation
+
+class DecimalFieldsMixin:
+
+    """
+        This mixin mark the decimal columns of a model serializer for the compact renderer
+    """
+
+    serializer_field_mapping: Dict[Any, Any] = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.DecimalField: DecimalField,
+    }
+
+class SparseFieldsMixin:
+
+    """
+        This mixin receive the requested fields in the fields argument
+        and remove the other fields of the serializer
+        The relations of expandable_fields are replaced by their serializer
+        when they are in the expand argument
+    """
+
+    #Relations that can be expanded: name, with the name of the serializer, the source and if it is a list
+    expandable_fields: Dict[str, Tuple[str, str, bool]] = {}
+
+    def __init__(
+        self,
+        *args,
+        fields: Optional[Dict[str, Dict]] = None,
+        expand: Optional[Dict[str, Dict]] = None,
+        **kwargs
+    ) -> None:
+        super().__init__(*args, **kwargs)
+
+        unknown: List[str] = sorted(set(expand or {}) - set(self.expandable_fields))
+        if unknown:
+            raise serializers.ValidationError({"expand": f"The relations {', '.join(unknown)} can not be expanded"})
+
+        for name, nested in (expand or {}).items():
+            #The serializers are referenced by name, they can be declared after this serializer
+            serializer_name, source, many = self.expandable_fields[name]
+            self.fields[name] = globals()[serializer_name](
+                many=many,
+                read_only=True,
+                expand=nested or None,
+                **({"source": source} if source != name else {})
+            )
+
+        if fields:
+            restrict_fields(self, fields)
+
+class VersionedSerializerMixin:
+
+    """
+        This mixin update the versioned models with a compare-and-swap
+        The client can send the version that it read, by default the version
+        of the instance loaded in the request is used
+    """
+
+    def create(self, validated_data: Dict[str, Any]) -> VersionedModel:
+        validated_data.pop("version", None)
+        return super().create(validated_data)
+
+    def update(self, instance: VersionedModel, validated_data: Dict[str, Any]) -> VersionedModel:
+
+        """
+            This method update only the validated fields of the instance
+
+            :param instance: Instance to update
+            :type instance: VersionedModel
+            :param validated_data: Validated data
+            :type validated_data: dict
+
+            :return: Updated instance
+            :rtype: VersionedModel
+
+            :raises ConcurrentUpdateError: When the version is not the current version of the row
+        """
+
+        version: int = validated_data.pop("version", instance.version)
+        if version != instance.version:
+            raise ConcurrentUpdateError()
+
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+
+        instance.cas_save(update_fields=list(validated_data))
+
+        return instance
+
+class CustomersSerializer(SparseFieldsMixin, DecimalFieldsMixin, VersionedSerializerMixin, serializers.ModelSerializer):
+
+    expandable_fields: Dict[str, Tuple[str, str, bool]] = {
+        "loans": ("LoansSerializer", "loans_set", True),
+        "payments": ("PaymentSerializer", "payment_set", True),
+    }
+
     class Meta:
         model = Customers
         fields: List[str] = [
@@ -13,9 +179,11 @@ class CustomersSerializer(serializers.ModelSerializer):
             "external_id",
             "status",
             "score",
-            "preapproved_at"
+            "preapproved_at",
+            "version"
         ]
         read_only_fields: List[str] = ["outstanding"]
+        extra_kwargs: Dict[str, Dict[str, Any]] = {"version": {"required": False}}
 
     
     def validate_status(self, value: int) -> int:
@@ -37,7 +205,12 @@ class CustomersSerializer(serializers.ModelSerializer):
 
         return value
     
-class LoansSerializer(serializers.ModelSerializer):
+class LoansSerializer(SparseFieldsMixin, DecimalFieldsMixin, VersionedSerializerMixin, serializers.ModelSerializer):
+
+    expandable_fields: Dict[str, Tuple[str, str, bool]] = {
+        "customer": ("CustomersSerializer", "customer", False),
+    }
+
     class Meta:
         model = Loans
         fields: List[str] = [
@@ -47,8 +220,10 @@ class LoansSerializer(serializers.ModelSerializer):
             "contract_version",
             "status",
             "outstanding",
-            "customer"
+            "customer",
+            "version"
         ]
+        extra_kwargs: Dict[str, Dict[str, Any]] = {"version": {"required": False}}
 
     def validate_amount(self, amount: int) -> float:
             
@@ -66,7 +241,7 @@ class LoansSerializer(serializers.ModelSerializer):
         customer: Customers = Customers.objects.get(id=customer_id)
         total_amount: float = Loans.objects.filter(
             customer=customer,
-            status__in=[0, 1]
+            status__in=services.CREDIT_LOAN_STATUS
         ).aggregate(total_amount=models.Sum('amount')).get('total_amount', 0)
         total_amount: float = total_amount if total_amount else 0
 
@@ -88,35 +263,26 @@ class LoansSerializer(serializers.ModelSerializer):
             :rtype: dict
         """
 
+        #The transitions are shared with the bulk updates
+        try:
+            taken: bool = services.check_transition(
+                None if self.instance is None else self.instance.status,
+                attrs.get('status')
+            )
+        except LoanError as error:
+            raise serializers.ValidationError(error.message)
+
+        if taken:
+            attrs["taken_at"] = datetime.now()
+
         #Validate if the instance is being created
         if self.instance is None:
 
-            #Validate the status when the loan will be created
-            status: int = attrs.get('status')
-            if status == 2:
-                attrs["taken_at"] = datetime.now()
-            elif status == 3:
-                raise serializers.ValidationError("A loan cant be created how rejected")
-            elif status == 4:
-                raise serializers.ValidationError("A loan cant be created how paid")
-            
             #When a Loan is created, the outstanding must be equeal to the amount
             attrs["outstanding"] = attrs["amount"]
             
         else:
 
-            #Validate the status when the loan exist
-            status: int = attrs.get('status')
-            if status == 2 and self.instance.status == 1:
-                attrs["taken_at"] = datetime.now()
-            elif status == 3 and self.instance.status != 1:
-                raise serializers.ValidationError("A loan can only be rejected when it is pending")
-            elif status == 4:
-                raise serializers.ValidationError("Dont cant update a loan how paid directly, use the payment endpoint")
-            
-            if status in [1,2] and self.instance.status in [3,4]:
-                raise serializers.ValidationError("A loan cant be updated how Pending or Active after be rejected or paid")
-
             #Validate that the outstanding cant be updated directly
             if "outstanding" in attrs:
                 del attrs["outstanding"]
@@ -127,7 +293,66 @@ class LoansSerializer(serializers.ModelSerializer):
 
         return super().validate(attrs)
 
-class PaymentDetailsSerializer(serializers.ModelSerializer):
+class BulkLoanSerializer(serializers.ModelSerializer):
+
+    """
+        This serializer validate the fields of a loan of the bulk creation,
+        the customer, the status and the credit limit are validated by the bulk for all the loans
+    """
+
+    customer = serializers.IntegerField()
+
+    class Meta:
+        model = Loans
+        fields: List[str] = [
+            "external_id",
+            "amount",
+            "contract_version",
+            "status",
+            "maximum_payment_date",
+            "customer"
+        ]
+
+class BulkStatusSerializer(serializers.Serializer):
+
+    """
+        This serializer validate a change of status of the bulk transitions,
+        the version is the version that the client read, by default the current version
+    """
+
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Loans.STATUS_LOAD_CHOICES)
+    version = serializers.IntegerField(required=False)
+
+class ScenarioSerializer(serializers.Serializer):
+
+    """
+        This serializer validate a scenario of the simulation, the changes are fractions:
+        a score_change of -0.1 is a drop of 10% of the scores
+    """
+
+    name = serializers.CharField(max_length=60)
+    score_change = serializers.FloatField(min_value=-1, max_value=10, default=0)
+    outstanding_change = serializers.FloatField(min_value=-1, max_value=10, default=0)
+
+class SimulationSerializer(serializers.Serializer):
+
+    scenarios = ScenarioSerializer(many=True, allow_empty=False)
+    #Read the portfolio from the database instead of the cached snapshot
+    refresh = serializers.BooleanField(default=False)
+
+    def validate_scenarios(self, scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if len(scenarios) > settings.CREDICTS_SIMULATION_MAX_SCENARIOS:
+            raise serializers.ValidationError(
+                f"The simulation can have at most {settings.CREDICTS_SIMULATION_MAX_SCENARIOS} scenarios"
+            )
+        return scenarios
+
+class PaymentDetailsSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    expandable_fields: Dict[str, Tuple[str, str, bool]] = {
+        "loan": ("LoansSerializer", "loan", False),
+    }
 
     class Meta:
         model = PaymentDetails
@@ -137,7 +362,12 @@ class PaymentDetailsSerializer(serializers.ModelSerializer):
             "loan"
         ]
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    expandable_fields: Dict[str, Tuple[str, str, bool]] = {
+        "customer": ("CustomersSerializer", "customer", False),
+        "paymentdetails": ("PaymentDetailsSerializer", "paymentdetails_set", True),
+    }
 
     class Meta:
         model = Payment
@@ -169,8 +399,112 @@ class PaymentSerializer(serializers.ModelSerializer):
         
         return total_amount
 
+class StatementLoanSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Loans
+        fields: List[str] = LoansSerializer.Meta.fields + ["created_at"]
+
+class StatementPaymentSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    """
+        This serializer return the payments with their details, prefetched by the statement
+    """
+
+    paymentdetails = PaymentDetailsSerializer(many=True, read_only=True, source="paymentdetails_set")
+
+    class Meta:
+        model = Payment
+        fields: List[str] = PaymentSerializer.Meta.fields + ["external_id", "paymentdetails"]
+
+class ArchivedLoanSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    """
+        This serializer return the archived loans with the fields of the loans
+    """
 
+    customer = serializers.IntegerField(source="customer_id")
 
+    class Meta:
+        model = ArchivedLoan
+        fields: List[str] = LoansSerializer.Meta.fields
+
+class ArchivedPaymentSerializer(SparseFieldsMixin, DecimalFieldsMixin, serializers.ModelSerializer):
+
+    """
+        This serializer return the archived payments with the fields of the payments
+    """
+
+    customer = serializers.IntegerField(source="customer_id")
+
+    class Meta:
+        model = ArchivedPayment
+        fields: List[str] = PaymentSerializer.Meta.fields
+
+class PaymentSummarySerializer(DecimalFieldsMixin, serializers.ModelSerializer):
+
+    """
+        This serializer return the payments of a customer in a month,
+        with the amount that was not rejected and the rejection rate
+    """
+
+    net_amount = serializers.SerializerMethodField()
+    rejection_rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PaymentMonthlySummary
+        fields: List[str] = [
+            "month", "payments", "total_amount", "rejected", "rejected_amount", "net_amount", "rejection_rate"
+        ]
+
+    def get_net_amount(self, summary: PaymentMonthlySummary) -> str:
+        return DecimalString(summary.total_amount - summary.rejected_amount)
+
+    def get_rejection_rate(self, summary: PaymentMonthlySummary) -> float:
+        return round(summary.rejected / summary.payments, 4) if summary.payments else 0
 
+class JobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Job
+        fields: List[str] = [
+            "id",
+            "kind",
+            "payload",
+            "status",
+            "progress",
+            "total",
+            "result",
+            "error",
+            "attempts",
+            "created_at",
+            "started_at",
+            "finished_at"
+        ]
+        read_only_fields: List[str] = [
+            "status",
+            "progress",
+            "total",
+            "result",
+            "error",
+            "attempts",
+            "started_at",
+            "finished_at"
+        ]
+
+    def validate_kind(self, kind: str) -> str:
+
+        """
+            This method validate that the kind of job has a handler
+
+            :param kind: Kind of the job
+            :type kind: str
+
+            :return: Kind of the job
+            :rtype: str
+        """
 
+        if kind not in HANDLERS:
+            raise serializers.ValidationError(f"The kind of job {kind} does not exist")
 
+        return kind
@@ -0,0 +1,363 @@
+import random
+import time
+from decimal import Decimal
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import OperationalError, models, transaction
+from django.utils import timezone
+
+from . import events, metrics, rollups, sharding
+from .exceptions import ConcurrentUpdateError, LoanError, PaymentError
+from .models import Customers, Loans, Payment, PaymentDetails
+
+#Status of the loans counted in the credit limit and in the debt of a customer: Pending and Active
+CREDIT_LOAN_STATUS: List[int] = [Loans.STATUS_LOAD_CHOICES[0][0], Loans.STATUS_LOAD_CHOICES[1][0]]
+
+#Codes of PostgreSQL when a transaction lost against another one: serialization failure and deadlock
+LOCK_ERROR_CODES: tuple = ("40001", "40P01")
+
+def is_lock_error(error: OperationalError) -> bool:
+
+    """
+        This method return if an error of the database was caused by the lock of another transaction,
+        SQLite fail with database is locked when another process is writing
+
+        :param error: Error of the database
+        :type error: OperationalError
+
+        :return: True when the transaction can be retried
+        :rtype: bool
+    """
+
+    if getattr(error.__cause__, "pgcode", None) in LOCK_ERROR_CODES:
+        return True
+    return "database is locked" in str(error) or "database table is locked" in str(error)
+
+def with_retries(function: Callable) -> Callable:
+
+    """
+        This decorator run the function in a transaction of the current shard
+        and retry it when a compare-and-swap update fails because of a concurrent writer
+        The transactions that fail on the lock of another writer are retried too, after a backoff,
+        only when they are not inside the transaction of the caller
+
+        :param function: Function to run
+        :type function: Callable
+
+        :return: Decorated function
+        :rtype: Callable
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs) -> Any:
+        alias: str = sharding.current_shard()
+        #Inside another transaction the whole transaction failed, it is retried by its owner
+        outermost: bool = not transaction.get_connection(alias).in_atomic_block
+        conflicts: int = 0
+        locks: int = 0
+        while True:
+            try:
+                with transaction.atomic(using=alias):
+                    return function(*args, **kwargs)
+            except ConcurrentUpdateError:
+                #The transaction was rolled back, read again and retry
+                conflicts += 1
+                if conflicts >= settings.CREDICTS_CONCURRENCY_RETRIES:
+                    raise
+            except OperationalError as error:
+                if not outermost or not is_lock_error(error):
+                    raise
+                locks += 1
+                if locks >= settings.CREDICTS_LOCK_RETRIES:
+                    raise ConcurrentUpdateError() from error
+                #The writers that collided wait different times
+                backoff: float = min(settings.CREDICTS_LOCK_BACKOFF_SECONDS * 2 ** (locks - 1), settings.CREDICTS_LOCK_BACKOFF_MAX_SECONDS)
+                time.sleep(backoff * random.uniform(0.5, 1.5))
+
+    return wrapper
+
+def total_debt(customer: Customers) -> Decimal:
+
+    """
+        This method return the total debt of a customer
+
+        :param customer: Customer object
+        :type customer: Customers
+
+        :return: Total debt of the customer
+        :rtype: Decimal
+    """
+
+    #Calculate the total debt
+    total_debt: Decimal = Loans.objects.filter(
+        customer=customer,
+        status__in=CREDIT_LOAN_STATUS
+    ).aggregate(total_debt=models.Sum('outstanding')).get('total_debt', 0)
+
+    return total_debt if total_debt else 0
+
+def total_debts(customer_ids: Iterable[int]) -> Dict[int, Decimal]:
+
+    """
+        This method return the total debt of some customers, with one grouped query
+
+        :param customer_ids: Primary keys of the customers
+        :type customer_ids: Iterable
+
+        :return: Total debt by customer, the customers without debt have 0
+        :rtype: dict
+    """
+
+    debts: Dict[int, Decimal] = {customer_id: Decimal(0) for customer_id in customer_ids}
+    rows = Loans.objects.filter(
+        customer_id__in=list(debts),
+        status__in=CREDIT_LOAN_STATUS
+    ).values("customer_id").annotate(total_debt=models.Sum("outstanding")).values_list("customer_id", "total_debt")
+    for customer_id, total_debt in rows:
+        debts[customer_id] = total_debt or Decimal(0)
+
+    return debts
+
+def balance(customer: Customers) -> Dict[str, Any]:
+
+    """
+        This method return the debt and the available amount of a customer
+
+        :param customer: Customer object
+        :type customer: Customers
+
+        :return: External id, score, available amount and total debt of the customer
+        :rtype: dict
+    """
+
+    #Calculate the total debt
+    customer_debt: Decimal = total_debt(customer)
+
+    return {
+        "external_id": customer.external_id,
+        "score": customer.score,
+        "available_amount": customer.score - customer_debt,
+        "total_debt": customer_debt
+    }
+
+def check_transition(current: Optional[int], status: Optional[int]) -> bool:
+
+    """
+        This method validate the status of a new loan, or the change of status of a loan
+        Pending -> Active -> Paid, and Pending -> Rejected. The loans are paid by the payments
+
+        :param current: Status of the loan, None when the loan is created
+        :type current: int
+        :param status: New status of the loan
+        :type status: int
+
+        :return: True when the loan is taken, the taken date must be set
+        :rtype: bool
+
+        :raises LoanError: When the status is not allowed
+    """
+
+    if current is None:
+        if status == 3:
+            raise LoanError("A loan cant be created how rejected")
+        if status == 4:
+            raise LoanError("A loan cant be created how paid")
+        return status == 2
+
+    if status == 3 and current != 1:
+        raise LoanError("A loan can only be rejected when it is pending")
+    if status == 4:
+        raise LoanError("Dont cant update a loan how paid directly, use the payment endpoint")
+    if status in [1, 2] and current in [3, 4]:
+        raise LoanError("A loan cant be updated how Pending or Active after be rejected or paid")
+
+    return status == 2 and current == 1
+
+def credit_in_use(customer_ids: Iterable[int]) -> Dict[int, Decimal]:
+
+    """
+        This method return the amount of the loans counted in the credit limit
+        of some customers, with one grouped query
+
+        :param customer_ids: Primary keys of the customers
+        :type customer_ids: Iterable
+
+        :return: Amount by customer, the customers without loans have 0
+        :rtype: dict
+    """
+
+    amounts: Dict[int, Decimal] = {customer_id: Decimal(0) for customer_id in customer_ids}
+    rows = Loans.objects.filter(
+        customer_id__in=list(amounts),
+        status__in=CREDIT_LOAN_STATUS
+    ).values("customer_id").annotate(total_amount=models.Sum("amount")).values_list("customer_id", "total_amount")
+    for customer_id, total_amount in rows:
+        amounts[customer_id] = total_amount or Decimal(0)
+
+    return amounts
+
+def apply_payment(
+    customer_id: int,
+    external_id: str,
+    total_amount: Any,
+    paymentdetails: List[Dict[str, Any]]
+) -> Payment:
+
+    """
+        This method create a payment with all the details in the shard of the customer
+        Adicional, update the outstanding of the loans
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+        :param external_id: External id of the payment
+        :type external_id: str
+        :param total_amount: Total amount of the payment
+        :type total_amount: float
+        :param paymentdetails: Loan and amount of every detail of the payment
+        :type paymentdetails: list
+
+        :return: Payment created
+        :rtype: Payment
+
+        :raises PaymentError: When the payment is not valid
+        :raises ConcurrentUpdateError: When the loans keep changing after all the retries
+    """
+
+    with sharding.use_shard(sharding.shard_for_customer(customer_id)):
+        return _apply_payment(customer_id, external_id, total_amount, paymentdetails)
+
+@with_retries
+def _apply_payment(
+    customer_id: int,
+    external_id: str,
+    total_amount: Any,
+    paymentdetails: List[Dict[str, Any]]
+) -> Payment:
+
+    #Get the customer
+    customer: Customers = Customers.objects.get(pk=customer_id)
+    #Get the total debt of the customer
+    customer_debt: Decimal = total_debt(customer)
+
+    #If the customer does not have any debt, dont create the payment
+    if customer_debt == 0:
+        raise PaymentError("The customer does not have any debt")
+
+    #Validate if the amount of the payment is greater than the total debt, dont create the payment
+    if Decimal(str(total_amount)) > customer_debt:
+        raise PaymentError("The amount of the payment is greater than the total debt")
+
+    #Get all the loans of the customer counted in its debt
+    loans_of_customer: Dict[int, Loans] = {
+        loan.id: loan for loan in Loans.objects.filter(
+            customer=customer,
+            status__in=CREDIT_LOAN_STATUS
+        )
+    }
+
+    #Validate that all the payments details are correct
+    #All the loan must exist
+    #The amount of the payment must be less than the outstanding of the loan
+    for payment_detail in paymentdetails:
+        loan_id: int = payment_detail['loan']
+        loan: Loans = loans_of_customer.get(loan_id)
+        #The loan must exist
+        if not loan:
+            raise PaymentError(f"The loan {loan_id} does not exist")
+
+        #The amount of the payment must be less or equal than the outstanding of the loan
+        if Decimal(str(payment_detail['amount'])) > loan.outstanding:
+            raise PaymentError(f"The amount of the payment is greater than the outstanding of the loan {loan_id}")
+
+    #Create the payment
+    payment_instance: Payment = Payment.objects.create(
+        external_id=external_id,
+        total_amount=total_amount,
+        customer=customer
+    )
+    #Count the payment in the summary of its month
+    rollups.record_payment(payment_instance)
+
+    #For all the payment details, create the payment detail and update the outstanding of the loan
+    paid: int = 0
+    for payment_detail in paymentdetails:
+
+        loan: Loans = loans_of_customer[payment_detail['loan']]
+        payment_detail_amount: Decimal = Decimal(str(payment_detail['amount']))
+
+        PaymentDetails.objects.create(
+            amount=payment_detail_amount,
+            loan=loan,
+            payment=payment_instance
+        )
+
+        #Reduce the outstanding of the loan
+        loan.outstanding = loan.outstanding - payment_detail_amount
+        #If the outstanding of the loan is 0, update the status of the loan
+        if loan.outstanding == 0:
+            loan.status = 4
+            paid += 1
+        #Only the outstanding and the status, if the loan changed the payment is retried
+        loan.cas_save(update_fields=["outstanding", "status"])
+
+    #Publish the new balance to the event streams of the customer
+    events.notify(customer.id)
+    metrics.count_on_commit(metrics.PAYMENTS_CREATED)
+    metrics.count_on_commit(metrics.LOANS_PAID, paid)
+
+    return payment_instance
+
+def reject_payment(payment_pk: int) -> Payment:
+
+    """
+        This method reject a payment
+        Aditional, update the information of the loans
+
+        :param payment_pk: Primary key of the payment
+        :type payment_pk: int
+
+        :return: Payment rejected
+        :rtype: Payment
+
+        :raises Payment.DoesNotExist: When the payment does not exist
+        :raises PaymentError: When the payment was rejected previously
+        :raises ConcurrentUpdateError: When the loans keep changing after all the retries
+    """
+
+    with sharding.use_shard(sharding.shard_for_row(Payment, payment_pk)):
+        return _reject_payment(payment_pk)
+
+@with_retries
+def _reject_payment(payment_pk: int) -> Payment:
+
+    payment_instance: Payment = Payment.objects.get(pk=payment_pk)
+
+    #Only one writer can move the payment from completed to rejected
+    rejected: int = Payment.objects.filter(
+        pk=payment_instance.pk,
+        status=0
+    ).update(status=1, updated_at=timezone.now())
+
+    if not rejected:
+        raise PaymentError("The payment was rejected previously")
+
+    payment_instance.status = 1
+    rollups.record_rejection(payment_instance)
+
+    #Get payment details, grouped by loan
+    returned_amounts: Dict[int, Decimal] = {}
+    for detail in PaymentDetails.objects.filter(payment=payment_instance):
+        returned_amounts[detail.loan_id] = returned_amounts.get(detail.loan_id, 0) + detail.amount
+
+    for loan in Loans.objects.filter(id__in=returned_amounts):
+        loan.outstanding = loan.outstanding + returned_amounts[loan.id]
+        loan.status = 1
+        loan.cas_save(update_fields=["outstanding", "status"])
+
+    #Publish the new balance to the event streams of the customer
+    events.notify(payment_instance.customer_id)
+    metrics.count_on_commit(metrics.PAYMENTS_REJECTED)
+
+    return payment_instance
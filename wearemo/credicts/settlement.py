@@ -0,0 +1,170 @@
+import csv
+import json
+from collections import Counter, defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.utils import timezone
+
+from . import sharding
+from .models import Payment
+
+#Lines of the file looked up with one query
+BATCH_SIZE: int = 1000
+#Precision of the amounts of the bank
+CENTS: Decimal = Decimal("0.01")
+
+#Results of a line of the file
+MATCHED: str = "matched"
+MISSING: str = "missing"
+AMOUNT_MISMATCH: str = "amount_mismatch"
+INVALID: str = "invalid"
+
+#Payment candidates: id, amount, date and status
+Candidate = Tuple[int, Decimal, date, int]
+
+
+def parse(rows: Iterable[List[str]]) -> Iterator[Dict[str, Any]]:
+
+    """
+        This method read the lines of a settlement file: external_id, amount and date (YYYY-MM-DD)
+        The header is optional
+
+        :param rows: Rows of the CSV file
+        :type rows: Iterable
+
+        :return: Lines of the file, the invalid lines have an error
+        :rtype: Iterator
+    """
+
+    for number, row in enumerate(rows, start=1):
+        if not row or (number == 1 and row[0].strip().lower() == "external_id"):
+            continue
+
+        line: Dict[str, Any] = {"line": number, "external_id": row[0].strip()}
+        try:
+            line["amount"] = Decimal(row[1].strip()).quantize(CENTS)
+            line["date"] = date.fromisoformat(row[2].strip())
+        except (IndexError, ValueError, InvalidOperation):
+            line["error"] = "The line must have an external id, an amount and a date (YYYY-MM-DD)"
+        yield line
+
+def find_payments(external_ids: List[str]) -> Dict[str, List[Candidate]]:
+
+    """
+        This method return the payments of a batch of external ids, searched in all the shards
+
+        :param external_ids: External ids of the payments
+        :type external_ids: list
+
+        :return: Candidates by external id
+        :rtype: dict
+    """
+
+    payments: Dict[str, List[Candidate]] = defaultdict(list)
+    rows = chain.from_iterable(sharding.fan_out(lambda alias: list(
+        Payment.objects.using(alias).filter(
+            external_id__in=external_ids
+        ).values_list("external_id", "id", "total_amount", "paid_at", "status")
+    )))
+
+    for external_id, payment_id, total_amount, paid_at, payment_status in sorted(rows, key=lambda row: row[1]):
+        payments[external_id].append(
+            (payment_id, Decimal(total_amount).quantize(CENTS), timezone.localtime(paid_at).date(), payment_status)
+        )
+
+    return payments
+
+def classify(line: Dict[str, Any], candidates: List[Candidate]) -> Dict[str, Any]:
+
+    """
+        This method compare a line of the file with the payments of its external id and date
+        The completed payments are preferred to the rejected ones
+
+        :param line: Line of the file
+        :type line: dict
+        :param candidates: Payments with the external id of the line
+        :type candidates: list
+
+        :return: Result of the line
+        :rtype: dict
+    """
+
+    result: Dict[str, Any] = {
+        "line": line["line"],
+        "external_id": line["external_id"],
+    }
+    if "error" in line:
+        result.update(result=INVALID, error=line["error"])
+        return result
+
+    result.update(amount=str(line["amount"]), date=line["date"].isoformat())
+    same_day: List[Candidate] = sorted(
+        [candidate for candidate in candidates if candidate[2] == line["date"]],
+        key=lambda candidate: candidate[3]
+    )
+    if not same_day:
+        result["result"] = MISSING
+        return result
+
+    payment: Candidate = next((candidate for candidate in same_day if candidate[1] == line["amount"]), same_day[0])
+    result.update(
+        result=MATCHED if payment[1] == line["amount"] else AMOUNT_MISMATCH,
+        payment=payment[0],
+        payment_amount=str(payment[1]),
+        payment_status=payment[3]
+    )
+
+    return result
+
+def match(rows: Iterable[List[str]], batch_size: int = BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+
+    """
+        This method match a settlement file against the payments, in batches of lines,
+        only one batch is kept in memory
+
+        :param rows: Rows of the CSV file
+        :type rows: Iterable
+        :param batch_size: Lines looked up with one query
+        :type batch_size: int
+
+        :return: Result of every line
+        :rtype: Iterator
+    """
+
+    lines: Iterator[Dict[str, Any]] = parse(rows)
+    while True:
+        batch: List[Dict[str, Any]] = list(islice(lines, batch_size))
+        if not batch:
+            return
+
+        payments: Dict[str, List[Candidate]] = find_payments(
+            list({line["external_id"] for line in batch if "error" not in line})
+        )
+        for line in batch:
+            yield classify(line, payments.get(line["external_id"], []))
+
+def diff(lines: Iterable[str], include_matched: bool = False) -> Iterator[str]:
+
+    """
+        This method return the diff of a settlement file as JSON lines,
+        the last line is the summary of the results
+
+        :param lines: Lines of the CSV file
+        :type lines: Iterable
+        :param include_matched: Include the matched lines in the diff
+        :type include_matched: bool
+
+        :return: JSON lines
+        :rtype: Iterator
+    """
+
+    summary: Counter = Counter({MATCHED: 0, MISSING: 0, AMOUNT_MISMATCH: 0, INVALID: 0})
+    for result in match(csv.reader(lines)):
+        summary[result["result"]] += 1
+        if include_matched or result["result"] != MATCHED:
+            yield json.dumps(result) + "\n"
+
+    yield json.dumps({"summary": dict(summary)}) + "\n"
@@ -0,0 +1,295 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Type
+
+from django.conf import settings
+from django.db import connections, models
+
+#Models stored in the shard of their customer, the other models live in the default database
+SHARDED_MODELS: Set[str] = {
+    "customers", "loans", "payment", "paymentdetails", "appliedsubmission",
+    "archivedloan", "archivedpayment", "archivedpaymentdetail", "paymentmonthlysummary",
+    "loanadjustment",
+}
+
+#Every shard generate the ids of its rows in its own range, shard k start in k * SHARD_ID_SPAN
+SHARD_ID_SPAN: int = 10 ** 15
+
+#Shard used by the queries of the current request or task
+_current_shard: ContextVar[Optional[str]] = ContextVar("credicts_shard", default=None)
+
+
+def shards() -> List[str]:
+
+    """
+        This method return the databases of the shards, the first one is the default database
+
+        :return: Aliases of the shards
+        :rtype: list
+    """
+
+    return ["default"] + [f"shard_{index}" for index in range(1, settings.CREDICTS_SHARDS)]
+
+def is_sharded(model: Type[models.Model]) -> bool:
+
+    """
+        This method return if the rows of the model are stored in the shards
+
+        :param model: Model class
+        :type model: Model
+
+        :return: True when the model is sharded
+        :rtype: bool
+    """
+
+    return model._meta.app_label == "credicts" and model._meta.model_name in SHARDED_MODELS
+
+def current_shard() -> str:
+
+    """
+        This method return the shard of the current request or task
+
+        :return: Alias of the shard
+        :rtype: str
+    """
+
+    return _current_shard.get() or "default"
+
+def set_shard(alias: Optional[str]) -> Token:
+
+    """
+        This method change the shard of the current context
+
+        :param alias: Alias of the shard
+        :type alias: str
+
+        :return: Token to restore the previous shard
+        :rtype: Token
+    """
+
+    return _current_shard.set(alias)
+
+def reset_shard(token: Token) -> None:
+    _current_shard.reset(token)
+
+@contextmanager
+def use_shard(alias: Optional[str]) -> Iterator[str]:
+
+    """
+        This context manager route the queries of the sharded models to a shard
+
+        :param alias: Alias of the shard
+        :type alias: str
+    """
+
+    token: Token = set_shard(alias)
+    try:
+        yield current_shard()
+    finally:
+        reset_shard(token)
+
+def shard_of_id(pk: Any) -> str:
+
+    """
+        This method return the shard where a row was created, from the range of its id
+
+        :param pk: Primary key of the row
+        :type pk: int
+
+        :return: Alias of the shard
+        :rtype: str
+    """
+
+    aliases: List[str] = shards()
+    try:
+        index: int = int(pk) // SHARD_ID_SPAN
+    except (TypeError, ValueError):
+        return "default"
+
+    return aliases[index] if 0 <= index < len(aliases) else "default"
+
+def shard_for_new_customer(external_id: Any) -> str:
+
+    """
+        This method return the shard of a new customer, from the hash of its external id
+
+        :param external_id: External id of the customer
+        :type external_id: str
+
+        :return: Alias of the shard
+        :rtype: str
+    """
+
+    aliases: List[str] = shards()
+    if len(aliases) == 1:
+        return "default"
+
+    return aliases[zlib.crc32(str(external_id).encode()) % len(aliases)]
+
+def shard_for_customer(customer_id: Any) -> str:
+
+    """
+        This method return the shard that store a customer and all its rows
+        The customers moved by the rebalance have a placement, the others
+        live in the shard where they were created
+
+        :param customer_id: Primary key of the customer
+        :type customer_id: int
+
+        :return: Alias of the shard
+        :rtype: str
+    """
+
+    if len(shards()) == 1:
+        return "default"
+
+    try:
+        customer_id: int = int(customer_id)
+    except (TypeError, ValueError):
+        return "default"
+
+    from .models import CustomerPlacement
+
+    shard: Optional[str] = CustomerPlacement.objects.filter(
+        customer_id=customer_id
+    ).values_list("shard", flat=True).first()
+
+    return shard or shard_of_id(customer_id)
+
+def shards_for_customers(customer_ids: Iterable[int]) -> Dict[int, str]:
+
+    """
+        This method return the shard of some customers, with one query for the placements
+
+        :param customer_ids: Primary keys of the customers
+        :type customer_ids: Iterable
+
+        :return: Alias of the shard by customer
+        :rtype: dict
+    """
+
+    ids: List[int] = list(set(customer_ids))
+    if len(shards()) == 1:
+        return {customer_id: "default" for customer_id in ids}
+
+    from .models import CustomerPlacement
+
+    placements: Dict[int, str] = dict(
+        CustomerPlacement.objects.filter(customer_id__in=ids).values_list("customer_id", "shard")
+    )
+
+    return {customer_id: placements.get(customer_id) or shard_of_id(customer_id) for customer_id in ids}
+
+def shard_for_row(model: Type[models.Model], pk: Any) -> str:
+
+    """
+        This method return the shard that store a row of a sharded model
+        The rows of the moved customers are searched in the other shards
+
+        :param model: Sharded model
+        :type model: Model
+        :param pk: Primary key of the row
+        :type pk: int
+
+        :return: Alias of the shard, the shard of the id when the row does not exist
+        :rtype: str
+    """
+
+    home: str = shard_of_id(pk)
+    if len(shards()) == 1:
+        return home
+
+    for alias in [home] + [alias for alias in shards() if alias != home]:
+        if model._default_manager.using(alias).filter(pk=pk).exists():
+            return alias
+
+    return home
+
+def fan_out(function: Callable[[str], Any]) -> List[Any]:
+
+    """
+        This method run a function in every shard in parallel,
+        or in order when the thread has a transaction open
+
+        :param function: Function that receive the alias of a shard
+        :type function: Callable
+
+        :return: Results of the function, in the order of the shards
+        :rtype: list
+    """
+
+    aliases: List[str] = shards()
+    if len(aliases) == 1 or any(connections[alias].in_atomic_block for alias in aliases):
+        #The connections of other threads do not see the changes of an open transaction,
+        #inside a transaction the shards are read in order with the connections of the thread
+        results: List[Any] = []
+        for alias in aliases:
+            with use_shard(alias):
+                results.append(function(alias))
+        return results
+
+    #The wrappers of the connections of the thread (the queries of the metrics and of the profiles)
+    #also observe the queries of the threads of the pool
+    wrappers: Dict[str, List[Callable]] = {alias: list(connections[alias].execute_wrappers) for alias in aliases}
+
+    def run(alias: str) -> Any:
+        try:
+            with ExitStack() as stack, use_shard(alias):
+                for wrapper in wrappers[alias]:
+                    if wrapper not in connections[alias].execute_wrappers:
+                        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+                return function(alias)
+        finally:
+            #Every thread of the pool open its own connection
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+        return list(executor.map(run, aliases))
+
+def seed_id_sequences(using: str, **kwargs) -> None:
+
+    """
+        This method move the sequences of the sharded tables to the range of the shard,
+        connected to the post_migrate signal
+        SQLite keep the sequences in sqlite_sequence, PostgreSQL in the sequence of every identity column
+
+        :param using: Alias of the migrated database
+        :type using: str
+    """
+
+    from django.apps import apps
+
+    if using not in shards():
+        return
+
+    start: int = shards().index(using) * SHARD_ID_SPAN
+    if not start:
+        return
+
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config("credicts").get_models():
+            if not is_sharded(model):
+                continue
+
+            table: str = model._meta.db_table
+            if connection.vendor == "postgresql":
+                #The next id of the identity column is start + 1, like in SQLite
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, %s), %s) "
+                    "WHERE COALESCE(pg_sequence_last_value(pg_get_serial_sequence(%s, %s)::regclass), 0) < %s",
+                    [table, model._meta.pk.column, start, table, model._meta.pk.column, start]
+                )
+                continue
+
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                [start, table, start]
+            )
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, start, table]
+            )
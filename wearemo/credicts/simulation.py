@@ -0,0 +1,215 @@
+import os
+import tempfile
+import threading
+import time
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import models
+from django.db.models.functions import Coalesce
+
+from . import services, sharding
+from .models import Customers
+
+#Columns of a snapshot of the portfolio
+COLUMNS: List[str] = ["customer_id", "score", "committed", "outstanding"]
+#Customers read from the database in every chunk
+CHUNK_SIZE: int = 10000
+#Matrices of float64 (scenarios x customers) alive at the same time while a group of scenarios is evaluated
+GROUP_MATRICES: int = 6
+#Percentiles of the distributions
+PERCENTILES: List[int] = [5, 25, 50, 75, 95]
+
+
+class Snapshot:
+
+    """
+        This class represent the portfolio in arrays: for every customer the score,
+        the committed amount (the amount of the loans counted in the credit limit)
+        and the outstanding of those loans
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], created_at: float) -> None:
+        self.arrays: Dict[str, np.ndarray] = arrays
+        self.created_at: float = created_at
+
+    def __len__(self) -> int:
+        return len(self.arrays["customer_id"])
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.created_at < settings.CREDICTS_SIMULATION_SNAPSHOT_SECONDS
+
+def _read_shard(alias: str) -> Dict[str, np.ndarray]:
+
+    """
+        This method read the customers of a shard with one grouped query,
+        streamed in chunks and converted to arrays chunk by chunk
+
+        :param alias: Alias of the shard
+        :type alias: str
+
+        :return: Arrays of the shard
+        :rtype: dict
+    """
+
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    credit = models.Q(loans__status__in=services.CREDIT_LOAN_STATUS)
+    rows = Customers.objects.using(alias).annotate(
+        committed=Coalesce(models.Sum("loans__amount", filter=credit), models.Value(0), output_field=amount),
+        outstanding=Coalesce(models.Sum("loans__outstanding", filter=credit), models.Value(0), output_field=amount),
+    ).order_by().values_list("id", "score", "committed", "outstanding").iterator(chunk_size=CHUNK_SIZE)
+
+    chunks: List[np.ndarray] = []
+    while True:
+        chunk: List[Any] = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        chunks.append(np.array(chunk, dtype=np.float64).reshape(-1, len(COLUMNS)))
+
+    table: np.ndarray = np.concatenate(chunks) if chunks else np.empty((0, len(COLUMNS)))
+    arrays: Dict[str, np.ndarray] = {name: table[:, index].copy() for index, name in enumerate(COLUMNS)}
+    arrays["customer_id"] = arrays["customer_id"].astype(np.int64)
+
+    return arrays
+
+def load() -> Snapshot:
+
+    """
+        This method read the portfolio of all the shards in one pass
+
+        :return: Snapshot of the portfolio
+        :rtype: Snapshot
+    """
+
+    parts: List[Dict[str, np.ndarray]] = sharding.fan_out(_read_shard)
+
+    return Snapshot({name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}, time.time())
+
+def _save(snapshot: Snapshot, path: str) -> None:
+    #The file is replaced atomically, the other processes never read a partial snapshot
+    directory: str = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".npz", delete=False) as file:
+        np.savez(file, created_at=np.array(snapshot.created_at), **snapshot.arrays)
+    os.replace(file.name, path)
+
+def _open(path: str) -> Optional[Snapshot]:
+    try:
+        with np.load(path) as data:
+            return Snapshot({name: data[name] for name in COLUMNS}, float(data["created_at"]))
+    except (OSError, KeyError, ValueError):
+        return None
+
+_cache: Dict[str, Snapshot] = {}
+_lock: threading.Lock = threading.Lock()
+
+def snapshot(refresh: bool = False) -> Snapshot:
+
+    """
+        This method return the snapshot of the portfolio, cached in the process
+        and in the file of CREDICTS_SIMULATION_SNAPSHOT_PATH shared by the processes
+        The snapshot is read again from the database when it is older than
+        CREDICTS_SIMULATION_SNAPSHOT_SECONDS
+
+        :param refresh: Read the portfolio from the database
+        :type refresh: bool
+
+        :return: Snapshot of the portfolio
+        :rtype: Snapshot
+    """
+
+    path: Optional[str] = settings.CREDICTS_SIMULATION_SNAPSHOT_PATH
+    with _lock:
+        cached: Optional[Snapshot] = _cache.get("portfolio")
+        if not refresh and cached is not None and cached.is_fresh():
+            return cached
+
+        shared: Optional[Snapshot] = _open(path) if path and not refresh else None
+        if shared is not None and shared.is_fresh():
+            current: Snapshot = shared
+        else:
+            current = load()
+            if path:
+                _save(current, path)
+
+        _cache["portfolio"] = current
+        return current
+
+def _distribution(values: np.ndarray) -> Dict[str, float]:
+    if not len(values):
+        return {}
+    return {f"p{percentile}": round(float(value), 2) for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+def group_size(customers: int) -> int:
+
+    """
+        This method return the scenarios evaluated together, so all the matrices of a group
+        fit in CREDICTS_SIMULATION_MAX_BYTES. One scenario is always evaluated
+
+        :param customers: Customers of the portfolio
+        :type customers: int
+
+        :return: Scenarios of a group
+        :rtype: int
+    """
+
+    scenario_bytes: int = GROUP_MATRICES * np.dtype(np.float64).itemsize * max(customers, 1)
+    return max(1, settings.CREDICTS_SIMULATION_MAX_BYTES // scenario_bytes)
+
+def simulate(portfolio: Snapshot, scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+
+    """
+        This method evaluate scenarios over the portfolio, every scenario change
+        the scores and the outstanding by a percentage
+        The scenarios are evaluated together as matrices (scenarios x customers)
+
+        :param portfolio: Snapshot of the portfolio
+        :type portfolio: Snapshot
+        :param scenarios: Name, score_change and outstanding_change (fractions, -0.1 is a drop of 10%)
+        :type scenarios: list
+
+        :return: Summary of every scenario
+        :rtype: list
+    """
+
+    arrays: Dict[str, np.ndarray] = portfolio.arrays
+    customers: int = len(portfolio)
+    results: List[Dict[str, Any]] = []
+    #The scenarios are grouped so the matrices of a request fit in CREDICTS_SIMULATION_MAX_BYTES
+    size: int = group_size(customers)
+
+    for start in range(0, len(scenarios), size):
+        group: List[Dict[str, Any]] = scenarios[start:start + size]
+        score_factors: np.ndarray = 1 + np.array([float(scenario["score_change"]) for scenario in group])[:, None]
+        outstanding_factors: np.ndarray = 1 + np.array([float(scenario["outstanding_change"]) for scenario in group])[:, None]
+
+        scores: np.ndarray = arrays["score"][None, :] * score_factors
+        debts: np.ndarray = arrays["outstanding"][None, :] * outstanding_factors
+        available: np.ndarray = scores - debts
+        over_limit: np.ndarray = available < 0
+        committed_over: np.ndarray = arrays["committed"][None, :] > scores
+        excess: np.ndarray = np.where(over_limit, -available, 0).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            utilization: np.ndarray = np.where(scores > 0, debts / scores, np.nan)
+
+        for index, scenario in enumerate(group):
+            over: int = int(over_limit[index].sum())
+            results.append({
+                "name": scenario["name"],
+                "score_change": float(scenario["score_change"]),
+                "outstanding_change": float(scenario["outstanding_change"]),
+                "customers": customers,
+                "over_limit": over,
+                "over_limit_ratio": round(over / customers, 6) if customers else 0,
+                "committed_over_limit": int(committed_over[index].sum()),
+                "excess_amount": round(float(excess[index]), 2),
+                "total_debt": round(float(debts[index].sum()), 2),
+                "available_amount": _distribution(available[index]),
+                "utilization": _distribution(utilization[index][~np.isnan(utilization[index])]),
+            })
+
+        #The matrices of the group are released before the next group is allocated
+        del scores, debts, available, over_limit, committed_over, utilization
+
+    return results
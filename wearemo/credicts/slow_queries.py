@@ -0,0 +1,283 @@
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from . import sqlite_store
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+#Log of the slow queries of all the processes, only the last rows are kept
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    alias TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    sql TEXT NOT NULL,
+    params TEXT NOT NULL,
+    view TEXT,
+    frame TEXT,
+    plan TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slow_queries_fingerprint ON slow_queries (fingerprint, duration_ms);
+"""
+
+#Slow queries recorded by the process between two prunes of the log
+PRUNE_EVERY: int = 100
+#Parameters and characters of a query kept in the log
+MAX_PARAMS: int = 50
+MAX_SQL: int = 10000
+#Statements that can be explained without running them
+EXPLAINED: tuple = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+#The literals and the placeholders are replaced, the lists of values are collapsed
+_LITERALS: List[tuple] = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+#Strings of the plans, PostgreSQL write the values of the query in the filters
+_PLAN_STRINGS: re.Pattern = re.compile(r"'(?:[^']|'')*'")
+#Code of the project, the frames of django and the libraries are skipped
+_ROOT: str = str(settings.BASE_DIR) + os.sep
+_recorded: Iterator[int] = itertools.count(1)
+_local: threading.local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite_store.connect(settings.CREDICTS_SLOW_QUERY_DB, SCHEMA)
+
+def fingerprint(sql: str) -> str:
+
+    """
+        This method normalize a query, the queries that only differ
+        in their values have the same fingerprint
+
+        :param sql: SQL of the query
+        :type sql: str
+
+        :return: Normalized SQL
+        :rtype: str
+    """
+
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+def _callers() -> Dict[str, Optional[str]]:
+
+    """
+        This method return the frame of the project that executed the query,
+        and the view or the command that was running
+
+        :return: Frame and view
+        :rtype: dict
+    """
+
+    frame: Optional[str] = None
+    view: Optional[str] = None
+    current = sys._getframe(2)
+    while current is not None:
+        path: str = current.f_code.co_filename
+        if path.startswith(_ROOT) and "site-packages" not in path and path != __file__:
+            name: str = current.f_code.co_name
+            owner: Any = current.f_locals.get("self")
+            if owner is not None:
+                name = f"{type(owner).__name__}.{name}"
+
+            if frame is None:
+                frame = f"{os.path.relpath(path, _ROOT)}:{current.f_lineno} {name}"
+            #The outermost view or command of the stack
+            if path.endswith("views.py") or f"management{os.sep}commands" in path:
+                view = name if path.endswith("views.py") else f"{os.path.basename(path)[:-3]} command"
+        current = current.f_back
+
+    return {"frame": frame, "view": view}
+
+def _explain(connection: Any, sql: str, params: Any) -> List[str]:
+
+    """
+        This method return the plan of a query that already ran, in the same connection
+        The plan is read with the EXPLAIN of the database, the statements are not executed again
+
+        :param connection: Connection of the query
+        :type connection: DatabaseWrapper
+        :param sql: SQL of the query
+        :type sql: str
+        :param params: Parameters of the query
+        :type params: Any
+
+        :return: Lines of the plan
+        :rtype: list
+    """
+
+    if not sql.lstrip().upper().startswith(EXPLAINED):
+        return []
+
+    _local.explaining = True
+    try:
+        #Inside a transaction the plan is read in a savepoint, an error of the EXPLAIN
+        #does not abort the transaction of the caller in PostgreSQL
+        with transaction.atomic(using=connection.alias) if connection.in_atomic_block else nullcontext(), connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            #SQLite return the step in the last column, PostgreSQL in the only column
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [f"The plan could not be read: {error}"]
+    finally:
+        _local.explaining = False
+
+def _params(params: Any) -> str:
+
+    """
+        This method return the parameters of a query saved in the log
+        The values are only saved with CREDICTS_SLOW_QUERY_PARAMS, by default only their types
+        are saved, the parameters can be personal data of the customers
+
+        :param params: Parameters of the query
+        :type params: Any
+
+        :return: JSON of the parameters
+        :rtype: str
+    """
+
+    if not settings.CREDICTS_SLOW_QUERY_PARAMS:
+        if isinstance(params, (list, tuple)):
+            params = [type(value).__name__ for value in params]
+        elif isinstance(params, dict):
+            params = {name: type(value).__name__ for name, value in params.items()}
+        elif params is not None:
+            params = type(params).__name__
+    if isinstance(params, (list, tuple)) and len(params) > MAX_PARAMS:
+        params = [*params[:MAX_PARAMS], f"... {len(params) - MAX_PARAMS} more"]
+    return json.dumps(params, default=str)
+
+def _plan(plan: List[str]) -> str:
+    #Without CREDICTS_SLOW_QUERY_PARAMS the strings written in the plan are redacted too
+    if not settings.CREDICTS_SLOW_QUERY_PARAMS:
+        plan = [_PLAN_STRINGS.sub("'?'", line) for line in plan]
+    return json.dumps(plan)
+
+def record(alias: str, sql: str, params: Any, duration: float, plan: List[str], callers: Dict[str, Optional[str]]) -> None:
+
+    """
+        This method save a slow query in the log and prune the old rows
+        An error of the log is only logged, it never fails the query
+
+        :param alias: Alias of the database
+        :type alias: str
+        :param sql: SQL of the query
+        :type sql: str
+        :param params: Parameters of the query
+        :type params: Any
+        :param duration: Seconds of the query
+        :type duration: float
+        :param plan: Lines of the plan
+        :type plan: list
+        :param callers: Frame and view that executed the query
+        :type callers: dict
+    """
+
+    try:
+        connection: sqlite3.Connection = _connect()
+        connection.execute(
+            "INSERT INTO slow_queries (created_at, alias, fingerprint, duration_ms, sql, params, view, frame, plan) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                time.time(), alias, fingerprint(sql), duration * 1000, sql[:MAX_SQL], _params(params),
+                callers["view"], callers["frame"], _plan(plan)
+            )
+        )
+        if next(_recorded) % PRUNE_EVERY == 0:
+            connection.execute(
+                "DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?",
+                (settings.CREDICTS_SLOW_QUERY_MAX_ROWS,)
+            )
+    except sqlite3.Error:
+        logger.exception("The slow query could not be recorded")
+
+def log_slow_queries(execute: Callable, sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+
+    """
+        This method is a wrapper of the execution of the queries, the queries slower than
+        CREDICTS_SLOW_QUERY_MS are recorded with their plan, their caller and their view
+        The fast queries only pay a clock read
+    """
+
+    started_at: float = time.perf_counter()
+    result: Any = execute(sql, params, many, context)
+    duration: float = time.perf_counter() - started_at
+
+    threshold: float = settings.CREDICTS_SLOW_QUERY_MS
+    if threshold and duration * 1000 >= threshold and not getattr(_local, "explaining", False):
+        connection: Any = context["connection"]
+        #The plan of a batch of statements is not read, it would be the plan of the first one
+        plan: List[str] = [] if many else _explain(connection, sql, params)
+        record(connection.alias, sql, params, duration, plan, _callers())
+
+    return result
+
+def install(sender: Any, connection: Any, **kwargs) -> None:
+
+    """
+        This method install the wrapper in a new connection, so the queries of the requests,
+        the commands and the threads of the shards are logged
+    """
+
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
+
+def ranking(since: Optional[float] = None, limit: int = 20) -> List[Dict[str, Any]]:
+
+    """
+        This method group the slow queries by fingerprint, ranked by their total time
+        Every group has the slowest sample with its plan
+
+        :param since: Timestamp of the first query, None read all the log
+        :type since: float
+        :param limit: Groups returned
+        :type limit: int
+
+        :return: Groups of queries
+        :rtype: list
+    """
+
+    connection: sqlite3.Connection = _connect()
+    connection.row_factory = sqlite3.Row
+    try:
+        groups: List[Dict[str, Any]] = [
+            dict(row) for row in connection.execute(
+                "SELECT fingerprint, COUNT(*) AS count, SUM(duration_ms) AS total_ms, AVG(duration_ms) AS mean_ms, "
+                "MAX(duration_ms) AS max_ms, MAX(created_at) AS last_at FROM slow_queries WHERE created_at >= ? "
+                "GROUP BY fingerprint ORDER BY total_ms DESC LIMIT ?",
+                (since or 0, limit)
+            )
+        ]
+        for group in groups:
+            slowest = connection.execute(
+                "SELECT sql, params, view, frame, plan FROM slow_queries WHERE fingerprint = ? AND created_at >= ? "
+                "ORDER BY duration_ms DESC LIMIT 1",
+                (group["fingerprint"], since or 0)
+            ).fetchone()
+            group["slowest"] = {**dict(slowest), "params": json.loads(slowest["params"]), "plan": json.loads(slowest["plan"])}
+    finally:
+        connection.row_factory = None
+
+    return groups
+
+def clear() -> int:
+    return _connect().execute("DELETE FROM slow_queries").rowcount
@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+from typing import Dict
+
+#Connections of the current thread, one for every database file
+_local: threading.local = threading.local()
+
+
+def connect(path: str, schema: str = "") -> sqlite3.Connection:
+
+    """
+        This method return a connection to a local SQLite file shared by all the workers
+        The connection is reused by the thread and works in autocommit mode,
+        the callers open their own transactions
+
+        :param path: Path of the database file
+        :type path: str
+        :param schema: Statements that create the tables, run when the connection is opened
+        :type schema: str
+
+        :return: Connection to the database
+        :rtype: sqlite3.Connection
+    """
+
+    path: str = str(path)
+    connections: Dict[str, sqlite3.Connection] = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    connection: sqlite3.Connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        #The readers dont block the writer and the commits dont wait for a fsync
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if schema:
+            connection.executescript(schema)
+        connections[path] = connection
+
+    return connection
+
+def close_all() -> None:
+
+    """
+        This method close the connections of the current thread
+    """
+
+    for connection in getattr(_local, "connections", {}).values():
+        connection.close()
+    _local.connections = {}
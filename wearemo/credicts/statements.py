@@ -0,0 +1,216 @@
+import json
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import Customers, Loans, Payment, PaymentDetails
+from .serializers import (CustomersSerializer, StatementLoanSerializer,
+                          StatementPaymentSerializer, parse_fields)
+
+#Sections of a statement, with the serializer of their rows
+SECTIONS: Dict[str, Type[serializers.Serializer]] = {
+    "customer": CustomersSerializer,
+    "loans": StatementLoanSerializer,
+    "payments": StatementPaymentSerializer,
+}
+
+
+def parse_range(params: Dict[str, str]) -> Tuple[Optional[date], Optional[date]]:
+
+    """
+        This method parse the dates of the statement: from and to (YYYY-MM-DD), both inclusive
+
+        :param params: Query params of the request
+        :type params: dict
+
+        :return: First and last day, None when the param is not sent
+        :rtype: tuple
+
+        :raises ValidationError: When a date is invalid or the range is empty
+    """
+
+    field: serializers.DateField = serializers.DateField()
+    days: Dict[str, Optional[date]] = {}
+    errors: Dict[str, List[str]] = {}
+
+    for name in ["from", "to"]:
+        days[name] = None
+        if params.get(name):
+            try:
+                days[name] = field.to_internal_value(params[name])
+            except serializers.ValidationError as error:
+                errors[name] = error.detail
+
+    if not errors and days["from"] and days["to"] and days["from"] > days["to"]:
+        errors["to"] = ["The end of the range must be after its start"]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    return days["from"], days["to"]
+
+def parse_sections(value: Optional[str]) -> Dict[str, Dict]:
+
+    """
+        This method parse the fields of the statement, the paths start with the section
+        Example: "customer.score,loans.id,loans.outstanding,payments.paymentdetails.amount"
+        The sections that are not requested are not read
+
+        :param value: Value of the fields parameter
+        :type value: str
+
+        :return: Fields by section, an empty tree keep all the fields
+        :rtype: dict
+
+        :raises ValidationError: When a section does not exist
+    """
+
+    fields: Optional[Dict[str, Dict]] = parse_fields(value)
+    if fields is None:
+        return {section: {} for section in SECTIONS}
+
+    unknown: List[str] = sorted(set(fields) - set(SECTIONS))
+    if unknown:
+        raise serializers.ValidationError({"fields": f"The sections {', '.join(unknown)} do not exist"})
+
+    return fields
+
+def payments(customer: Customers, first: Optional[date], last: Optional[date]) -> models.QuerySet:
+
+    """
+        This method return the payments of a customer in a range of days,
+        the details of all the payments are read with one query
+
+        :param customer: Customer of the statement
+        :type customer: Customers
+        :param first: First day, inclusive
+        :type first: date
+        :param last: Last day, inclusive
+        :type last: date
+
+        :return: Queryset of payments
+        :rtype: QuerySet
+    """
+
+    queryset: models.QuerySet = Payment.objects.using(customer._state.db).filter(customer=customer)
+    #The days are converted to datetimes, the range can use the index of paid_at
+    if first:
+        queryset = queryset.filter(paid_at__gte=timezone.make_aware(datetime.combine(first, time.min)))
+    if last:
+        queryset = queryset.filter(paid_at__lt=timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)))
+
+    return queryset.prefetch_related(
+        models.Prefetch("paymentdetails_set", queryset=PaymentDetails.objects.order_by("id"))
+    ).order_by("paid_at", "id")
+
+def loans(customer: Customers) -> models.QuerySet:
+    return Loans.objects.using(customer._state.db).filter(customer=customer).order_by("id")
+
+def serialize(
+    queryset: models.QuerySet,
+    serializer_class: Type[serializers.Serializer],
+    fields: Dict[str, Dict],
+    chunk_size: int
+) -> Iterator[Dict[str, Any]]:
+
+    """
+        This method serialize a queryset in chunks, only one chunk is kept in memory
+        The prefetches of the queryset are read once per chunk
+
+        :param queryset: Queryset of the rows
+        :type queryset: QuerySet
+        :param serializer_class: Serializer of the rows
+        :type serializer_class: Serializer
+        :param fields: Requested fields
+        :type fields: dict
+        :param chunk_size: Rows of every chunk
+        :type chunk_size: int
+
+        :return: Serialized rows
+        :rtype: Iterator
+    """
+
+    rows: Iterator[models.Model] = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk: List[models.Model] = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from serializer_class(chunk, many=True, fields=fields).data
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+def stream(document: Iterable[Tuple[str, Any]]) -> Iterator[str]:
+
+    """
+        This method write a JSON object piece by piece,
+        the iterators of the object are written as arrays while they are consumed
+
+        :param document: Keys and values of the object
+        :type document: Iterable
+
+        :return: Pieces of the JSON object
+        :rtype: Iterator
+    """
+
+    yield "{"
+    for index, (key, value) in enumerate(document):
+        yield ("," if index else "") + _dumps(key) + ":"
+        if isinstance(value, Iterator):
+            yield "["
+            for position, item in enumerate(value):
+                yield ("," if position else "") + _dumps(item)
+            yield "]"
+        else:
+            yield _dumps(value)
+    yield "}"
+
+def build(customer: Customers, params: Dict[str, str]) -> Tuple[List[Tuple[str, Any]], bool]:
+
+    """
+        This method build the statement of a customer: its loans, and its payments
+        of a range of days with their details
+        Every section is read with a fixed number of queries, no matter how many payments there are
+
+        :param customer: Customer of the statement
+        :type customer: Customers
+        :param params: Query params: from, to and fields
+        :type params: dict
+
+        :return: Sections of the statement, and if it must be streamed
+        :rtype: tuple
+
+        :raises ValidationError: When the range or a field is invalid
+    """
+
+    first, last = parse_range(params)
+    sections: Dict[str, Dict] = parse_sections(params.get("fields"))
+    #The fields of the rows are checked before the response is started, the error of a streamed statement
+    #or of a statement without rows would not be returned
+    for section in ["loans", "payments"]:
+        if section in sections:
+            SECTIONS[section](fields=sections[section])
+    chunk_size: int = settings.CREDICTS_STATEMENT_CHUNK_SIZE
+
+    document: List[Tuple[str, Any]] = [
+        ("from", first.isoformat() if first else None),
+        ("to", last.isoformat() if last else None),
+    ]
+    large: bool = False
+
+    if "customer" in sections:
+        document.append(("customer", CustomersSerializer(customer, fields=sections["customer"]).data))
+    if "loans" in sections:
+        document.append(("loans", serialize(loans(customer), StatementLoanSerializer, sections["loans"], chunk_size)))
+    if "payments" in sections:
+        queryset: models.QuerySet = payments(customer, first, last)
+        #The count use the index of the customer, the small statements are rendered in one response
+        large = queryset.count() > settings.CREDICTS_STATEMENT_STREAM_AFTER
+        document.append(("payments", serialize(queryset, StatementPaymentSerializer, sections["payments"], chunk_size)))
+
+    return document, large
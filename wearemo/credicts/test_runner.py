@@ -0,0 +1,45 @@
+import os
+import tempfile
+import warnings
+from typing import Dict
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import sqlite_store
+
+#Settings of the local files shared by the processes, and their names in the temporary directory
+SIDE_STORES: Dict[str, str] = {
+    "CREDICTS_THROTTLE_DB": "throttle.sqlite3",
+    "CREDICTS_LOAD_SHEDDING_DB": "load_shedding.sqlite3",
+    "CREDICTS_PAYMENT_QUEUE_DB": "payment_queue.sqlite3",
+    "CREDICTS_EVENTS_DB": "events.sqlite3",
+    "CREDICTS_SLOW_QUERY_DB": "slow_queries.sqlite3",
+    "CREDICTS_SIMULATION_SNAPSHOT_PATH": "simulation.npz",
+    "CREDICTS_PROFILE_DIR": "profiles",
+}
+
+
+class SideStoresTestRunner(DiscoverRunner):
+
+    """
+        This runner point the local files of the feed of events, the queue of payments,
+        the throttle and the other side stores to a temporary directory,
+        the tests do not write the files of the service
+    """
+
+    def setup_test_environment(self, **kwargs) -> None:
+        super().setup_test_environment(**kwargs)
+        self.side_stores: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.side_stores_settings: override_settings = override_settings(**{
+            name: os.path.join(self.side_stores.name, filename) for name, filename in SIDE_STORES.items()
+        })
+        self.side_stores_settings.enable()
+        #The static files are collected when the image is built, the tests use the finders
+        warnings.filterwarnings("ignore", message="No directory at")
+
+    def teardown_test_environment(self, **kwargs) -> None:
+        self.side_stores_settings.disable()
+        sqlite_store.close_all()
+        self.side_stores.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,17 +1,55 @@
 # BEGIN: 1a2b3c4d5e6f
-from typing import Dict, List
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+from unittest import mock, skipUnless
 
+import brotli
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_finished
+from django.db import models
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
-from .models import Customers, Loans, Payment, PaymentDetails
+from . import (accrual, admin, archive, bulk, compression, events, jobs, metrics, pipeline,
+               profiling, rebalance, reconcile, rollups, services, settlement, sharding,
+               simulation, slow_queries, sqlite_store, throttling, warmup)
+from .exceptions import ConcurrentUpdateError, LeaseLostError
+from .middleware import LoadSheddingMiddleware
+from .models import (ArchivedLoan, ArchivedPayment, ArchivedPaymentDetail,
+                     Customers, Job, LoanAdjustment, Loans, Payment,
+                     PaymentDetails, PaymentMonthlySummary)
+from .routers import CustomerShardRouter
 from .serializers import CustomersSerializer
 
+#Queries added with more than one shard: the placement of the customer and the lists read in the other shards
+PLACEMENT_QUERIES: int = 1 if len(sharding.shards()) > 1 else 0
+OTHER_SHARDS: int = len(sharding.shards()) - 1
+
 
 class CustomersViewSetTestCase(TestCase):
+
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
 
@@ -42,7 +80,8 @@ class CustomersViewSetTestCase(TestCase):
         url: str = reverse("customers-list")
         response = self.client.post(url, data_customer)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(Customers.objects.count(), 1)
+        #The customer is created in its shard
+        self.assertEqual(sum(sharding.fan_out(lambda alias: Customers.objects.count())), 1)
 
     def test_create_customer_invalid_status(self):
 
@@ -103,6 +142,9 @@ class CustomersViewSetTestCase(TestCase):
         self.assertEqual(response.data['available_amount'], customer.score - loan.outstanding)
 
 class LoansViewSetTestCase(TestCase):
+
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
 
@@ -146,6 +188,8 @@ class LoansViewSetTestCase(TestCase):
 
 class PaymentViewSetTestCase(TestCase):
 
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
 
@@ -246,4 +290,2675 @@ class PaymentViewSetTestCase(TestCase):
         self.assertEqual(Loans.objects.get(id=loan.id).outstanding, 3500)
 
         response = self.client.post(url, data_payment, format='json')
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ReadyTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def tearDown(self):
+        warmup.reset()
+
+    def test_not_ready_before_warm_up(self):
+
+        """
+            This method test that the process is not ready before the warm-up
+        """
+
+        warmup.reset()
+        response = self.client.get(reverse("ready"))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.data["ready"])
+
+    def test_ready_after_warm_up(self):
+
+        """
+            This method test the startup report after the warm-up
+        """
+
+        report: Dict[str, Any] = warmup.warm_up()
+        self.assertEqual(set(report["phases"]), {"urls", "serializers", "databases", "caches"})
+        self.assertGreater(report["phases"]["urls"]["items"], 0)
+        self.assertGreater(report["phases"]["serializers"]["items"], 0)
+
+        response = self.client.get(reverse("ready"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["ready"])
+        self.assertIn("startup_seconds", response.data)
+
+    @override_settings(WHITENOISE_USE_FINDERS=True)
+    def test_static_files_are_served(self):
+
+        """
+            This method test that the workers serve the static files of the admin and the swagger UI
+        """
+
+        for path in ["admin/css/base.css", "drf-yasg/swagger-ui-dist/swagger-ui-bundle.js"]:
+            response = self.client.get(f"/static/{path}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            b"".join(response.streaming_content)
+            response.close()
+
+class FiltersTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        #Seed customers with loans and payments
+        self.customers: List[Customers] = Customers.objects.bulk_create([
+            Customers(external_id=f"customer-{index}", score=index * 100)
+            for index in range(1, 301)
+        ])
+        Loans.objects.bulk_create([
+            Loans(
+                external_id=f"loan-{customer.id}",
+                customer=customer,
+                amount=50,
+                outstanding=50,
+                status=1 if customer.id % 2 else 2
+            )
+            for customer in self.customers
+        ])
+        Payment.objects.bulk_create([
+            Payment(external_id=f"payment-{customer.id}", customer=customer, total_amount=10)
+            for customer in self.customers
+        ])
+
+    def test_filter_customers_by_score_range(self):
+
+        """
+            This method test the filter of customers by score range
+        """
+
+        url: str = reverse("customers-list")
+        response = self.client.get(url, {"score__gte": 1000, "score__lt": 2000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10)
+
+        response = self.client.get(url, {"score__gte": "a lot"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_loans_by_customer_and_status(self):
+
+        """
+            This method test the filter of loans by customer and status
+        """
+
+        customer: Customers = self.customers[0]
+        url: str = reverse("loans-list")
+
+        response = self.client.get(url, {"customer": customer.id})
+        self.assertEqual([loan["customer"] for loan in response.data], [customer.id])
+
+        response = self.client.get(url, {"status": [1, 2]})
+        self.assertEqual(len(response.data), 300)
+        response = self.client.get(url, {"status": 2})
+        self.assertEqual(len(response.data), 150)
+
+    def test_lookup_by_external_id(self):
+
+        """
+            This method test the lookup of customers, loans and payments by external id
+        """
+
+        customer: Customers = self.customers[10]
+
+        response = self.client.get(reverse("customers-external", args=[customer.external_id]))
+        self.assertEqual(response.data["id"], customer.id)
+        response = self.client.get(reverse("customers-external", args=["unknown"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse("loans-external", args=[f"loan-{customer.id}"]))
+        self.assertEqual([loan["customer"] for loan in response.data], [customer.id])
+
+        response = self.client.get(reverse("payment_external", args=[f"payment-{customer.id}"]))
+        self.assertEqual([payment["customer"] for payment in response.data], [customer.id])
+
+    def test_filters_use_indexes(self):
+
+        """
+            This method test that the filters and lookups use an index
+        """
+
+        querysets: List[Any] = [
+            Customers.objects.filter(external_id="customer-1"),
+            Customers.objects.filter(score__gte=100),
+            Customers.objects.filter(status=1),
+            Loans.objects.filter(external_id="loan-1"),
+            Loans.objects.filter(customer=self.customers[0], status__in=[1, 2]),
+            Loans.objects.filter(taken_at__gte="2020-01-01T00:00:00Z"),
+            Loans.objects.filter(maximum_payment_date__lt="2020-01-01T00:00:00Z"),
+            Payment.objects.filter(external_id="payment-1"),
+        ]
+        if connection.vendor == "postgresql":
+            #The tables of the test are small, the planner would read them sequentially
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        for queryset in querysets:
+            self.assertIn("INDEX", queryset.explain().upper())
+
+class OptimisticConcurrencyTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=4000
+        )
+        self.loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f",
+            customer=self.customer,
+            amount=3500,
+            outstanding=3500,
+        )
+
+    def test_stale_instance_is_not_saved(self):
+
+        """
+            This method test that a stale instance can not overwrite a newer row
+        """
+
+        stale_loan: Loans = Loans.objects.get(id=self.loan.id)
+        self.loan.contract_version = "2"
+        self.loan.cas_save(update_fields=["contract_version"])
+
+        stale_loan.outstanding = 0
+        with self.assertRaises(ConcurrentUpdateError):
+            stale_loan.cas_save(update_fields=["outstanding"])
+
+        loan: Loans = Loans.objects.get(id=self.loan.id)
+        self.assertEqual(loan.version, 1)
+        self.assertEqual(loan.outstanding, 3500)
+
+    def test_update_with_stale_version_conflicts(self):
+
+        """
+            This method test the 409 response when the client sends an old version
+        """
+
+        url: str = reverse("loans-detail", args=[self.loan.id])
+        response = self.client.patch(url, {"contract_version": "2", "version": 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["version"], 1)
+
+        response = self.client.patch(url, {"contract_version": "3", "version": 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Loans.objects.get(id=self.loan.id).contract_version, "2")
+
+    def test_payment_is_retried_on_conflict(self):
+
+        """
+            This method test that a payment is retried when a loan changed concurrently
+        """
+
+        cas_save = Loans.cas_save
+        calls: List[int] = []
+
+        def conflict_once(loan: Loans, update_fields: List[str]) -> None:
+            calls.append(loan.id)
+            if len(calls) == 1:
+                #Another writer updated the loan after it was read
+                Loans.objects.filter(id=loan.id).update(version=models.F("version") + 1)
+            cas_save(loan, update_fields)
+
+        with mock.patch.object(Loans, "cas_save", conflict_once):
+            payment: Payment = services.apply_payment(
+                customer_id=self.customer.id,
+                external_id="1a2b3c4d5e6f",
+                total_amount=500,
+                paymentdetails=[{"loan": self.loan.id, "amount": 500}]
+            )
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Payment.objects.filter(id=payment.id).count(), 1)
+        self.assertEqual(PaymentDetails.objects.count(), 1)
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 3000)
+
+class ThrottlingTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        #Every test use its own buckets
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.settings: override_settings = override_settings(
+            CREDICTS_THROTTLE_DB=os.path.join(self.directory.name, "throttle.sqlite3"),
+            CREDICTS_THROTTLE_RATES={"read": "3/min", "write": "1/min"}
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        sqlite_store.close_all()
+        self.directory.cleanup()
+
+    def test_read_budget(self):
+
+        """
+            This method test that the reads are limited by the read budget
+        """
+
+        url: str = reverse("customers-list")
+        for _ in range(3):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "20")
+
+    def test_write_budget_is_separated(self):
+
+        """
+            This method test that the writes have their own budget
+        """
+
+        url: str = reverse("customers-list")
+        data_customer: Dict[str, Any] = {"external_id": "1a2b3c4d5e6f", "score": 1000}
+
+        response = self.client.post(url, data_customer)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(url, data_customer)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CREDICTS_MAX_PENDING_WRITES=1)
+    def test_load_shedding(self):
+
+        """
+            This method test that the writes are rejected when the workers have too many in progress
+        """
+
+        request_factory: RequestFactory = RequestFactory()
+        context = multiprocessing.get_context("fork")
+        started = context.Event()
+        finish = context.Event()
+
+        def slow_write(request) -> HttpResponse:
+            started.set()
+            finish.wait(10)
+            return HttpResponse()
+
+        def worker() -> None:
+            LoadSheddingMiddleware(slow_write)(request_factory.post("/"))
+
+        with override_settings(CREDICTS_LOAD_SHEDDING_DB=os.path.join(self.directory.name, "load_shedding.sqlite3")):
+            #The other process must open its own connection to the file
+            sqlite_store.close_all()
+            process = context.Process(target=worker)
+            process.start()
+            try:
+                self.assertTrue(started.wait(10))
+
+                middleware: LoadSheddingMiddleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+                response = middleware(request_factory.post("/"))
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertIn("Retry-After", response)
+                self.assertEqual(middleware(request_factory.get("/")).status_code, status.HTTP_200_OK)
+            finally:
+                finish.set()
+                process.join(10)
+
+            self.assertEqual(middleware(request_factory.post("/")).status_code, status.HTTP_200_OK)
+
+    @override_settings(CREDICTS_MAX_PENDING_WRITES=1)
+    def test_streamed_write_keeps_its_slot(self):
+
+        """
+            This method test that a streamed write keeps its slot until the response is closed
+        """
+
+        request_factory: RequestFactory = RequestFactory()
+        with override_settings(CREDICTS_LOAD_SHEDDING_DB=os.path.join(self.directory.name, "load_shedding.sqlite3")):
+            streamed = LoadSheddingMiddleware(lambda request: StreamingHttpResponse(iter([b"line\n"])))(request_factory.post("/"))
+            middleware: LoadSheddingMiddleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+
+            self.assertEqual(b"".join(streamed.streaming_content), b"line\n")
+            self.assertEqual(middleware(request_factory.post("/")).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            #The server close the response, like the test client the connections of the test are kept
+            request_finished.disconnect(close_old_connections)
+            try:
+                streamed.close()
+            finally:
+                request_finished.connect(close_old_connections)
+            self.assertEqual(middleware(request_factory.post("/")).status_code, status.HTTP_200_OK)
+
+    def test_idle_buckets_are_pruned(self):
+
+        """
+            This method test that the buckets unused for longer than the longest period are deleted
+        """
+
+        connection = sqlite_store.connect(os.path.join(self.directory.name, "throttle.sqlite3"), throttling.SCHEMA)
+        connection.execute("INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", ("read:token:old", 0, time.time() - 61))
+        connection.execute("INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", ("read:token:recent", 0, time.time() - 30))
+
+        with mock.patch.object(throttling, "PRUNE_EVERY", 1):
+            self.assertEqual(self.client.get(reverse("customers-list")).status_code, status.HTTP_200_OK)
+
+        keys: List[str] = [row[0] for row in connection.execute("SELECT key FROM buckets ORDER BY key")]
+        self.assertEqual(len(keys), 2)
+        self.assertNotIn("read:token:old", keys)
+        self.assertIn("read:token:recent", keys)
+
+class JobsTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=4000
+        )
+        self.loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f",
+            customer=self.customer,
+            amount=3500,
+            outstanding=3500,
+        )
+
+    def test_enqueue_and_process_job(self):
+
+        """
+            This method test a bulk reversal enqueued from the api and processed by a worker
+        """
+
+        payment: Payment = services.apply_payment(
+            customer_id=self.customer.id,
+            external_id="1a2b3c4d5e6f",
+            total_amount=500,
+            paymentdetails=[{"loan": self.loan.id, "amount": 500}]
+        )
+
+        url: str = reverse("job-list")
+        response = self.client.post(url, {"kind": "reject_payments", "payload": {"payments": [payment.id, 0]}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], 1)
+
+        self.assertEqual(jobs.work("test", once=True), 1)
+
+        response = self.client.get(reverse("job-detail", args=[response.data["id"]]))
+        self.assertEqual(response.data["status"], 3)
+        self.assertEqual(response.data["progress"], 2)
+        self.assertEqual(response.data["result"], {"rejected": 1, "errors": {"0": "The payment does not exist"}})
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 3500)
+
+    def test_unknown_kind(self):
+
+        """
+            This method test that only the registered kinds can be enqueued
+        """
+
+        response = self.client.post(reverse("job-list"), {"kind": "unknown"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_job_is_retried(self):
+
+        """
+            This method test that a failed job is retried until the maximum of attempts
+        """
+
+        job: Job = Job.objects.create(kind="reject_payments", payload={}, max_attempts=2)
+
+        with self.assertLogs("credicts.jobs", level="ERROR"):
+            job = jobs.run(jobs.claim("test"))
+        self.assertEqual(job.status, 1)
+        self.assertIn("KeyError", job.error)
+
+        with self.assertLogs("credicts.jobs", level="ERROR"):
+            job = jobs.run(jobs.claim("test"))
+        self.assertEqual(job.status, 4)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(jobs.claim("test"))
+
+    def test_expired_lease_is_claimed_again(self):
+
+        """
+            This method test that a job whose worker died is claimed by other worker
+        """
+
+        job: Job = jobs.enqueue("reject_payments", {"payments": []})
+        job = jobs.claim("dead-worker")
+        self.assertIsNone(jobs.claim("test"))
+
+        Job.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        claimed: Job = jobs.claim("test")
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.attempts, 2)
+
+        #The first worker lost the lease
+        with self.assertRaises(LeaseLostError):
+            job.report_progress(1)
+
+class JobLeaseTestCase(TransactionTestCase):
+
+    databases = "__all__"
+
+    @override_settings(CREDICTS_JOB_LEASE_SECONDS=1)
+    def test_lease_is_renewed_while_the_handler_runs(self):
+
+        """
+            This method test that a job that runs longer than the lease is not claimed by other worker
+        """
+
+        def slow_handler(job: Job) -> Dict[str, bool]:
+            #The lease would expire twice without the renewal
+            time.sleep(2)
+            return {"claimed": jobs.claim("other") is not None}
+
+        with mock.patch.dict(jobs.HANDLERS, {"slow": slow_handler}):
+            jobs.enqueue("slow")
+            job: Job = jobs.run(jobs.claim("test"))
+
+        self.assertEqual(job.status, 3)
+        self.assertEqual(job.result, {"claimed": False})
+        self.assertEqual(job.attempts, 1)
+
+class LockRetriesTestCase(TransactionTestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=4000)
+        self.loan: Loans = Loans.objects.create(external_id="loan-1", customer=self.customer, amount=1000, outstanding=1000)
+
+    @override_settings(CREDICTS_LOCK_BACKOFF_SECONDS=0.001)
+    def test_payment_is_retried_on_lock(self):
+
+        """
+            This method test that a payment that fail on the lock of another writer is retried,
+            and that it conflicts after all the attempts
+        """
+
+        record_payment = rollups.record_payment
+        failures: List[int] = [2]
+
+        def locked(payment: Payment) -> None:
+            if failures[0]:
+                failures[0] -= 1
+                raise OperationalError("database is locked")
+            record_payment(payment)
+
+        with mock.patch.object(rollups, "record_payment", side_effect=locked):
+            services.apply_payment(self.customer.id, "payment-1", 100, [{"loan": self.loan.id, "amount": 100}])
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 900)
+
+        failures[0] = 100
+        with override_settings(CREDICTS_LOCK_RETRIES=3), mock.patch.object(rollups, "record_payment", side_effect=locked):
+            with self.assertRaises(ConcurrentUpdateError):
+                services.apply_payment(self.customer.id, "payment-2", 100, [{"loan": self.loan.id, "amount": 100}])
+        self.assertEqual(failures[0], 97)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        #The other errors are not retried
+        with mock.patch.object(rollups, "record_payment", side_effect=OperationalError("no such table")):
+            with self.assertRaises(OperationalError):
+                services.apply_payment(self.customer.id, "payment-3", 100, [{"loan": self.loan.id, "amount": 100}])
+
+    @override_settings(CREDICTS_LOCK_BACKOFF_SECONDS=0.01)
+    def test_payment_during_backfill(self):
+
+        """
+            This method test that a payment of a customer whose summaries are being rebuilt
+            waits for the backfill and is counted once
+        """
+
+        services.apply_payment(self.customer.id, "payment-1", 100, [{"loan": self.loan.id, "amount": 100}])
+        #The summary of the month is created by the payment, not updated
+        PaymentMonthlySummary.objects.all().delete()
+        results: Dict[str, Any] = {}
+
+        def pay() -> None:
+            try:
+                results["payment"] = services.apply_payment(self.customer.id, "payment-2", 100, [{"loan": self.loan.id, "amount": 100}])
+            except Exception as error:
+                results["error"] = error
+            finally:
+                connections.close_all()
+
+        summarize = rollups.summarize
+
+        def pay_while_summarizing(alias: str, customer_ids: List[int]) -> List[PaymentMonthlySummary]:
+            #The old summaries were deleted, the payment runs before the new summaries are inserted
+            results["payer"] = threading.Thread(target=pay)
+            results["payer"].start()
+            results["payer"].join(1)
+            return summarize(alias, customer_ids)
+
+        with mock.patch.object(rollups, "summarize", side_effect=pay_while_summarizing):
+            rollups.backfill_shard("default")
+        results["payer"].join(30)
+
+        self.assertNotIn("error", results)
+        summary: PaymentMonthlySummary = PaymentMonthlySummary.objects.get(customer_id=self.customer.id)
+        self.assertEqual((summary.payments, summary.total_amount), (2, 200))
+
+    def test_postgresql_lock_errors(self):
+        serialization: OperationalError = OperationalError("could not serialize access")
+        #psycopg2 keep the code of the error in the exception wrapped by django
+        serialization.__cause__ = Exception("could not serialize access")
+        serialization.__cause__.pgcode = "40001"
+        self.assertTrue(services.is_lock_error(serialization))
+        self.assertFalse(services.is_lock_error(OperationalError("server closed the connection")))
+
+class ShardingTestCase(TestCase):
+
+    databases = "__all__"
+
+    @override_settings(CREDICTS_SHARDS=3)
+    def test_routing(self):
+
+        """
+            This method test the shard of the ids and of the new customers
+        """
+
+        self.assertEqual(sharding.shards(), ["default", "shard_1", "shard_2"])
+        self.assertEqual(sharding.shard_of_id(15), "default")
+        self.assertEqual(sharding.shard_of_id(2 * sharding.SHARD_ID_SPAN + 15), "shard_2")
+        self.assertEqual(sharding.shard_of_id("unknown"), "default")
+
+        shards: List[str] = [sharding.shard_for_new_customer(f"customer-{index}") for index in range(30)]
+        self.assertEqual(set(shards), set(sharding.shards()))
+        self.assertEqual(sharding.shard_for_new_customer("customer-1"), shards[1])
+
+    @override_settings(CREDICTS_SHARDS=3)
+    def test_router(self):
+
+        """
+            This method test that only the customer data is stored in the shards
+        """
+
+        router: CustomerShardRouter = CustomerShardRouter()
+        self.assertTrue(router.allow_migrate("shard_1", "credicts", "loans"))
+        self.assertTrue(router.allow_migrate("default", "credicts", "loans"))
+        self.assertFalse(router.allow_migrate("shard_1", "credicts", "job"))
+        self.assertFalse(router.allow_migrate("shard_1", "auth", "user"))
+
+        with sharding.use_shard("shard_2"):
+            self.assertEqual(router.db_for_write(Payment), "shard_2")
+            self.assertIsNone(router.db_for_write(Job))
+        self.assertEqual(router.db_for_read(Payment), "default")
+
+@skipUnless(len(sharding.shards()) > 1, "Run with CREDICTS_SHARDS=2 or more")
+class ShardedDatabasesTestCase(TransactionTestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+    def create_customer(self, external_id: str) -> int:
+        response = self.client.post(reverse("customers-list"), {"external_id": external_id, "score": 4000})
+        return response.data["id"]
+
+    def test_customer_data_is_stored_in_its_shard(self):
+
+        """
+            This method test that the loans and payments are stored in the shard of the customer
+        """
+
+        external_id: str = next(
+            f"customer-{index}" for index in range(100)
+            if sharding.shard_for_new_customer(f"customer-{index}") != "default"
+        )
+        customer_id: int = self.create_customer(external_id)
+        shard: str = sharding.shard_of_id(customer_id)
+        self.assertNotEqual(shard, "default")
+
+        response = self.client.post(reverse("loans-list"), {"external_id": "loan", "amount": 3500, "customer": customer_id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        loan_id: int = response.data["id"]
+        self.assertEqual(sharding.shard_of_id(loan_id), shard)
+
+        response = self.client.post(reverse("add_payment"), {
+            "customer": customer_id,
+            "external_id": "payment",
+            "total_amount": 500,
+            "paymentdetails": [{"loan": loan_id, "amount": 500}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Payment.objects.using(shard).count(), 1)
+        self.assertEqual(Payment.objects.using("default").count(), 0)
+
+        response = self.client.get(reverse("customers-detail", args=[customer_id]) + "total_debt/")
+        self.assertEqual(response.data["total_debt"], 3000)
+
+        #The lists include the rows of all the shards
+        self.create_customer(next(
+            f"customer-{index}" for index in range(100)
+            if sharding.shard_for_new_customer(f"customer-{index}") == "default"
+        ))
+        response = self.client.get(reverse("customers-list"))
+        self.assertEqual(len(response.data), 2)
+
+    def test_move_customer(self):
+
+        """
+            This method test the move of a customer and its rows to another shard
+        """
+
+        customer_id: int = self.create_customer("customer")
+        source: str = sharding.shard_for_customer(customer_id)
+        target: str = next(alias for alias in sharding.shards() if alias != source)
+
+        response = self.client.post(reverse("loans-list"), {"external_id": "loan", "amount": 3500, "customer": customer_id})
+        loan_id: int = response.data["id"]
+        services.apply_payment(customer_id, "payment", 500, [{"loan": loan_id, "amount": 500}])
+
+        copied: Dict[str, int] = rebalance.move_customer(customer_id, target)
+        self.assertEqual(copied, {
+            "customers": 1, "loans": 1, "payment": 1, "paymentdetails": 1,
+            "archivedloan": 0, "archivedpayment": 0, "archivedpaymentdetail": 0, "paymentmonthlysummary": 1,
+            "loanadjustment": 0,
+        })
+        self.assertEqual(sharding.shard_for_customer(customer_id), target)
+        self.assertEqual(sharding.shard_for_row(Loans, loan_id), target)
+        self.assertFalse(Customers.objects.using(source).filter(id=customer_id).exists())
+
+        response = self.client.get(reverse("loans-detail", args=[loan_id]))
+        self.assertEqual(response.data["outstanding"], "3000.00")
+
+    def test_move_interrupted_before_delete(self):
+
+        """
+            This method test that a move interrupted after the change of the placement
+            delete the rows of the old shard when it is run again
+        """
+
+        customer_id: int = self.create_customer("customer")
+        source: str = sharding.shard_for_customer(customer_id)
+        target: str = next(alias for alias in sharding.shards() if alias != source)
+        response = self.client.post(reverse("loans-list"), {"external_id": "loan", "amount": 3500, "customer": customer_id})
+        loan_id: int = response.data["id"]
+
+        #The delete of the old shard fail after the placement was changed
+        delete_customer_rows = rebalance.delete_customer_rows
+
+        def interrupt(alias: str, pk: int) -> None:
+            if alias == source:
+                raise RuntimeError("Interrupted")
+            delete_customer_rows(alias, pk)
+
+        with mock.patch.object(rebalance, "delete_customer_rows", side_effect=interrupt):
+            with self.assertRaises(RuntimeError):
+                rebalance.move_customer(customer_id, target)
+        #The placement is rolled back with the delete when it is stored in the old shard
+        self.assertEqual(sharding.shard_for_customer(customer_id), source if source == "default" else target)
+        self.assertTrue(Loans.objects.using(source).filter(id=loan_id).exists())
+        self.assertEqual(self.client.get(reverse("loans-detail", args=[loan_id])).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(rebalance.move_customer(customer_id, target), {})
+        self.assertFalse(Customers.objects.using(source).filter(id=customer_id).exists())
+        self.assertFalse(Loans.objects.using(source).filter(id=loan_id).exists())
+        self.assertTrue(Loans.objects.using(target).filter(id=loan_id).exists())
+
+    def test_payment_during_move(self):
+
+        """
+            This method test that a payment sent to the old shard while the rows are copied
+            is not committed there and lost with the rows deleted by the move
+        """
+
+        customer_id: int = self.create_customer("customer")
+        source: str = sharding.shard_for_customer(customer_id)
+        target: str = next(alias for alias in sharding.shards() if alias != source)
+        response = self.client.post(reverse("loans-list"), {"external_id": "loan", "amount": 3500, "customer": customer_id})
+        loan_id: int = response.data["id"]
+
+        results: Dict[str, Any] = {}
+
+        def pay() -> None:
+            try:
+                results["payment"] = services.apply_payment(customer_id, "during", 500, [{"loan": loan_id, "amount": 500}])
+            except Exception as error:
+                results["error"] = error
+            finally:
+                connections.close_all()
+
+        copy = rebalance._copy
+
+        def pay_while_copying(model: Any, filters: Dict[str, Any], copy_source: str, copy_target: str) -> int:
+            if "payer" not in results:
+                #The placement still point to the old shard
+                results["payer"] = threading.Thread(target=pay)
+                results["payer"].start()
+                results["payer"].join(1)
+                results["fenced"] = results["payer"].is_alive() or "error" in results
+            return copy(model, filters, copy_source, copy_target)
+
+        with override_settings(CREDICTS_LOCK_BACKOFF_SECONDS=0.01), mock.patch.object(rebalance, "_copy", side_effect=pay_while_copying):
+            rebalance.move_customer(customer_id, target)
+            results["payer"].join(30)
+
+        #The payment did not commit in the old shard while the move held the fence
+        self.assertTrue(results["fenced"])
+        self.assertFalse(Payment.objects.using(source).filter(external_id="during").exists())
+        #The payment failed, or it was applied in the new shard
+        paid: bool = Payment.objects.using(target).filter(external_id="during").exists()
+        self.assertEqual(paid, "payment" in results)
+        self.assertEqual(Loans.objects.using(target).get(id=loan_id).outstanding, 3000 if paid else 3500)
+
+        services.apply_payment(customer_id, "after", 500, [{"loan": loan_id, "amount": 500}])
+        self.assertTrue(Payment.objects.using(target).filter(external_id="after").exists())
+
+class PaymentPipelineTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=4000
+        )
+        self.loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f",
+            customer=self.customer,
+            amount=3500,
+            outstanding=3500,
+        )
+
+        #Every test use its own queue
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.settings: override_settings = override_settings(
+            CREDICTS_PAYMENT_PIPELINE=True,
+            CREDICTS_PAYMENT_QUEUE_DB=os.path.join(self.directory.name, "payment_queue.sqlite3")
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        sqlite_store.close_all()
+        self.directory.cleanup()
+
+    def submit(self, amount: Any) -> Any:
+        return self.client.post(reverse("add_payment"), {
+            "customer": self.customer.id,
+            "external_id": "1a2b3c4d5e6f",
+            "total_amount": amount,
+            "paymentdetails": [{"loan": self.loan.id, "amount": amount}]
+        }, format='json')
+
+    def test_payments_are_applied_in_batches(self):
+
+        """
+            This method test that the queued payments are applied by the writer
+        """
+
+        accepted = self.submit(500)
+        self.assertEqual(accepted.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Payment.objects.count(), 0)
+        rejected = self.submit(5000)
+
+        response = self.client.get(accepted["Location"])
+        self.assertEqual(response.data["status"], "pending")
+
+        self.assertEqual(pipeline.run_writer(batch_size=10, max_delay=0, once=True), 2)
+
+        response = self.client.get(accepted["Location"])
+        self.assertEqual(response.data["status"], "applied")
+        self.assertEqual(response.data["payment"], Payment.objects.get().id)
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 3000)
+
+        response = self.client.get(rejected["Location"])
+        self.assertEqual(response.data["status"], "failed")
+        self.assertEqual(response.data["message"], "The amount of the payment is greater than the total debt")
+
+    def test_invalid_submission(self):
+
+        """
+            This method test that the submissions are validated before they are queued
+        """
+
+        response = self.client.post(reverse("add_payment"), {"customer": self.customer.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recover_interrupted_batch(self):
+
+        """
+            This method test that a batch interrupted before saving its result is not applied twice
+        """
+
+        self.submit(500)
+        self.submit(700)
+        batch: List[Any] = pipeline.claim_batch(10)
+
+        #The writer stopped after the first payment was committed
+        results = pipeline.apply_batch(batch[:1])
+        self.assertEqual(pipeline.recover(), 2)
+        self.assertEqual(pipeline.get_submission(batch[0][0])["status"], "applied")
+        self.assertEqual(pipeline.get_submission(batch[0][0])["payment"], results[batch[0][0]][1])
+        self.assertEqual(pipeline.get_submission(batch[1][0])["status"], "pending")
+
+        pipeline.run_writer(batch_size=10, max_delay=0, once=True)
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 2300)
+
+    def test_unexpected_error_fails_one_submission(self):
+
+        """
+            This method test that an unexpected error fail its submission and the batch continue,
+            and that the amounts are queued as validated, without the rounding of a float
+        """
+
+        failing = self.submit("0.1")
+        accepted = self.submit(500)
+        self.assertEqual(pipeline.claim_batch(10)[0][1]["total_amount"], "0.1000000000")
+        pipeline.recover()
+
+        apply_payment = services.apply_payment
+
+        def apply_or_fail(**kwargs) -> Payment:
+            if kwargs["total_amount"] == "0.1000000000":
+                raise ValueError("Unexpected")
+            return apply_payment(**kwargs)
+
+        with mock.patch.object(services, "apply_payment", side_effect=apply_or_fail), self.assertLogs("credicts.pipeline", level="ERROR"):
+            self.assertEqual(pipeline.run_writer(batch_size=10, max_delay=0, once=True), 2)
+
+        response = self.client.get(failing["Location"])
+        self.assertEqual((response.data["status"], response.data["message"]), ("failed", "Unexpected"))
+        response = self.client.get(accepted["Location"])
+        self.assertEqual(response.data["status"], "applied")
+        self.assertEqual(Loans.objects.get(id=self.loan.id).outstanding, 3000)
+
+class ReconcileTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=10000
+        )
+        self.loans: List[Loans] = [
+            Loans.objects.create(
+                external_id=f"1a2b3c4d5e6f{index}",
+                customer=self.customer,
+                amount=1000,
+                outstanding=1000,
+            )
+            for index in range(3)
+        ]
+        services.apply_payment(
+            customer_id=self.customer.id,
+            external_id="1a2b3c4d5e6f",
+            total_amount=1300,
+            paymentdetails=[
+                {"loan": self.loans[0].id, "amount": 1000},
+                {"loan": self.loans[1].id, "amount": 300}
+            ]
+        )
+
+    def test_consistent_portfolio(self):
+
+        """
+            This method test that the balances left by the payments have no discrepancies
+        """
+
+        report: Dict[str, Any] = reconcile.reconcile(chunk_size=2)
+        self.assertEqual(report["loans_checked"], 3)
+        self.assertEqual(report["payments_checked"], 1)
+        self.assertEqual(report["customers_checked"], 1)
+        self.assertEqual(report["chunks"], 4)
+        self.assertFalse(any(report["discrepancies"].values()))
+
+    def test_report_and_repair(self):
+
+        """
+            This method test that the drifted loans are reported and repaired
+        """
+
+        Loans.objects.filter(id=self.loans[1].id).update(outstanding=900)
+        Loans.objects.filter(id=self.loans[0].id).update(status=1)
+        Payment.objects.update(total_amount=1200)
+
+        report: Dict[str, Any] = reconcile.reconcile()
+        self.assertEqual(report["discrepancies"], {
+            "outstanding": 1, "status": 1, "payment_total": 1,
+            "customer_debt": 1, "customer_payments": 1, "credit_limit": 0,
+        })
+        self.assertEqual(report["repaired"], 0)
+        self.assertEqual(Loans.objects.get(id=self.loans[1].id).outstanding, 900)
+
+        report = reconcile.reconcile(repair=True, chunk_size=1)
+        self.assertEqual(report["repaired"], 2)
+        self.assertEqual(Loans.objects.get(id=self.loans[1].id).outstanding, 700)
+        self.assertEqual(Loans.objects.get(id=self.loans[0].id).status, 4)
+        self.assertEqual(Loans.objects.get(id=self.loans[0].id).version, self.loans[0].version + 2)
+
+        report = reconcile.reconcile()
+        self.assertEqual(report["discrepancies"], {
+            "outstanding": 0, "status": 0, "payment_total": 1,
+            "customer_debt": 0, "customer_payments": 1, "credit_limit": 0,
+        })
+
+    def test_customer_drift(self):
+
+        """
+            This method test that the payment summaries that drifted from the payments
+            and the customers over their credit limit are reported
+        """
+
+        PaymentMonthlySummary.objects.update(total_amount=1500)
+        Customers.objects.filter(id=self.customer.id).update(score=1500)
+
+        report: Dict[str, Any] = reconcile.reconcile()
+        self.assertEqual(report["discrepancies"], {
+            "outstanding": 0, "status": 0, "payment_total": 0,
+            "customer_debt": 0, "customer_payments": 1, "credit_limit": 1,
+        })
+        self.assertEqual(report["samples"], [{
+            "shard": sharding.shard_of_id(self.customer.id),
+            "customer": self.customer.id,
+            "kinds": ["customer_payments", "credit_limit"],
+            "total_debt": "1700.00",
+            "expected_total_debt": "1700.00",
+            "payments_total": "1300.00",
+            "summaries_total": "1500.00",
+            "credit_in_use": "2000.00",
+            "score": "1500.00",
+        }])
+
+    def test_reconcile_job(self):
+
+        """
+            This method test the reconciliation enqueued as a job
+        """
+
+        job: Job = jobs.enqueue("reconcile", {"chunk_size": 1})
+        jobs.work("test", once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 3)
+        self.assertEqual(job.progress, job.total)
+        self.assertEqual(job.result["loans_checked"], 3)
+
+class SettlementTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=4000
+        )
+        self.loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f",
+            customer=self.customer,
+            amount=3500,
+            outstanding=3500,
+        )
+        for external_id, amount in [("pay-1", 500), ("pay-2", 700)]:
+            services.apply_payment(
+                customer_id=self.customer.id,
+                external_id=external_id,
+                total_amount=amount,
+                paymentdetails=[{"loan": self.loan.id, "amount": amount}]
+            )
+        self.today: str = timezone.localdate().isoformat()
+
+    def test_match_in_batches(self):
+
+        """
+            This method test the classification of the lines, with batches smaller than the file
+        """
+
+        rows: List[List[str]] = [
+            ["external_id", "amount", "date"],
+            ["pay-1", "500.00", self.today],
+            ["pay-2", "650", self.today],
+            ["pay-3", "100", self.today],
+            ["pay-1", "500", "2001-01-01"],
+            ["pay-1", "abc", self.today],
+        ]
+        results: List[Dict[str, Any]] = list(settlement.match(rows, batch_size=2))
+
+        self.assertEqual(
+            [result["result"] for result in results],
+            ["matched", "amount_mismatch", "missing", "missing", "invalid"]
+        )
+        self.assertEqual(results[0]["line"], 2)
+        self.assertEqual(results[1]["payment_amount"], "700.00")
+
+    def test_upload_settlement_file(self):
+
+        """
+            This method test the streamed diff of an uploaded settlement file
+        """
+
+        content: bytes = f"pay-1,500,{self.today}\npay-2,650,{self.today}\n".encode()
+        response = self.client.post(
+            reverse("payment_settlement"),
+            {"file": SimpleUploadedFile("settlement.csv", content)},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        lines: List[Dict[str, Any]] = [
+            json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["external_id"], "pay-2")
+        self.assertEqual(lines[-1]["summary"], {"matched": 1, "missing": 0, "amount_mismatch": 1, "invalid": 0})
+
+        response = self.client.post(reverse("payment_settlement"), {}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ArchiveTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=10000
+        )
+        self.paid: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f1",
+            customer=self.customer,
+            amount=1000,
+            outstanding=1000,
+        )
+        self.open: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f2",
+            customer=self.customer,
+            amount=1000,
+            outstanding=1000,
+        )
+        for external_id, loan, amount in [("pay-1", self.paid, 1000), ("pay-2", self.open, 300)]:
+            services.apply_payment(
+                customer_id=self.customer.id,
+                external_id=external_id,
+                total_amount=amount,
+                paymentdetails=[{"loan": loan.id, "amount": amount}]
+            )
+
+        old = timezone.now() - timedelta(days=400)
+        Payment.objects.update(paid_at=old)
+        Loans.objects.update(updated_at=old)
+
+    def test_archive_closed_history(self):
+
+        """
+            This method test that only the payments of closed loans and the paid loans are archived
+        """
+
+        moved: Dict[str, Dict[str, int]] = archive.archive(older_than_days=365, chunk_size=1)
+        self.assertEqual(moved["default"], {"payment": 1, "paymentdetails": 1, "loans": 1})
+
+        self.assertEqual(list(Payment.objects.values_list("external_id", flat=True)), ["pay-2"])
+        self.assertEqual(list(Loans.objects.values_list("id", flat=True)), [self.open.id])
+        self.assertEqual(ArchivedPayment.objects.get().external_id, "pay-1")
+        self.assertEqual(ArchivedLoan.objects.get().id, self.paid.id)
+        self.assertEqual(ArchivedPaymentDetail.objects.get().loan_id, self.paid.id)
+        self.assertEqual(reconcile.reconcile()["discrepancies"]["outstanding"], 0)
+
+        moved = archive.archive(older_than_days=365)
+        self.assertEqual(moved["default"], {"payment": 0, "paymentdetails": 0, "loans": 0})
+
+    def test_history_is_requested(self):
+
+        """
+            This method test that the archived rows are only returned with history=1
+        """
+
+        archive.archive(older_than_days=365)
+
+        response = self.client.get(reverse("customers-loads", args=[self.customer.id]))
+        self.assertEqual([loan["id"] for loan in response.data], [self.open.id])
+        response = self.client.get(reverse("customers-loads", args=[self.customer.id]), {"history": 1})
+        self.assertEqual([loan["id"] for loan in response.data], [self.paid.id, self.open.id])
+        self.assertEqual(response.data[0]["customer"], self.customer.id)
+
+        response = self.client.get(reverse("customers-payments", args=[self.customer.id]), {"history": 1})
+        self.assertEqual([payment["total_amount"] for payment in response.data], ["1000.0000000000", "300.0000000000"])
+
+        #The rows are merged by id when the id is not requested
+        response = self.client.get(
+            reverse("customers-loads", args=[self.customer.id]), {"history": 1, "fields": "external_id,amount"}
+        )
+        self.assertEqual(response.data, [
+            {"external_id": "1a2b3c4d5e6f1", "amount": "1000.00"},
+            {"external_id": "1a2b3c4d5e6f2", "amount": "1000.00"},
+        ])
+        response = self.client.get(
+            reverse("customers-payments", args=[self.customer.id]), {"history": 1, "fields": "total_amount"}
+        )
+        self.assertEqual(response.data, [{"total_amount": "1000.0000000000"}, {"total_amount": "300.0000000000"}])
+
+    def test_delete_without_archive(self):
+
+        """
+            This method test the purge of the old rows without archiving them
+        """
+
+        archive.archive(older_than_days=365, delete=True)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(ArchivedPayment.objects.count(), 0)
+        self.assertEqual(ArchivedLoan.objects.count(), 0)
+
+    def test_delete_keeps_reconcile(self):
+
+        """
+            This method test that the deleted payments take their loans and their summaries,
+            a payment of a loan with a newer payment is kept
+        """
+
+        loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f3",
+            customer=self.customer,
+            amount=1000,
+            outstanding=1000,
+        )
+        services.apply_payment(
+            customer_id=self.customer.id,
+            external_id="pay-3",
+            total_amount=500,
+            paymentdetails=[{"loan": loan.id, "amount": 500}]
+        )
+        old = timezone.now() - timedelta(days=400)
+        Payment.objects.filter(external_id="pay-3").update(paid_at=old)
+        services.apply_payment(
+            customer_id=self.customer.id,
+            external_id="pay-4",
+            total_amount=500,
+            paymentdetails=[{"loan": loan.id, "amount": 500}]
+        )
+        Loans.objects.update(updated_at=old)
+        rollups.backfill()
+
+        moved: Dict[str, Dict[str, int]] = archive.archive(older_than_days=365, delete=True, chunk_size=1)
+        self.assertEqual(moved["default"], {"payment": 1, "paymentdetails": 1, "loans": 1})
+        self.assertEqual(
+            sorted(Payment.objects.values_list("external_id", flat=True)), ["pay-2", "pay-3", "pay-4"]
+        )
+        self.assertEqual(Loans.objects.get(id=loan.id).status, 4)
+
+        report: Dict[str, Any] = reconcile.reconcile()
+        self.assertFalse(any(report["discrepancies"].values()))
+        reconcile.reconcile(repair=True)
+        self.assertEqual(Loans.objects.get(id=loan.id).status, 4)
+
+    def test_destroy_customer(self):
+
+        """
+            This method test that the customer is deleted with its hot and archived rows
+        """
+
+        archive.archive(older_than_days=365)
+        response = self.client.delete(reverse("customers-detail", args=[self.customer.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        for model in [Customers, Loans, Payment, PaymentDetails, ArchivedLoan, ArchivedPayment, ArchivedPaymentDetail]:
+            self.assertFalse(model.objects.exists())
+
+class AdminTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user: User = User.objects.create_superuser(
+            username="admin",
+            password="admin"
+        )
+        self.client.force_login(self.user)
+
+        self.customers: List[Customers] = [
+            Customers.objects.create(external_id=f"1a2b3c4d5e6f{index}", status=1, score=4000)
+            for index in range(5)
+        ]
+        for customer in self.customers:
+            loan: Loans = Loans.objects.create(
+                external_id=customer.external_id,
+                customer=customer,
+                amount=1000,
+                outstanding=1000,
+            )
+            services.apply_payment(
+                customer_id=customer.id,
+                external_id=customer.external_id,
+                total_amount=100,
+                paymentdetails=[{"loan": loan.id, "amount": 100}]
+            )
+
+    def test_changelists(self):
+
+        """
+            This method test that the changelists render without counting the tables
+        """
+
+        for model in ["customers", "loans", "payment", "paymentdetails"]:
+            response = self.client.get(reverse(f"admin:credicts_{model}_changelist"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse("admin:credicts_loans_changelist"), {"q": "1a2b3c4d5e6f3"})
+        self.assertEqual([loan.external_id for loan in response.context["cl"].result_list], ["1a2b3c4d5e6f3"])
+
+    def test_keyset_pagination(self):
+
+        """
+            This method test that the pages are read after the last id of the previous page
+        """
+
+        url: str = reverse("admin:credicts_customers_changelist")
+        with mock.patch.object(admin.CustomersAdmin, "list_per_page", 2):
+            response = self.client.get(url)
+            cl = response.context["cl"]
+            self.assertEqual([customer.id for customer in cl.result_list], [self.customers[4].id, self.customers[3].id])
+            self.assertEqual(cl.next_cursor, self.customers[3].id)
+            self.assertContains(response, f"?after={self.customers[3].id}")
+
+            response = self.client.get(url, {"after": cl.next_cursor, "status__exact": 1})
+            cl = response.context["cl"]
+            self.assertEqual([customer.id for customer in cl.result_list], [self.customers[2].id, self.customers[1].id])
+            self.assertEqual(cl.result_count, 5)
+
+            response = self.client.get(url, {"after": self.customers[1].id})
+            self.assertIsNone(response.context["cl"].next_cursor)
+
+    def test_delete_customer(self):
+
+        """
+            This method test the deletion of a customer from the admin without the cascade of the ORM
+        """
+
+        customer: Customers = self.customers[0]
+        url: str = reverse("admin:credicts_customers_delete", args=[customer.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url, {"post": "yes"})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(Customers.objects.filter(id=customer.id).exists())
+        self.assertFalse(Loans.objects.filter(customer_id=customer.id).exists())
+
+class EventsTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+        self.token: Token = Token.objects.create(user=self.user)
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=4000
+        )
+        self.loan: Loans = Loans.objects.create(
+            external_id="1a2b3c4d5e6f",
+            customer=self.customer,
+            amount=3500,
+            outstanding=3500,
+        )
+
+        #Every test use its own feed
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.settings: override_settings = override_settings(
+            CREDICTS_EVENTS=True,
+            CREDICTS_EVENTS_DB=os.path.join(self.directory.name, "events.sqlite3"),
+            CREDICTS_EVENTS_POLL_SECONDS=0.01,
+            CREDICTS_EVENTS_HEARTBEAT_SECONDS=0.05
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        sqlite_store.close_all()
+        self.directory.cleanup()
+
+    def test_payments_publish_changes(self):
+
+        """
+            This method test that the committed payments are published in the feed
+        """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment: Payment = services.apply_payment(
+                customer_id=self.customer.id,
+                external_id="1a2b3c4d5e6f",
+                total_amount=500,
+                paymentdetails=[{"loan": self.loan.id, "amount": 500}]
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            services.reject_payment(payment.id)
+
+        self.assertEqual(events.changes_after(0), (2, {self.customer.id}))
+
+        #The changes are not published when the streams are disabled
+        with override_settings(CREDICTS_EVENTS=False), self.captureOnCommitCallbacks(execute=True):
+            services.apply_payment(
+                customer_id=self.customer.id,
+                external_id="1a2b3c4d5e6f",
+                total_amount=500,
+                paymentdetails=[{"loan": self.loan.id, "amount": 500}]
+            )
+        self.assertEqual(events.changes_after(2), (2, set()))
+
+    async def test_stream_balances(self):
+
+        """
+            This method test the stream of a customer: the initial balance, the changes and the heartbeats
+        """
+
+        url: str = reverse("customer_events", args=[self.customer.id])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        #The token is only accepted in the header
+        response = await self.async_client.get(url, {"token": self.token.key})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get(url, headers={"Authorization": "Token " + self.token.key})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        content = response.streaming_content
+        self.assertIn(b'"total_debt": "3500', await content.__anext__())
+        self.assertEqual(await content.__anext__(), b": heartbeat\n\n")
+
+        await sync_to_async(services.apply_payment)(
+            customer_id=self.customer.id,
+            external_id="1a2b3c4d5e6f",
+            total_amount=500,
+            paymentdetails=[{"loan": self.loan.id, "amount": 500}]
+        )
+        await sync_to_async(events.record)(self.customer.id)
+        event: bytes = await content.__anext__()
+        while event.startswith(b":"):
+            event = await content.__anext__()
+        self.assertIn(b'"total_debt": "3000', event)
+
+        #The client disconnects
+        pending = asyncio.ensure_future(content.__anext__())
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertNotIn(self.customer.id, events.broker.subscriptions)
+
+    async def test_stream_with_ticket(self):
+
+        """
+            This method test that a ticket open the stream of its customer once
+        """
+
+        client: APIClient = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        response = await sync_to_async(client.post)(reverse("customer_events_ticket", args=[self.customer.id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ticket: str = response.data["ticket"]
+
+        response = await self.async_client.get(reverse("customer_events", args=[0]), {"ticket": ticket})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        ticket = (await sync_to_async(client.post)(reverse("customer_events_ticket", args=[self.customer.id]))).data["ticket"]
+        url: str = reverse("customer_events", args=[self.customer.id])
+        response = await self.async_client.get(url, {"ticket": ticket})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'"total_debt": "3500', await response.streaming_content.__anext__())
+        await response.streaming_content.aclose()
+
+        #The ticket was used
+        response = await self.async_client.get(url, {"ticket": ticket})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_cancel_on_disconnect(self):
+
+        """
+            This method test that a stream request is cancelled when the client disconnects
+        """
+
+        cancelled: List[bool] = []
+
+        async def application(scope, receive, send):
+            self.assertEqual((await receive())["type"], "http.request")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        messages = iter([{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}])
+
+        async def receive():
+            return next(messages)
+
+        scope: Dict[str, Any] = {"type": "http", "path": f"/api/customer/{self.customer.id}/events"}
+        await asyncio.wait_for(events.cancel_on_disconnect(application)(scope, receive, None), 1)
+        self.assertEqual(cancelled, [True])
+
+class StatementTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=100000
+        )
+        self.loans: List[Loans] = [
+            Loans.objects.create(
+                external_id=f"1a2b3c4d5e6f{number}",
+                customer=self.customer,
+                amount=1000,
+                outstanding=1000,
+            )
+            for number in range(2)
+        ]
+        self.url: str = reverse("customers-statement", kwargs={"pk": self.customer.id})
+
+    def pay(self, count: int) -> None:
+        for number in range(count):
+            services.apply_payment(
+                customer_id=self.customer.id,
+                external_id=f"pay-{number}",
+                total_amount=20,
+                paymentdetails=[{"loan": loan.id, "amount": 10} for loan in self.loans]
+            )
+
+    def test_statement_fixed_queries(self):
+
+        """
+            This method test that the statement embed the details
+            with the same queries for one payment and for many payments
+        """
+
+        self.pay(1)
+        #Token, customer, loans, count of the payments, payments and details
+        with self.assertNumQueries(6 + PLACEMENT_QUERIES):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["payments"][0]["paymentdetails"]), 2)
+
+        self.pay(20)
+        with self.assertNumQueries(6 + PLACEMENT_QUERIES):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data["payments"]), 21)
+        self.assertEqual(len(response.data["loans"]), 2)
+        self.assertEqual(response.data["customer"]["id"], self.customer.id)
+
+    def test_statement_range_and_fields(self):
+
+        """
+            This method test the range of days and the sparse fieldsets
+        """
+
+        self.pay(2)
+        Payment.objects.filter(external_id="pay-0").update(paid_at=timezone.now() - timedelta(days=10))
+        today: str = timezone.localdate().isoformat()
+
+        response = self.client.get(
+            self.url,
+            {"from": today, "to": today, "fields": "loans.id,payments.external_id,payments.paymentdetails.amount"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("customer", response.data)
+        self.assertEqual(response.data["loans"], [{"id": loan.id} for loan in self.loans])
+        self.assertEqual(
+            response.data["payments"],
+            [{"external_id": "pay-1", "paymentdetails": [{"amount": "10.0000000000"}, {"amount": "10.0000000000"}]}]
+        )
+
+        self.assertEqual(self.client.get(self.url, {"fields": "payments.unknown"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"from": today, "to": "2000-01-01"}).status_code, 400)
+
+    @override_settings(CREDICTS_STATEMENT_STREAM_AFTER=2, CREDICTS_STATEMENT_CHUNK_SIZE=2)
+    def test_statement_stream(self):
+
+        """
+            This method test that a large statement is streamed with the same content
+        """
+
+        self.pay(5)
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+
+        statement: Dict[str, Any] = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([payment["external_id"] for payment in statement["payments"]], [f"pay-{number}" for number in range(5)])
+        self.assertTrue(all(len(payment["paymentdetails"]) == 2 for payment in statement["payments"]))
+        self.assertEqual(statement["customer"]["id"], self.customer.id)
+
+    @override_settings(CREDICTS_STATEMENT_STREAM_AFTER=2, CREDICTS_STATEMENT_CHUNK_SIZE=2)
+    def test_unknown_fields_before_stream(self):
+
+        """
+            This method test that an unknown field is rejected before the statement is streamed,
+            and when the section has no rows
+        """
+
+        response = self.client.get(self.url, {"fields": "payments.bogus"})
+        self.assertEqual(response.status_code, 400)
+
+        self.pay(5)
+        response = self.client.get(self.url, {"fields": "payments.bogus"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+
+        Loans.objects.all().delete()
+        Payment.objects.all().delete()
+        response = self.client.get(self.url, {"fields": "loans.bogus"})
+        self.assertEqual(response.status_code, 400)
+
+class FieldsetsTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customers: List[Customers] = [
+            Customers.objects.create(external_id=f"1a2b3c4d5e6f{number}", status=1, score=100000)
+            for number in range(3)
+        ]
+        for customer in self.customers:
+            loan: Loans = Loans.objects.create(
+                external_id=f"loan-{customer.id}",
+                customer=customer,
+                amount=1000,
+                outstanding=1000,
+            )
+            for number in range(2):
+                services.apply_payment(
+                    customer_id=customer.id,
+                    external_id=f"pay-{customer.id}-{number}",
+                    total_amount=10,
+                    paymentdetails=[{"loan": loan.id, "amount": 10}]
+                )
+
+    def test_sparse_fields(self):
+
+        """
+            This method test that only the requested fields are returned and selected
+        """
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("loans-list"), {"fields": "id,outstanding"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data[0]), {"id", "outstanding"})
+        self.assertNotIn("contract_version", queries.captured_queries[-1]["sql"])
+
+        response = self.client.get(reverse("loans-list"), {"fields": "id,unknown"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_expand_without_queries_per_row(self):
+
+        """
+            This method test that the expanded relations are joined or prefetched
+        """
+
+        #Token and loans joined with their customers
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("loans-list"), {"expand": "customer", "fields": "id,customer.external_id"}
+            )
+        self.assertEqual(
+            response.data,
+            [{"id": loan.id, "customer": {"external_id": loan.customer.external_id}} for loan in Loans.objects.order_by("id")]
+        )
+
+        #Token, customer, payments, and details joined with their loans
+        customer: Customers = self.customers[0]
+        with self.assertNumQueries(4 + PLACEMENT_QUERIES):
+            response = self.client.get(
+                reverse("customers-payments", args=[customer.id]),
+                {"expand": "paymentdetails.loan", "fields": "id,paymentdetails.amount,paymentdetails.loan.outstanding"}
+            )
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[1]["paymentdetails"], [{"amount": "10.0000000000", "loan": {"outstanding": "980.00"}}])
+
+        response = self.client.get(reverse("customers-list"), {"expand": "unknown"})
+        self.assertEqual(response.status_code, 400)
+
+class BulkLoansTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(
+            external_id="1a2b3c4d5e6f",
+            status=1,
+            score=1000
+        )
+
+    def test_active_loans_use_the_credit(self):
+
+        """
+            This method test that the active loans are counted in the credit limit and in the debt
+        """
+
+        active: Loans = Loans.objects.create(
+            external_id="active", customer=self.customer, amount=800, outstanding=800, status=2, taken_at=timezone.now()
+        )
+        self.assertEqual(services.credit_in_use([self.customer.id]), {self.customer.id: 800})
+        self.assertEqual(services.total_debt(self.customer), 800)
+
+        response = self.client.post(reverse("loans-list"), {"external_id": "loan", "amount": 300, "customer": self.customer.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("loans-bulk"), [
+            {"external_id": "loan", "amount": 300, "customer": self.customer.id}
+        ], format='json')
+        self.assertEqual(response.data["failed"], 1)
+        self.assertIn("amount", response.data["results"][0]["errors"])
+
+        #An active loan is paid like a pending loan
+        services.apply_payment(self.customer.id, "payment", 800, [{"loan": active.id, "amount": 800}])
+        self.assertEqual(Loans.objects.get(id=active.id).status, 4)
+        self.assertEqual(services.credit_in_use([self.customer.id]), {self.customer.id: 0})
+
+    def test_bulk_create(self):
+
+        """
+            This method test that the credit limit is checked with the loans of the request
+            and that the invalid loans are returned with their errors
+        """
+
+        rows: List[Dict[str, Any]] = [
+            {"external_id": "loan-1", "amount": 600, "customer": self.customer.id},
+            {"external_id": "loan-2", "amount": 600, "customer": self.customer.id},
+            {"external_id": "loan-3", "amount": 400, "customer": self.customer.id, "status": 2},
+            {"external_id": "loan-4", "amount": 100, "customer": self.customer.id, "status": 4},
+            {"external_id": "loan-5", "amount": 100, "customer": 999999},
+            {"external_id": "loan-6", "amount": -1, "customer": self.customer.id},
+        ]
+        #Token, savepoint, customers, amounts in use, insert and release of the savepoint
+        with self.assertNumQueries(6 + PLACEMENT_QUERIES):
+            response = self.client.post(reverse("loans-bulk"), rows, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["succeeded"], response.data["failed"]), (2, 4))
+        results: List[Dict[str, Any]] = response.data["results"]
+        self.assertEqual([result["index"] for result in results], list(range(6)))
+        self.assertIn("amount", results[1]["errors"])
+        self.assertIn("non_field_errors", results[3]["errors"])
+        self.assertIn("customer", results[4]["errors"])
+        self.assertIn("amount", results[5]["errors"])
+
+        active: Loans = Loans.objects.get(id=results[2]["id"])
+        self.assertEqual((active.status, active.outstanding), (2, 400))
+        self.assertIsNotNone(active.taken_at)
+        self.assertEqual(Loans.objects.count(), 2)
+
+    def test_bulk_status(self):
+
+        """
+            This method test the transitions of many loans with grouped updates
+        """
+
+        loans: List[Loans] = Loans.objects.bulk_create([
+            Loans(external_id=f"loan-{number}", customer=self.customer, amount=10, outstanding=10)
+            for number in range(4)
+        ])
+        Loans.objects.filter(id=loans[3].id).update(status=3)
+
+        rows: List[Dict[str, Any]] = [
+            {"id": loans[0].id, "status": 2},
+            {"id": loans[1].id, "status": 2},
+            {"id": loans[2].id, "status": 3, "version": 7},
+            {"id": loans[3].id, "status": 2},
+            {"id": loans[0].id, "status": 3},
+            {"id": 999999, "status": 2},
+        ]
+        response = self.client.post(reverse("loans-bulk-status"), rows, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results: List[Dict[str, Any]] = response.data["results"]
+        self.assertEqual(results[0], {"index": 0, "id": loans[0].id, "version": 1})
+        self.assertIn("version", results[2]["errors"])
+        self.assertIn("status", results[3]["errors"])
+        self.assertIn("id", results[4]["errors"])
+        self.assertIn("id", results[5]["errors"])
+
+        self.assertEqual(
+            list(Loans.objects.order_by("id").values_list("status", flat=True)),
+            [2, 2, 1, 3]
+        )
+        self.assertIsNotNone(Loans.objects.get(id=loans[1].id).taken_at)
+
+        response = self.client.post(reverse("loans-bulk-status"), {"id": loans[0].id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_status_conflict_by_shard(self):
+
+        """
+            This method test that the loans of a shard in conflict are returned with an error,
+            and the loans of the other shards are committed
+        """
+
+        conflicted: Loans = Loans.objects.create(external_id="loan-1", customer=self.customer, amount=10, outstanding=10)
+        with sharding.use_shard(sharding.shards()[-1]):
+            other: Customers = Customers.objects.create(external_id="1a2b3c4d5e6g", status=1, score=1000)
+            committed: Loans = Loans.objects.create(external_id="loan-2", customer=other, amount=10, outstanding=10)
+        transition_in_shard = bulk._transition_in_shard
+
+        def conflict(rows):
+            if sharding.current_shard() == "default":
+                raise ConcurrentUpdateError()
+            return transition_in_shard(rows)
+
+        rows: List[Dict[str, Any]] = [{"id": conflicted.id, "status": 2}, {"id": committed.id, "status": 2}]
+        with mock.patch.object(bulk, "_transition_in_shard", side_effect=conflict):
+            response = self.client.post(reverse("loans-bulk-status"), rows, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results: List[Dict[str, Any]] = response.data["results"]
+        self.assertIn("non_field_errors", results[0]["errors"])
+        self.assertEqual(Loans.objects.get(id=conflicted.id).status, 1)
+        if OTHER_SHARDS:
+            self.assertEqual(results[1], {"index": 1, "id": committed.id, "version": 1})
+            self.assertEqual(Loans.objects.using(sharding.shards()[-1]).get(id=committed.id).status, 2)
+
+class ScoresTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customers: List[Customers] = [
+            Customers.objects.create(external_id=f"customer-{number}", status=1, score=1000)
+            for number in range(3)
+        ]
+        Loans.objects.create(external_id="loan-1", customer=self.customers[0], amount=500, outstanding=500)
+
+    def upload(self, content: str, **params) -> List[Dict[str, Any]]:
+        response = self.client.post(
+            reverse("customer_scores") + ("?" + "&".join(f"{name}={value}" for name, value in params.items()) if params else ""),
+            {"file": SimpleUploadedFile("scores.csv", content.encode())},
+            format="multipart"
+        )
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_import_scores(self):
+
+        """
+            This method test that only the changed customers are updated and
+            that the customers below their debt are reported
+        """
+
+        lines: List[Dict[str, Any]] = self.upload(
+            "external_id,score,preapproved_at\n"
+            "customer-0,300\n"
+            "customer-1,1000,2024-05-01\n"
+            "customer-2,1000\n"
+            "unknown,10\n"
+            "customer-2,abc\n"
+        )
+
+        self.assertEqual(lines[-1]["summary"], {"updated": 2, "unchanged": 1, "missing": 1, "invalid": 1, "below_debt": 1})
+        self.assertEqual(
+            [(line["external_id"], line["result"]) for line in lines[:-1]],
+            [("customer-0", "updated"), ("unknown", "missing"), ("customer-2", "invalid")]
+        )
+        self.assertEqual(lines[0]["debt"], "500.00")
+
+        first, second, third = [Customers.objects.get(id=customer.id) for customer in self.customers]
+        self.assertEqual((first.score, first.version), (300, 1))
+        self.assertEqual(second.preapproved_at.date().isoformat(), "2024-05-01")
+        self.assertEqual((third.score, third.version), (1000, 0))
+
+    def test_dry_run(self):
+
+        """
+            This method test that the dry run does not update the customers
+        """
+
+        lines: List[Dict[str, Any]] = self.upload("customer-0,10\n", all=1, dry_run=1)
+        self.assertEqual(lines[0]["result"], "updated")
+        self.assertTrue(lines[0]["below_debt"])
+        self.assertEqual(Customers.objects.get(id=self.customers[0].id).score, 1000)
+
+    def test_active_loan_is_below_debt(self):
+
+        """
+            This method test that the outstanding of the active loans is counted in the debt
+        """
+
+        Loans.objects.create(
+            external_id="loan-2", customer=self.customers[1], amount=800, outstanding=800,
+            status=2, taken_at=timezone.now()
+        )
+
+        lines: List[Dict[str, Any]] = self.upload("customer-1,700\n")
+        self.assertTrue(lines[0]["below_debt"])
+        self.assertEqual(lines[0]["debt"], "800.00")
+        self.assertEqual(lines[-1]["summary"]["below_debt"], 1)
+
+class SimulationTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        for number, outstanding in enumerate([900, 500, 0]):
+            customer: Customers = Customers.objects.create(external_id=f"customer-{number}", status=1, score=1000)
+            if outstanding:
+                Loans.objects.create(external_id=f"loan-{number}", customer=customer, amount=outstanding, outstanding=outstanding)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        simulation._cache.clear()
+        self.addCleanup(simulation._cache.clear)
+
+    def simulate(self, scenarios: List[Dict[str, Any]], **kwargs) -> Any:
+        with override_settings(CREDICTS_SIMULATION_SNAPSHOT_PATH=os.path.join(self.directory.name, "simulation.npz")):
+            return self.client.post(reverse("portfolio_simulation"), {"scenarios": scenarios, **kwargs}, format="json")
+
+    def test_scenarios(self):
+
+        """
+            This method test the customers over their limit in every scenario
+        """
+
+        response = self.simulate([
+            {"name": "baseline"},
+            {"name": "drop", "score_change": -0.2},
+            {"name": "stress", "score_change": -0.5, "outstanding_change": 0.1},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["snapshot"]["customers"], 3)
+        self.assertEqual([scenario["over_limit"] for scenario in response.data["scenarios"]], [0, 1, 2])
+        #The stress scenario: scores of 500 and debts of 990 and 550
+        self.assertEqual(response.data["scenarios"][2]["excess_amount"], 540)
+        self.assertEqual(response.data["scenarios"][0]["total_debt"], 1400)
+
+    def test_snapshot_is_cached(self):
+
+        """
+            This method test that the snapshot is read once, by the process and from the shared file
+        """
+
+        self.simulate([{"name": "baseline"}])
+        Customers.objects.update(score=100)
+
+        with self.assertNumQueries(1):
+            #Only the token is read
+            response = self.simulate([{"name": "baseline"}])
+        self.assertEqual(response.data["scenarios"][0]["over_limit"], 0)
+
+        simulation._cache.clear()
+        self.assertEqual(self.simulate([{"name": "baseline"}]).data["scenarios"][0]["over_limit"], 0)
+        self.assertEqual(self.simulate([{"name": "baseline"}], refresh=True).data["scenarios"][0]["over_limit"], 2)
+
+    def test_active_loans_are_committed(self):
+
+        """
+            This method test that the active loans are counted in the committed amount and the debt
+        """
+
+        customer: Customers = Customers.objects.get(external_id="customer-2")
+        Loans.objects.create(
+            external_id="loan-2", customer=customer, amount=1200, outstanding=1200,
+            status=2, taken_at=timezone.now()
+        )
+
+        response = self.simulate([{"name": "baseline"}])
+        self.assertEqual(response.data["scenarios"][0]["over_limit"], 1)
+        self.assertEqual(response.data["scenarios"][0]["committed_over_limit"], 1)
+        self.assertEqual(response.data["scenarios"][0]["total_debt"], 2600)
+
+    def test_groups_fit_in_the_memory(self):
+
+        """
+            This method test that the scenarios are grouped by the memory of all their matrices,
+            and that the groups give the same results
+        """
+
+        scenarios: List[Dict[str, Any]] = [{"name": f"drop-{number}", "score_change": -number / 10} for number in range(5)]
+        expected = self.simulate(scenarios).data["scenarios"]
+
+        #Every scenario of 3 customers use 6 matrices of 3 floats
+        with override_settings(CREDICTS_SIMULATION_MAX_BYTES=6 * 8 * 3 * 2):
+            self.assertEqual(simulation.group_size(3), 2)
+            self.assertEqual(simulation.group_size(10 ** 9), 1)
+            self.assertEqual(self.simulate(scenarios).data["scenarios"], expected)
+
+    def test_invalid_scenarios(self):
+        self.assertEqual(self.simulate([]).status_code, 400)
+        self.assertEqual(self.simulate([{"name": "bad", "score_change": -2}]).status_code, 400)
+
+class MetricsTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=4000)
+        self.loan: Loans = Loans.objects.create(external_id="loan-1", customer=self.customer, amount=1000, outstanding=1000)
+
+    def sample(self, name: str, **labels) -> float:
+        return metrics.registry().get_sample_value(name, labels) or 0
+
+    def test_business_counters(self):
+
+        """
+            This method test that the payments and the paid loans are counted when they are committed
+        """
+
+        created: float = self.sample("credicts_payments_created_total")
+        paid: float = self.sample("credicts_loans_paid_total")
+        rejected: float = self.sample("credicts_payments_rejected_total")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment: Payment = services.apply_payment(
+                self.customer.id, "payment-1", 1000, [{"loan": self.loan.id, "amount": 1000}]
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            services.reject_payment(payment.id)
+
+        self.assertEqual(self.sample("credicts_payments_created_total"), created + 1)
+        self.assertEqual(self.sample("credicts_loans_paid_total"), paid + 1)
+        self.assertEqual(self.sample("credicts_payments_rejected_total"), rejected + 1)
+
+    def test_request_histograms(self):
+
+        """
+            This method test the latency and the queries observed by route
+        """
+
+        requests: float = self.sample("credicts_request_duration_seconds_count", route="customers-list", method="GET", status="200")
+        queries: float = self.sample("credicts_db_queries_per_request_sum", route="customers-list")
+
+        self.client.get(reverse("customers-list"))
+
+        self.assertEqual(
+            self.sample("credicts_request_duration_seconds_count", route="customers-list", method="GET", status="200"),
+            requests + 1
+        )
+        #The token and the customers
+        self.assertEqual(self.sample("credicts_db_queries_per_request_sum", route="customers-list"), queries + 2 + OTHER_SHARDS)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'credicts_request_duration_seconds_bucket{le="0.005",method="GET",route="customers-list",status="200"}', response.content)
+
+    @override_settings(CREDICTS_METRICS_TOKEN="scrape")
+    def test_metrics_are_protected(self):
+
+        """
+            This method test that the metrics are only returned to Prometheus, with its token, and to the staff
+        """
+
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(APIClient().get(reverse("metrics")).status_code, 403)
+        self.assertEqual(APIClient().get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer other").status_code, 403)
+        self.assertEqual(APIClient().get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape").status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+class FanOutMetricsTestCase(TransactionTestCase):
+
+    databases = "__all__"
+
+    def test_queries_of_the_threads(self):
+
+        """
+            This method test that the queries of the threads of the shards are observed
+            by the wrappers of the connections of the request
+        """
+
+        timer: metrics.QueryTimer = metrics.QueryTimer()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            counts: List[int] = sharding.fan_out(lambda alias: Customers.objects.count())
+
+        self.assertEqual(counts, [0] * len(sharding.shards()))
+        self.assertEqual(timer.count, len(sharding.shards()))
+
+class SlowQueriesTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=4000)
+        Loans.objects.create(external_id="loan-1", customer=self.customer, amount=1000, outstanding=1000)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        #Every query is slow
+        self.settings_override = override_settings(
+            CREDICTS_SLOW_QUERY_MS=0.000001,
+            CREDICTS_SLOW_QUERY_DB=os.path.join(self.directory.name, "slow_queries.sqlite3")
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slow_queries.fingerprint("SELECT *  FROM loans WHERE id IN (%s, %s, %s) AND status = 1 AND name = 'it''s'"),
+            "SELECT * FROM loans WHERE id IN (...) AND status = ? AND name = ?"
+        )
+
+    def test_slow_queries_are_ranked(self):
+
+        """
+            This method test that the queries are recorded with their plan and their view,
+            and grouped by fingerprint
+        """
+
+        for _ in range(2):
+            self.client.get(reverse("customers-total-debt", kwargs={"pk": self.customer.id}))
+
+        groups: List[Dict[str, Any]] = slow_queries.ranking()
+        debts: Dict[str, Any] = next(group for group in groups if 'SUM("credicts_loans"."outstanding")' in group["fingerprint"])
+
+        self.assertEqual(debts["count"], 2)
+        self.assertEqual(debts["slowest"]["view"], "CustomersViewSet.total_debt")
+        self.assertTrue(debts["slowest"]["frame"].startswith("credicts/services.py"))
+        self.assertTrue(any("credicts_loans" in line for line in debts["slowest"]["plan"]))
+        #The values of the parameters are not saved by default
+        self.assertEqual(debts["slowest"]["params"], ["int"] * (1 + len(services.CREDIT_LOAN_STATUS)))
+
+    def test_params_are_captured(self):
+
+        """
+            This method test that the values of the parameters are saved only with CREDICTS_SLOW_QUERY_PARAMS
+        """
+
+        with override_settings(CREDICTS_SLOW_QUERY_PARAMS=True):
+            self.client.get(reverse("customers-total-debt", kwargs={"pk": self.customer.id}))
+
+        debts: Dict[str, Any] = next(group for group in slow_queries.ranking() if 'SUM("credicts_loans"."outstanding")' in group["fingerprint"])
+        self.assertEqual(debts["slowest"]["params"], [self.customer.id, *services.CREDIT_LOAN_STATUS])
+
+    def test_plan_strings_are_redacted(self):
+        callers: Dict[str, Any] = {"view": None, "frame": None}
+        slow_queries.record("default", "SELECT * FROM a WHERE b = %s", ["customer-1"], 1, ["Filter: ((external_id)::text = 'customer-1'::text)"], callers)
+        with override_settings(CREDICTS_SLOW_QUERY_PARAMS=True):
+            slow_queries.record("default", "SELECT * FROM c WHERE b = %s", ["customer-1"], 0.5, ["Filter: ((external_id)::text = 'customer-1'::text)"], callers)
+
+        redacted, captured = [group["slowest"] for group in slow_queries.ranking()]
+        self.assertEqual((redacted["params"], redacted["plan"]), (["str"], ["Filter: ((external_id)::text = '?'::text)"]))
+        self.assertEqual((captured["params"], captured["plan"]), (["customer-1"], ["Filter: ((external_id)::text = 'customer-1'::text)"]))
+
+    def test_failed_plan_keeps_the_transaction(self):
+
+        """
+            This method test that a plan that can not be read does not abort the transaction of the query
+        """
+
+        with mock.patch.object(connection.ops, "explain_query_prefix", return_value="EXPLAIN (BOGUS)"):
+            with transaction.atomic():
+                customer: Customers = Customers.objects.get(id=self.customer.id)
+                self.assertEqual(Loans.objects.filter(customer=customer).count(), 1)
+
+        customers: Dict[str, Any] = next(group for group in slow_queries.ranking() if 'FROM "credicts_customers"' in group["fingerprint"])
+        self.assertTrue(customers["slowest"]["plan"][0].startswith("The plan could not be read"))
+
+class ProfilingTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test",
+            is_staff=True
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        Customers.objects.create(external_id="customer-1", status=1, score=4000)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.settings_override = override_settings(CREDICTS_PROFILE_DIR=self.directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_profile_on_demand(self):
+
+        """
+            This method test that a staff user can profile a request and read its profile
+        """
+
+        response = self.client.get(reverse("customers-list"), HTTP_X_CREDICTS_PROFILE="1")
+        profile_id: str = response[profiling.RESPONSE_HEADER]
+
+        profile = self.client.get(reverse("profile_detail", kwargs={"profile_id": profile_id})).data
+        self.assertEqual((profile["route"], profile["status"], profile["user"]), ("customers-list", 200, "test"))
+        #The token and the customers
+        self.assertEqual(profile["queries"], 2 + OTHER_SHARDS)
+        self.assertIn("credicts_customers", profile["timeline"][1]["sql"])
+        self.assertTrue(profile["functions"])
+
+        self.assertEqual([item["id"] for item in self.client.get(reverse("profile_list")).data], [profile_id])
+        download = self.client.get(reverse("profile_download", kwargs={"profile_id": profile_id}))
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b"".join(download.streaming_content))
+
+    def test_only_staff_can_profile(self):
+        User.objects.filter(id=self.user.id).update(is_staff=False)
+
+        response = self.client.get(reverse("customers-list") + "?profile=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(profiling.RESPONSE_HEADER, response)
+        self.assertEqual(self.client.get(reverse("profile_list")).status_code, 403)
+
+    @override_settings(CREDICTS_PROFILE_SAMPLE_EVERY=2, CREDICTS_PROFILE_MAX_FILES=1)
+    def test_sampled_profiles(self):
+
+        """
+            This method test that one of every N requests is profiled and that only the last profiles are kept
+        """
+
+        responses = [self.client.get(reverse("customers-list")) for _ in range(4)]
+
+        self.assertEqual([profiling.RESPONSE_HEADER in response for response in responses], [False, True, False, True])
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+        self.assertTrue(profiling.load(responses[3][profiling.RESPONSE_HEADER])["sampled"])
+
+    def test_profiles_with_seconds(self):
+
+        """
+            This method test that the profiles saved with the ids of seconds are listed and pruned first
+        """
+
+        for profile_id in ["20240101T120000-0000000a", "20240101T120001-0000000b"]:
+            for extension in ["json", "prof"]:
+                with open(os.path.join(self.directory.name, f"{profile_id}.{extension}"), "w") as file:
+                    file.write(json.dumps({"id": profile_id}) if extension == "json" else "")
+
+        self.assertEqual([item["id"] for item in self.client.get(reverse("profile_list")).data], ["20240101T120001-0000000b", "20240101T120000-0000000a"])
+        self.assertEqual(self.client.get(reverse("profile_detail", kwargs={"profile_id": "20240101T120000-0000000a"})).status_code, 200)
+
+        with override_settings(CREDICTS_PROFILE_MAX_FILES=2):
+            profile_id: str = self.client.get(reverse("customers-list"), HTTP_X_CREDICTS_PROFILE="1")[profiling.RESPONSE_HEADER]
+        self.assertEqual([item["id"] for item in self.client.get(reverse("profile_list")).data], [profile_id, "20240101T120001-0000000b"])
+
+class PaymentSummaryTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=4000)
+        self.loan: Loans = Loans.objects.create(external_id="loan-1", customer=self.customer, amount=3000, outstanding=3000)
+
+    def pay(self, external_id: str, amount: int) -> Payment:
+        return services.apply_payment(self.customer.id, external_id, amount, [{"loan": self.loan.id, "amount": amount}])
+
+    def test_summaries_are_maintained(self):
+
+        """
+            This method test that the payments and the rejections update the summary of their month,
+            and that the summary is read with one query
+        """
+
+        self.pay("payment-1", 100)
+        rejected: Payment = self.pay("payment-2", 300)
+        services.reject_payment(rejected.id)
+        #A payment of an older month
+        old: Payment = self.pay("payment-3", 50)
+        Payment.objects.filter(id=old.id).update(paid_at=timezone.now() - timedelta(days=62))
+
+        url: str = reverse("customers-payment-summary", kwargs={"pk": self.customer.id})
+        with self.assertNumQueries(2 + PLACEMENT_QUERIES):
+            #The token and the summaries
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        month: Dict[str, Any] = response.data[0]
+        self.assertEqual(month["month"], rollups.month_of(timezone.now()).isoformat())
+        self.assertEqual((month["payments"], month["rejected"], month["rejection_rate"]), (3, 1, 0.3333))
+        self.assertEqual(Decimal(month["net_amount"]), 150)
+
+        #The backfill count the payments in the month when they were paid
+        rollups.backfill()
+        response = self.client.get(url)
+        self.assertEqual([(month["payments"], Decimal(month["total_amount"])) for month in response.data], [(1, 50), (2, 400)])
+        self.assertEqual(self.client.get(url + "?from=2000-01&to=2000-02").data, [])
+
+        #The amounts of the summaries are written as numbers by the compact output
+        compact: Dict[str, Any] = json.loads(self.client.get(url + "?decimals=number").content)[-1]
+        self.assertEqual((compact["total_amount"], compact["net_amount"]), (400.0, 100.0))
+
+    def test_invalid_requests(self):
+        url: str = reverse("customers-payment-summary", kwargs={"pk": self.customer.id})
+        self.assertEqual(self.client.get(url + "?from=2024-13").status_code, 400)
+        self.assertEqual(self.client.get(reverse("customers-payment-summary", kwargs={"pk": 999999})).status_code, 404)
+
+@override_settings(
+    CREDICTS_ACCRUAL_INTEREST_RATE=0.1,
+    CREDICTS_ACCRUAL_LATE_INTEREST_RATE=0.365,
+    CREDICTS_ACCRUAL_LATE_FEE="25",
+    CREDICTS_ACCRUAL_GRACE_DAYS=2
+)
+class AccrualTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        now = timezone.now()
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=10000)
+        self.current: Loans = Loans.objects.create(
+            external_id="loan-1", customer=self.customer, amount=3650, outstanding=3650,
+            taken_at=now - timedelta(days=10), maximum_payment_date=now + timedelta(days=20)
+        )
+        self.late: Loans = Loans.objects.create(
+            external_id="loan-2", customer=self.customer, amount=1000, outstanding=1000,
+            taken_at=now - timedelta(days=40), maximum_payment_date=now - timedelta(days=5)
+        )
+        #Not taken yet
+        self.pending: Loans = Loans.objects.create(external_id="loan-3", customer=self.customer, amount=500, outstanding=500)
+
+    def adjustments(self, loan: Loans) -> Dict[int, Decimal]:
+        return dict(LoanAdjustment.objects.filter(loan_id=loan.id).values_list("kind", "amount"))
+
+    def test_accrue_day(self):
+
+        """
+            This method test the interest and the late fee of a day, and that
+            the accrual and the payments keep the portfolio reconciled
+        """
+
+        today = timezone.localdate()
+        report: Dict[str, Any] = accrual.accrue(chunk_size=1)
+        shard: Dict[str, Any] = report["shards"]["default"]
+        self.assertFalse(report["already_completed"])
+        self.assertEqual((shard["loans"], shard["adjusted"]), (2, 2))
+        self.assertEqual(shard["late_fee"], {"count": 1, "amount": "25.00"})
+
+        self.assertEqual(self.adjustments(self.current), {accrual.INTEREST: Decimal("1.00")})
+        self.assertEqual(
+            self.adjustments(self.late),
+            {accrual.INTEREST: Decimal("0.27"), accrual.LATE_INTEREST: Decimal("1.00"), accrual.LATE_FEE: Decimal("25.00")}
+        )
+        self.assertEqual(Loans.objects.get(id=self.current.id).outstanding, Decimal("3651.00"))
+        self.assertEqual(Loans.objects.get(id=self.late.id).outstanding, Decimal("1026.27"))
+        self.assertEqual(Loans.objects.get(id=self.pending.id).outstanding, 500)
+
+        #A completed day is not accrued again
+        self.assertTrue(accrual.accrue(day=today)["already_completed"])
+        self.assertEqual(LoanAdjustment.objects.count(), 4)
+
+        #The late fee is charged once
+        accrual.accrue(day=today + timedelta(days=1))
+        self.assertEqual(LoanAdjustment.objects.filter(kind=accrual.LATE_FEE).count(), 1)
+        self.assertEqual(LoanAdjustment.objects.filter(loan_id=self.late.id).count(), 5)
+
+        services.apply_payment(self.customer.id, "payment-1", 26, [{"loan": self.late.id, "amount": 26}])
+        self.assertFalse(any(reconcile.reconcile()["discrepancies"].values()))
+
+    def test_accrued_loans_are_payable(self):
+
+        """
+            This method test that the active loans are accrued and that the accrued outstanding
+            can be paid, the loans paid are not accrued again
+        """
+
+        Loans.objects.filter(id__in=[self.current.id, self.late.id]).update(status=2)
+        today = timezone.localdate()
+        accrual.accrue(day=today)
+
+        debt: Decimal = services.total_debt(self.customer)
+        self.assertEqual(debt, Decimal("5177.27"))
+        services.apply_payment(self.customer.id, "payment-1", debt, [
+            {"loan": self.current.id, "amount": Decimal("3651.00")},
+            {"loan": self.late.id, "amount": Decimal("1026.27")},
+            {"loan": self.pending.id, "amount": 500},
+        ])
+        self.assertEqual(list(Loans.objects.order_by("id").values_list("status", "outstanding")), [(4, 0), (4, 0), (4, 0)])
+
+        report: Dict[str, Any] = accrual.accrue(day=today + timedelta(days=1))
+        self.assertEqual(report["shards"]["default"]["loans"], 0)
+        self.assertFalse(any(reconcile.reconcile()["discrepancies"].values()))
+
+    def test_resume_interrupted_run(self):
+
+        """
+            This method test that an interrupted run continue after the last loan of its journal
+        """
+
+        write_outstanding = accrual.write_outstanding
+        written: List[int] = []
+
+        def stop_after_first_chunk(alias: str, loans: List[tuple]) -> None:
+            if written:
+                raise RuntimeError("stopped")
+            written.append(len(loans))
+            write_outstanding(alias, loans)
+
+        with mock.patch.object(accrual, "write_outstanding", side_effect=stop_after_first_chunk):
+            with self.assertRaises(RuntimeError):
+                accrual.accrue(chunk_size=1)
+        self.assertEqual(LoanAdjustment.objects.count(), 1)
+
+        report: Dict[str, Any] = accrual.accrue(chunk_size=1)
+        self.assertEqual(report["shards"]["default"]["resumed_after"], self.current.id)
+        self.assertEqual(report["shards"]["default"]["loans"], 1)
+        self.assertEqual(Loans.objects.get(id=self.current.id).outstanding, Decimal("3651.00"))
+        self.assertEqual(Loans.objects.get(id=self.late.id).outstanding, Decimal("1026.27"))
+
+    def test_accrue_job(self):
+        job: Job = jobs.enqueue("accrue", {"day": timezone.localdate().isoformat()})
+        jobs.work("test", once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 3)
+        self.assertEqual(job.result["shards"]["default"]["adjusted"], 2)
+
+class CompressionTestCase(TestCase):
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+
+        #Create user
+        self.user: User = User.objects.create_user(
+            username="test",
+            password="test"
+        )
+
+        #Login
+        url: str = reverse("api-token-auth")
+        response = self.client.post(url, {"username": "test", "password": "test"}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + response.data['token'])
+
+        self.customer: Customers = Customers.objects.create(external_id="customer-1", status=1, score=10 ** 6)
+        Loans.objects.bulk_create([
+            Loans(external_id=f"loan-{index}", customer=self.customer, amount=100, outstanding=100)
+            for index in range(50)
+        ])
+        self.url: str = reverse("customers-loads", kwargs={"pk": self.customer.id})
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate("gzip, deflate, br"), "br")
+        self.assertEqual(compression.negotiate("gzip, br;q=0.5"), "gzip")
+        self.assertEqual(compression.negotiate("*;q=0.1"), "br")
+        self.assertIsNone(compression.negotiate("identity"))
+        self.assertIsNone(compression.negotiate("gzip;q=0, br;q=0"))
+
+    def test_compressed_responses(self):
+
+        """
+            This method test that the responses are compressed as the client ask for,
+            and that the small responses are sent as they are
+        """
+
+        plain = self.client.get(self.url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 5)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        small = self.client.get(reverse("customers-detail", kwargs={"pk": self.customer.id}), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(small.has_header("Content-Encoding"))
+
+        #The pages carry the CSRF token, they are not compressed
+        middleware = compression.CompressionMiddleware(lambda request: HttpResponse("<p>page</p>" * 1000, content_type="text/html"))
+        self.assertFalse(middleware(RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")).has_header("Content-Encoding"))
+
+    @override_settings(CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES=100)
+    def test_streamed_responses(self):
+
+        """
+            This method test that the streams are compressed while they are sent,
+            and that the event streams are not compressed
+        """
+
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+        middleware = compression.CompressionMiddleware(
+            lambda request: StreamingHttpResponse((f'{{"line": {index}}}\n' for index in range(100)), content_type="application/x-ndjson")
+        )
+        response = middleware(request)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        pieces: List[bytes] = list(response.streaming_content)
+        self.assertGreater(len(pieces), 10)
+        self.assertEqual(gzip.decompress(b"".join(pieces)).decode().count("\n"), 100)
+
+        middleware = compression.CompressionMiddleware(
+            lambda request: StreamingHttpResponse(iter(["data: 1\n\n"]), content_type="text/event-stream")
+        )
+        self.assertFalse(middleware(request).has_header("Content-Encoding"))
+
+    def test_compact_output(self):
+
+        """
+            This method test the null fields omitted, the decimals as numbers and the columns layout
+        """
+
+        row: Dict[str, Any] = json.loads(self.client.get(self.url + "?omit_null=1&decimals=number").content)[0]
+        self.assertNotIn("contract_version", row)
+        self.assertEqual(row["outstanding"], 100.0)
+
+        data: Dict[str, Any] = json.loads(self.client.get(self.url + "?layout=columns").content)
+        self.assertEqual(data["columns"][:3], ["id", "external_id", "amount"])
+        self.assertEqual(len(data["rows"]), 50)
+        self.assertEqual(data["rows"][0][data["columns"].index("outstanding")], "100.00")
+        self.assertIsNone(data["rows"][0][data["columns"].index("contract_version")])
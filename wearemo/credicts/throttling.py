@@ -0,0 +1,190 @@
+import itertools
+import logging
+import math
+import sqlite3
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from . import sqlite_store
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DURATIONS: Dict[str, int] = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+SCHEMA: str = "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL);"
+#Tokens taken by the process between two prunes of the idle buckets
+PRUNE_EVERY: int = 1000
+
+_taken: Iterator[int] = itertools.count(1)
+
+
+def parse_rate(rate: str) -> Tuple[int, int]:
+
+    """
+        This method parse a rate like 100/min
+
+        :param rate: Number of requests and period
+        :type rate: str
+
+        :return: Number of requests and duration of the period in seconds
+        :rtype: tuple
+    """
+
+    num, period = rate.split("/")
+    return int(num), DURATIONS[period[0]]
+
+def idle_seconds() -> int:
+
+    """
+        This method return the seconds after which an unused bucket is full again,
+        the longest period of the rates, a bucket idle for longer is the same as a new bucket
+
+        :return: Seconds
+        :rtype: int
+    """
+
+    return max([parse_rate(rate)[1] for rate in settings.CREDICTS_THROTTLE_RATES.values() if rate] or [0])
+
+class TokenBucketThrottle(BaseThrottle):
+
+    """
+        This throttle limit the requests of every token with a token bucket
+        The buckets are stored in a local SQLite file, so all the workers share them
+
+        Every token has a budget for every endpoint class, by default the read
+        and write classes, a view can use other class with the throttle_scope attribute
+        The budgets are configured in the CREDICTS_THROTTLE_RATES setting
+    """
+
+    def __init__(self) -> None:
+        self.wait_seconds: float = 0
+
+    def get_scope(self, request, view) -> str:
+
+        """
+            This method return the endpoint class of the request
+
+            :param request: Request object
+            :type request: Request
+            :param view: View of the request
+            :type view: APIView
+
+            :return: Endpoint class
+            :rtype: str
+        """
+
+        scope: Optional[str] = getattr(view, "throttle_scope", None)
+        if scope:
+            return scope
+
+        return "read" if request.method in SAFE_METHODS else "write"
+
+    def get_ident(self, request) -> str:
+
+        """
+            This method return the token of the request, or the address for anonymous requests
+
+            :param request: Request object
+            :type request: Request
+
+            :return: Identifier of the client
+            :rtype: str
+        """
+
+        token = getattr(request.auth, "key", None)
+        if token:
+            return f"token:{token}"
+
+        return f"address:{super().get_ident(request)}"
+
+    def allow_request(self, request, view) -> bool:
+
+        """
+            This method take a token from the bucket of the client
+
+            :param request: Request object
+            :type request: Request
+            :param view: View of the request
+            :type view: APIView
+
+            :return: True when the bucket had a token
+            :rtype: bool
+        """
+
+        scope: str = self.get_scope(request, view)
+        rate: Optional[str] = settings.CREDICTS_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+
+        capacity, duration = parse_rate(rate)
+        key: str = f"{scope}:{self.get_ident(request)}"
+
+        try:
+            allowed, self.wait_seconds = self.take(key, capacity, capacity / duration)
+        except sqlite3.Error:
+            #The throttle must not take down the api, the request is allowed
+            logger.exception("The throttle store is not available")
+            return True
+
+        return allowed
+
+    def take(self, key: str, capacity: int, refill_rate: float) -> Tuple[bool, float]:
+
+        """
+            This method refill the bucket and take one token in a single transaction
+
+            :param key: Key of the bucket
+            :type key: str
+            :param capacity: Maximum number of tokens of the bucket
+            :type capacity: int
+            :param refill_rate: Tokens added every second
+            :type refill_rate: float
+
+            :return: If a token was taken, and the seconds until the next token
+            :rtype: tuple
+        """
+
+        connection: sqlite3.Connection = sqlite_store.connect(settings.CREDICTS_THROTTLE_DB, SCHEMA)
+
+        now: float = time.time()
+        #Lock the file for writing, the read and the update are atomic between workers
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens: float = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+
+            allowed: bool = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            #The bucket of every token is kept until it is full again, then it is deleted
+            if next(_taken) % PRUNE_EVERY == 0:
+                connection.execute("DELETE FROM buckets WHERE updated_at < ?", (now - idle_seconds(),))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+    def wait(self) -> Optional[float]:
+
+        """
+            This method return the seconds until the bucket has a token,
+            used for the Retry-After header
+
+            :return: Seconds to wait
+            :rtype: float
+        """
+
+        return math.ceil(self.wait_seconds) if self.wait_seconds else None
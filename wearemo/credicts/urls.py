@@ -1,15 +1,32 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import (CustomersViewSet, LoansViewSet,
-                    create_payment, rejected_payment)
+from .views import (CustomersViewSet, JobsViewSet, LoansViewSet,
+                    create_payment, customer_events, customer_events_ticket,
+                    customer_scores,
+                    payment_by_external_id, payment_settlement,
+                    payment_submission, portfolio_simulation,
+                    profile_detail, profile_download, profile_list, ready,
+                    rejected_payment)
 
 router = routers.DefaultRouter()
 router.register(r'customer', CustomersViewSet)
 router.register(r'loan', LoansViewSet)
+router.register(r'job', JobsViewSet)
 
 urlpatterns = [
+    path("customer/scores", customer_scores, name="customer_scores"),
     path('', include(router.urls)),
     path("payment/add", create_payment, name="add_payment"),
     path("payment/rejecte", rejected_payment, name="rejecte_payment"),
+    path("payment/external/<str:external_id>", payment_by_external_id, name="payment_external"),
+    path("payment/submission/<int:submission_id>", payment_submission, name="payment_submission"),
+    path("payment/settlement", payment_settlement, name="payment_settlement"),
+    path("customer/<int:pk>/events", customer_events, name="customer_events"),
+    path("customer/<int:pk>/events/ticket", customer_events_ticket, name="customer_events_ticket"),
+    path("simulation", portfolio_simulation, name="portfolio_simulation"),
+    path("profile", profile_list, name="profile_list"),
+    path("profile/<str:profile_id>", profile_detail, name="profile_detail"),
+    path("profile/<str:profile_id>/download", profile_download, name="profile_download"),
+    path("ready", ready, name="ready"),
 ]
\ No newline at end of file
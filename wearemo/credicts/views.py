@@ -1,50 +1,243 @@
-from typing import Any, Dict, List
-
+import codecs
+import time
+from datetime import datetime, timezone
+from itertools import chain
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.db import models
+from django.http import (FileResponse, Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
+from django.urls import reverse
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import status, viewsets
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import (action, api_view, parser_classes,
+                                       permission_classes, throttle_classes)
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from . import (archive, bulk, events, fieldsets, pipeline, profiling, rollups,
+               scores, services, settlement, sharding, simulation, statements,
+               warmup)
 from .doc_serializer import (DocCreatePaymentDataSerializer,
                              DocRejectedPaymentDataSerializer)
-from .models import Customers, Loans, Payment, PaymentDetails
-from .serializers import (CustomersSerializer, LoansSerializer,
-                          PaymentSerializer)
+from .exceptions import PaymentError
+from .fieldsets import SparseFieldsetsMixin
+from .filters import QueryParamsFilterMixin
+from .models import (ArchivedLoan, ArchivedPayment, Customers,
+                     CustomerPlacement, Job, Loans, Payment,
+                     PaymentMonthlySummary)
+from .serializers import (ArchivedLoanSerializer, ArchivedPaymentSerializer,
+                          CustomersSerializer, JobSerializer, LoansSerializer,
+                          PaymentSerializer, PaymentSummarySerializer,
+                          SimulationSerializer)
+
+
+def with_history(request) -> bool:
 
+    """
+        This method return if the request ask for the archived rows, with history=1
+
+        :param request: Request object
+        :type request: Request
 
-def _total_debt(customer: Customers) -> float:
+        :return: True when the history is requested
+        :rtype: bool
+    """
+
+    return request.query_params.get("history") in ["1", "true"]
+
+def merge_history(
+    request,
+    serializer_class: Type[serializers.ModelSerializer],
+    queryset: models.QuerySet,
+    archive_serializer_class: Type[serializers.ModelSerializer],
+    archived: models.QuerySet
+) -> List[Dict[str, Any]]:
+
+    """
+        This method serialize the rows of a hot table and its archive table with the requested fields
+        and merge them ordered by id
+        The id is always read for the merge, and removed when it was not requested
+
+        :param request: Request object
+        :type request: Request
+        :param serializer_class: Serializer of the hot rows
+        :type serializer_class: ModelSerializer
+        :param queryset: Hot rows
+        :type queryset: QuerySet
+        :param archive_serializer_class: Serializer of the archived rows
+        :type archive_serializer_class: ModelSerializer
+        :param archived: Archived rows
+        :type archived: QuerySet
+
+        :return: All the rows
+        :rtype: list
+    """
+
+    hot = fieldsets.serializer_for(serializer_class, queryset, request, iterator=True, required=["id"]).data
+    cold = archive_serializer_class(
+        archived, many=True, fields=fieldsets.shared(request, archive_serializer_class, required=["id"])
+    ).data
+    rows: List[Dict[str, Any]] = sorted(chain(hot, cold), key=itemgetter("id"))
+
+    fields, _ = fieldsets.requested(request)
+    if fields is not None and "id" not in fields:
+        for row in rows:
+            del row["id"]
+
+    return rows
+
+class ShardedViewSetMixin:
+
+    """
+        This mixin run the requests of a viewset in the shard of the customer,
+        the list actions run in all the shards in parallel and merge the rows
+    """
+
+    def get_request_shard(self, request) -> Optional[str]:
 
         """
-            This method return the total debt of a customer
+            This method return the shard of the request, None for the default database
+
+            :param request: Request object
+            :type request: Request
+
+            :return: Alias of the shard
+            :rtype: str
+        """
+
+        return None
+
+    def initial(self, request, *args, **kwargs) -> None:
+        super().initial(request, *args, **kwargs)
+        self.shard_token = sharding.set_shard(self.get_request_shard(request))
+
+    def finalize_response(self, request, response, *args, **kwargs) -> Response:
+        if getattr(self, "shard_token", None) is not None:
+            sharding.reset_shard(self.shard_token)
+            self.shard_token = None
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def fan_out(self, queryset: models.QuerySet) -> List[models.Model]:
+
+        """
+            This method evaluate a queryset in all the shards
 
-            :param customer: Customer object
-            :type customer: Customers
+            :param queryset: Queryset to evaluate
+            :type queryset: QuerySet
+
+            :return: Rows of all the shards, ordered by primary key
+            :rtype: list
+        """
+
+        rows: List[List[models.Model]] = sharding.fan_out(lambda alias: list(queryset.using(alias)))
+
+        return sorted(chain.from_iterable(rows), key=attrgetter("pk"))
+
+    def list(self, request, *args, **kwargs) -> Response:
+
+        """
+            This method return the rows of all the shards
+
+            :param request: Request object
+            :type request: Request
 
-            :return: Total debt of the customer
-            :rtype: float
+            :return: Response object
+            :rtype: Response
         """
 
-        #Calculate the total debt
-        total_debt: float = Loans.objects.filter(
-            customer=customer,
-            status__in=[0, 1]
-        ).aggregate(total_debt=models.Sum('outstanding')).get('total_debt', 0)
+        rows: List[models.Model] = self.fan_out(self.filter_queryset(self.get_queryset()))
 
-        return total_debt if total_debt else 0
+        return Response(
+            self.get_serializer(rows, many=True).data,
+            status=status.HTTP_200_OK
+        )
 
-class CustomersViewSet(viewsets.ModelViewSet):
+class CustomersViewSet(ShardedViewSetMixin, SparseFieldsetsMixin, QueryParamsFilterMixin, viewsets.ModelViewSet):
     queryset = Customers.objects.all()
     serializer_class = CustomersSerializer
 
     permission_classes = (IsAuthenticated,)
 
+    filter_fields: Dict[str, serializers.Field] = {
+        "status": serializers.IntegerField(),
+        "score": serializers.DecimalField(max_digits=12, decimal_places=2),
+        "created_at": serializers.DateTimeField(),
+    }
+    range_fields: List[str] = ["score", "created_at"]
+
+    def get_request_shard(self, request) -> Optional[str]:
+
+        if "pk" in self.kwargs:
+            return sharding.shard_for_customer(self.kwargs["pk"])
+        #The new customers are distributed by the hash of the external id
+        if self.action == "create":
+            return sharding.shard_for_new_customer(request.data.get("external_id"))
+
+        return None
+
+    def perform_update(self, serializer: CustomersSerializer) -> None:
+        super().perform_update(serializer)
+        #The score change the available amount
+        events.notify(serializer.instance.id)
+
+    def perform_destroy(self, instance: Customers) -> None:
+
+        """
+            This method delete the customer with all its loans and payments,
+            with chunked statements instead of the cascade of the ORM
+
+            :param instance: Customer to delete
+            :type instance: Customers
+        """
+
+        archive.purge_customer(sharding.current_shard(), instance.pk)
+        CustomerPlacement.objects.filter(customer_id=instance.pk).delete()
+
+    @action(detail=False, methods=['get'], url_path=r'external/(?P<external_id>[^/]+)')
+    def external(self, request, external_id: str) -> Response:
+
+        """
+            This method return a customer by its external id
+
+            :param request: Request object
+            :type request: Request
+            :param external_id: External id of the customer
+            :type external_id: str
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        #Get the customer, the external id is unique
+        customers: List[Customers] = self.fan_out(
+            self.optimize_queryset(Customers.objects.filter(external_id=external_id))
+        )
+        if not customers:
+            raise Http404
+        customer: Customers = customers[0]
+        self.check_object_permissions(request, customer)
+
+        return Response(
+            self.get_serializer(customer).data,
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=True, methods=['get'])
     def payments(self, request, pk) -> Response:
 
         """
             This method return all the payments of a customer
+            With history=1, the archived payments are included
         
             :param request: Request object
             :type request: Request
@@ -59,8 +252,17 @@ class CustomersViewSet(viewsets.ModelViewSet):
         customer: Customers = self.get_object()
         #Get all the payments of the customer
         payments: Payment = Payment.objects.filter(customer=customer)
-        #Serialize the payments
-        payments_serializer: PaymentSerializer = PaymentSerializer(payments, many=True)
+
+        #The archived payments are only read when the history is requested
+        if with_history(request):
+            archived: List[ArchivedPayment] = ArchivedPayment.objects.filter(customer_id=customer.id)
+            return Response(
+                merge_history(request, PaymentSerializer, payments, ArchivedPaymentSerializer, archived),
+                status=status.HTTP_200_OK
+            )
+
+        #Serialize the payments with the requested fields and relations
+        payments_serializer: PaymentSerializer = fieldsets.serializer_for(PaymentSerializer, payments, request, iterator=True)
 
         return Response(
             payments_serializer.data,
@@ -72,6 +274,7 @@ class CustomersViewSet(viewsets.ModelViewSet):
 
         """
             This method return all the loans of a customer
+            With history=1, the archived loans are included
 
             :param request: Request object
             :type request: Request
@@ -86,14 +289,84 @@ class CustomersViewSet(viewsets.ModelViewSet):
         customer: Customers = self.get_object()
         #Get all the loans of the customer
         loans: Loans = Loans.objects.filter(customer=customer)
-        #Serialize the loans
-        loans_serializer: LoansSerializer = LoansSerializer(loans, many=True)
+
+        #The archived loans are only read when the history is requested
+        if with_history(request):
+            archived: List[ArchivedLoan] = ArchivedLoan.objects.filter(customer_id=customer.id)
+            return Response(
+                merge_history(request, LoansSerializer, loans, ArchivedLoanSerializer, archived),
+                status=status.HTTP_200_OK
+            )
+
+        #Serialize the loans with the requested fields and relations
+        loans_serializer: LoansSerializer = fieldsets.serializer_for(LoansSerializer, loans, request, iterator=True)
 
         return Response(
             loans_serializer.data,
             status=status.HTTP_200_OK
         )
 
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk) -> HttpResponse:
+
+        """
+            This method return the statement of a customer: the customer, its loans
+            and its payments of a range of days with their details, in a fixed number of queries
+            Query params: from and to (YYYY-MM-DD), and fields to select the sections and their fields
+            (customer.score,loans.id,payments.paymentdetails.amount)
+            The statements with many payments are streamed
+
+            :param request: Request object
+            :type request: Request
+            :param pk: Primary key of the customer
+            :type pk: int
+
+            :return: Response object
+            :rtype: HttpResponse
+        """
+
+        #Get the customer
+        customer: Customers = self.get_object()
+        document, large = statements.build(customer, request.query_params)
+
+        if large:
+            #The querysets are bound to the shard of the customer, the stream can be read after the view
+            return StreamingHttpResponse(statements.stream(document), content_type="application/json")
+
+        return Response(
+            {key: list(value) if isinstance(value, Iterator) else value for key, value in document},
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['get'])
+    def payment_summary(self, request, pk) -> Response:
+
+        """
+            This method return the payments of a customer by month: the payments,
+            the rejected payments, their amounts and the rejection rate
+            Query params: from and to (YYYY-MM), both inclusive
+            The months are read from the summaries with one query, not from the payments
+
+            :param request: Request object
+            :type request: Request
+            :param pk: Primary key of the customer
+            :type pk: int
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        first, last = rollups.parse_months(request.query_params)
+        summaries: List[PaymentMonthlySummary] = list(rollups.summaries(pk, first, last))
+        #The customer is only read when it does not have summaries
+        if not summaries and not Customers.objects.filter(pk=pk).exists():
+            raise Http404()
+
+        return Response(
+            PaymentSummarySerializer(summaries, many=True).data,
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=True, methods=['get'])
     def total_debt(self, request, pk) -> Response:
 
@@ -111,29 +384,181 @@ class CustomersViewSet(viewsets.ModelViewSet):
 
         #Get the customer
         customer: Customers = self.get_object()
-        #Calculate the total debt
-        total_debt: float = _total_debt(customer)
-
-        #Calculate the available amount
-        score: float = customer.score
-        available_amount: float = score - total_debt
 
         return Response(
-            {
-                "external_id": customer.external_id,
-                "score": score,
-                "available_amount": available_amount,
-                "total_debt": total_debt
-            },
+            services.balance(customer),
             status=status.HTTP_200_OK
         )
     
-class LoansViewSet(viewsets.ModelViewSet):
+class LoansViewSet(ShardedViewSetMixin, SparseFieldsetsMixin, QueryParamsFilterMixin, viewsets.ModelViewSet):
     queryset = Loans.objects.all()
     serializer_class = LoansSerializer
 
     permission_classes = (IsAuthenticated,)
 
+    filter_fields: Dict[str, serializers.Field] = {
+        "status": serializers.IntegerField(),
+        "customer": serializers.IntegerField(),
+        "created_at": serializers.DateTimeField(),
+        "taken_at": serializers.DateTimeField(),
+        "maximum_payment_date": serializers.DateTimeField(),
+    }
+    range_fields: List[str] = ["created_at", "taken_at", "maximum_payment_date"]
+
+    def get_request_shard(self, request) -> Optional[str]:
+
+        if "pk" in self.kwargs:
+            return sharding.shard_for_row(Loans, self.kwargs["pk"])
+        #The loans are stored in the shard of the customer
+        if self.action == "create":
+            return sharding.shard_for_customer(request.data.get("customer"))
+
+        return None
+
+    def perform_create(self, serializer: LoansSerializer) -> None:
+        super().perform_create(serializer)
+        events.notify(serializer.instance.customer_id)
+
+    def perform_update(self, serializer: LoansSerializer) -> None:
+        super().perform_update(serializer)
+        events.notify(serializer.instance.customer_id)
+
+    def bulk_response(self, request, operation: Callable[[List[Any]], List[Dict[str, Any]]]) -> Response:
+
+        """
+            This method run a bulk operation over the rows of the body, a list of loans,
+            and return the result of every row
+
+            :param request: Request object
+            :type request: Request
+            :param operation: Bulk operation
+            :type operation: Callable
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        rows: Any = request.data
+        if not isinstance(rows, list) or not rows:
+            raise serializers.ValidationError("The body must be a list of loans")
+        if len(rows) > settings.CREDICTS_BULK_MAX_ROWS:
+            raise serializers.ValidationError(f"The body can have at most {settings.CREDICTS_BULK_MAX_ROWS} loans")
+
+        results: List[Dict[str, Any]] = operation(rows)
+        failed: int = sum(1 for result in results if "errors" in result)
+
+        return Response(
+            {"succeeded": len(results) - failed, "failed": failed, "results": results},
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request) -> Response:
+
+        """
+            This method create many loans, the credit limit of the customers
+            is checked for all the loans of the request
+            The valid loans are created, the invalid loans are returned with their errors
+
+            :param request: Request object
+            :type request: Request
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        return self.bulk_response(request, bulk.create_loans)
+
+    @action(detail=False, methods=['post'], url_path='bulk/status')
+    def bulk_status(self, request) -> Response:
+
+        """
+            This method change the status of many loans: id, status and optionally version
+            The transitions follow the rules of the update of a loan
+
+            :param request: Request object
+            :type request: Request
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        return self.bulk_response(request, bulk.transition_loans)
+
+    @action(detail=False, methods=['get'], url_path=r'external/(?P<external_id>[^/]+)')
+    def external(self, request, external_id: str) -> Response:
+
+        """
+            This method return the loans with an external id
+            The external id of the loans is not unique, so the response is a list
+
+            :param request: Request object
+            :type request: Request
+            :param external_id: External id of the loans
+            :type external_id: str
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        loans: List[Loans] = self.fan_out(self.optimize_queryset(Loans.objects.filter(external_id=external_id)))
+
+        return Response(
+            self.get_serializer(loans, many=True).data,
+            status=status.HTTP_200_OK
+        )
+
+class JobsViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.ListModelMixin,
+    viewsets.GenericViewSet
+):
+    queryset = Job.objects.all().order_by('-id')
+    serializer_class = JobSerializer
+
+    permission_classes = (IsAuthenticated,)
+
+    def create(self, request, *args, **kwargs) -> Response:
+
+        """
+            This method enqueue a job, the job is processed by the run_worker command
+
+            :param request: Request object
+            :type request: Request
+
+            :return: Response object
+            :rtype: Response
+        """
+
+        response: Response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+
+        return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def payment_by_external_id(request, external_id: str) -> Response:
+
+    """
+        This method return the payments with an external id
+        The external id of the payments is not unique, so the response is a list
+    """
+
+    payments_serializer: PaymentSerializer = fieldsets.serializer_for(
+        PaymentSerializer, Payment.objects.filter(external_id=external_id), request
+    )
+    queryset: models.QuerySet = payments_serializer.instance
+    payments_serializer.instance = sorted(
+        chain.from_iterable(sharding.fan_out(lambda alias: list(queryset.using(alias)))),
+        key=attrgetter("pk")
+    )
+
+    return Response(
+        payments_serializer.data,
+        status=status.HTTP_200_OK
+    )
+
 
 @swagger_auto_schema(
     methods=['post'],
@@ -147,28 +572,19 @@ def rejected_payment(request) -> Response:
         This method reject a payment
         Aditional, update the information of the loans
     """
-    payment_pk: int = request.data['payment']
-    payment_instance: Payment = Payment.objects.get(pk=payment_pk)
 
-    if payment_instance.status == 1:
+    try:
+        services.reject_payment(request.data['payment'])
+    except Payment.DoesNotExist:
+        raise Http404
+    except PaymentError as error:
         return Response(
             {
-                "message": "The payment was rejected previously"
+                "message": error.message
             },
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    payment_instance.status: int = 1
-    payment_instance.save()
-
-    #Get payment details
-    payment_details: PaymentDetails = PaymentDetails.objects.filter(payment=payment_instance)
-    for detail in payment_details:
-        loan: Loans = detail.loan
-        loan.outstanding: float = loan.outstanding + detail.amount
-        loan.status: int = 1
-        loan.save()
-
     return Response(
         status=status.HTTP_200_OK
     )
@@ -184,92 +600,311 @@ def create_payment(request) -> Response:
     """
         This method create a payment with all the details
         Adicional, update the debict of the loan
+        With the payment pipeline enabled, the payment is queued and applied by the payment writer
     """
 
-    #Get the customer
-    customer: Customers = Customers.objects.get(pk=request.data['customer'])
-    #Get the total debt of the customer
-    total_debt: float = _total_debt(customer)
+    if settings.CREDICTS_PAYMENT_PIPELINE:
+        return _submit_payment(request)
 
-    response_json: Dict[str, str] = {}
-    response_status: int = status.HTTP_201_CREATED
-    failed: bool = False
+    try:
+        services.apply_payment(
+            customer_id=request.data['customer'],
+            external_id=request.data['external_id'],
+            total_amount=request.data['total_amount'],
+            paymentdetails=request.data['paymentdetails']
+        )
+    except Customers.DoesNotExist:
+        raise Http404
+    except PaymentError as error:
+        return Response(
+            {
+                "message": error.message
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response(
+        {},
+        status=status.HTTP_201_CREATED
+    )
+
+def _submit_payment(request) -> Response:
+
+    """
+        This method validate a payment and save it in the queue of the payment writer
+    """
+
+    serializer: DocCreatePaymentDataSerializer = DocCreatePaymentDataSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    if not Customers.objects.using(sharding.shard_for_customer(serializer.validated_data['customer'])).filter(
+        pk=serializer.validated_data['customer']
+    ).exists():
+        raise Http404
+
+    submission_id: int = pipeline.submit(serializer.validated_data)
+
+    return Response(
+        {
+            "submission": submission_id,
+            "status": "pending"
+        },
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": reverse("payment_submission", args=[submission_id])}
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def payment_submission(request, submission_id: int) -> Response:
 
-    #If the customer does not have any debt, dont create the payment
-    if total_debt == 0:
-        response_json: Dict[str, str] = {
-            "message": "The customer does not have any debt"
-        }
-        response_status: int = status.HTTP_400_BAD_REQUEST
+    """
+        This method return the status of a payment queued in the payment pipeline
+        Status: pending, applying, applied or failed
+    """
+
+    submission: Optional[Dict[str, Any]] = pipeline.get_submission(submission_id)
+    if submission is None:
+        raise Http404
 
-    #Validate if the amount of the payment is greater than the total debt, dont create the payment
-    elif float(request.data['total_amount']) > total_debt:
-        response_json: Dict[str, str] = {
-            "message": "The amount of the payment is greater than the total debt"
-        }
-        response_status: int = status.HTTP_400_BAD_REQUEST
+    return Response(
+        submission,
+        status=status.HTTP_200_OK
+    )
 
-    else:
+@swagger_auto_schema(
+    methods=['post'],
+    manual_parameters=[
+        openapi.Parameter("file", openapi.IN_FORM, type=openapi.TYPE_FILE, required=True),
+        openapi.Parameter("all", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+    ],
+    responses={})
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def payment_settlement(request) -> StreamingHttpResponse:
 
-        #Get all the active loans of the customer
-        loans_of_customer: Loans = Loans.objects.filter(
-            customer=customer,
-            status__in=[0, 1]
+    """
+        This method match a settlement file of the bank (external_id, amount, date) against the payments
+        The response is streamed as JSON lines: the lines missing or with a different amount and a summary
+        With all=1, the matched lines are included
+    """
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return Response(
+            {
+                "message": "The settlement file is required"
+            },
+            status=status.HTTP_400_BAD_REQUEST
         )
-        loans_of_customer: Dict[int, Loans] = { loan.id:loan for loan in loans_of_customer}
-
-        #Validate that all the payments details are correct
-        #All the loan must exist
-        #The amount of the payment must be less than the outstanding of the loan
-        for payment_detail in request.data['paymentdetails']:
-            loan_id: int = payment_detail['loan']
-            loan: Loans = loans_of_customer.get(loan_id)
-            #The loan must exist
-            if not loan:
-                response_json: Dict[str, str] = {
-                    "message": f"The loan {loan_id} does not exist"
-                }
-                response_status: int = status.HTTP_400_BAD_REQUEST
-                failed: bool = True
-
-            #The amount of the payment must be less or equal than the outstanding of the loan
-            if payment_detail['amount'] > loan.outstanding:
-
-                response_json: Dict[str, str] = {
-                    "message": f"The amount of the payment is greater than the outstanding of the loan {loan_id}"
-                }
-                response_status: int = status.HTTP_400_BAD_REQUEST
-                failed: bool = True
-
-        if not failed:
-
-            #Create the payment
-            payment_instance: Payment = Payment.objects.create(
-                external_id=request.data['external_id'],
-                total_amount=request.data['total_amount'],
-                customer=customer
-            )
 
-            #For all the payment details, create the payment detail and update the outstanding of the loan
-            for payment_detail in request.data['paymentdetails']:
-
-                loan: Loans = loans_of_customer[payment_detail['loan']]
-                payment_detail_amount: float = payment_detail['amount']
-
-                PaymentDetails.objects.create(
-                    amount=payment_detail_amount,
-                    loan=loan,
-                    payment=payment_instance
-                )
-                
-                #Reduce the outstanding of the loan
-                loan.outstanding = loan.outstanding - payment_detail_amount
-                #If the outstanding of the loan is 0, update the status of the loan
-                if loan.outstanding == 0:
-                    loan.status = 4
-                loan.save()
+    return StreamingHttpResponse(
+        settlement.diff(
+            codecs.iterdecode(upload, "utf-8-sig"),
+            include_matched=request.query_params.get("all") in ["1", "true"]
+        ),
+        content_type="application/x-ndjson"
+    )
+
+@swagger_auto_schema(
+    methods=['post'],
+    manual_parameters=[
+        openapi.Parameter("file", openapi.IN_FORM, type=openapi.TYPE_FILE, required=True),
+        openapi.Parameter("all", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+        openapi.Parameter("dry_run", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+    ],
+    responses={})
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def customer_scores(request) -> StreamingHttpResponse:
+
+    """
+        This method update the scores of the customers from a file of the risk model
+        (external_id, score, preapproved_at)
+        The response is streamed as JSON lines: the lines missing or invalid, the customers
+        whose new score is below their debt and a summary
+        With all=1, all the lines are included. With dry_run=1, the customers are not updated
+    """
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return Response(
+            {
+                "message": "The score file is required"
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return StreamingHttpResponse(
+        scores.report(
+            codecs.iterdecode(upload, "utf-8-sig"),
+            include_all=request.query_params.get("all") in ["1", "true"],
+            dry_run=request.query_params.get("dry_run") in ["1", "true"]
+        ),
+        content_type="application/x-ndjson"
+    )
+
+@swagger_auto_schema(
+    methods=['post'],
+    request_body=SimulationSerializer,
+    responses={})
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def portfolio_simulation(request) -> Response:
+
+    """
+        This method evaluate what-if scenarios over the portfolio: how many customers
+        would go over their limit if the scores or the outstanding changed
+        The portfolio is read from a cached snapshot, refresh=true read it again
+    """
+
+    serializer: SimulationSerializer = SimulationSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    started_at: float = time.perf_counter()
+    portfolio: simulation.Snapshot = simulation.snapshot(refresh=serializer.validated_data["refresh"])
+    loaded_at: float = time.perf_counter()
+    results: List[Dict[str, Any]] = simulation.simulate(portfolio, serializer.validated_data["scenarios"])
 
     return Response(
-        response_json,
-        status=response_status
-    )
\ No newline at end of file
+        {
+            "snapshot": {
+                "customers": len(portfolio),
+                "created_at": datetime.fromtimestamp(portfolio.created_at, tz=timezone.utc),
+                "load_ms": round((loaded_at - started_at) * 1000, 3),
+                "simulation_ms": round((time.perf_counter() - loaded_at) * 1000, 3),
+            },
+            "scenarios": results,
+        },
+        status=status.HTTP_200_OK
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request) -> Response:
+
+    """
+        This method return the saved profiles of the requests, the newest first
+    """
+
+    return Response(profiling.profiles(), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id: str) -> Response:
+
+    """
+        This method return a profile: the functions with the most cumulative time
+        and the timeline of the queries of the request
+    """
+
+    profile: Optional[Dict[str, Any]] = profiling.load(profile_id)
+    if profile is None:
+        raise Http404()
+
+    return Response(profile, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_download(request, profile_id: str) -> FileResponse:
+
+    """
+        This method download the stats of a profile, readable with pstats or snakeviz
+    """
+
+    path: Optional[str] = profiling.stats_path(profile_id)
+    if path is None:
+        raise Http404()
+
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([])
+def ready(request) -> Response:
+
+    """
+        This method return if the process finished the warm-up
+        Aditional, return the startup report of the process
+    """
+
+    return Response(
+        warmup.report(),
+        status=status.HTTP_200_OK if warmup.is_ready() else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def customer_events_ticket(request, pk: int) -> Response:
+
+    """
+        This method return a ticket that open the event stream of a customer once,
+        the ticket expires after CREDICTS_EVENTS_TICKET_SECONDS
+        GET customer/<id>/events?ticket=<ticket>
+    """
+
+    if not Customers.objects.using(sharding.shard_for_customer(pk)).filter(pk=pk).exists():
+        raise Http404
+
+    return Response(
+        {
+            "ticket": events.issue_ticket(pk, request.user.id),
+            "expires_in": settings.CREDICTS_EVENTS_TICKET_SECONDS
+        },
+        status=status.HTTP_201_CREATED
+    )
+
+async def customer_events(request, pk: int) -> HttpResponse:
+
+    """
+        This method stream the balance of a customer as server-sent events,
+        a new event is sent every time that a payment or a loan change the balance
+        The token is sent in the Authorization header, the browsers can not send headers
+        with EventSource and open the stream with a ticket of customer/<id>/events/ticket
+        The streams are served by the ASGI server
+    """
+
+    if not isinstance(request, ASGIRequest) or not settings.CREDICTS_EVENTS:
+        return JsonResponse(
+            {
+                "message": "The event streams are served by the ASGI server with CREDICTS_EVENTS enabled"
+            },
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    user: Optional[User] = None
+    key: str = request.headers.get("Authorization", "").removeprefix("Token ")
+    if key:
+        token: Optional[Token] = await Token.objects.select_related("user").filter(key=key).afirst()
+        user = token.user if token is not None else None
+    elif request.GET.get("ticket"):
+        user_id: Optional[int] = await sync_to_async(events.redeem_ticket)(request.GET["ticket"], pk)
+        user = await User.objects.filter(pk=user_id).afirst() if user_id is not None else None
+
+    if user is None or not user.is_active:
+        return JsonResponse(
+            {
+                "detail": "Invalid token."
+            },
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    balance: Dict[int, Dict[str, Any]] = await sync_to_async(events.balances)([pk])
+    if pk not in balance:
+        return JsonResponse(
+            {
+                "detail": "Not found."
+            },
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    response: StreamingHttpResponse = StreamingHttpResponse(
+        events.stream(pk, balance[pk]),
+        content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    #The proxies must not buffer the events
+    response["X-Accel-Buffering"] = "no"
+
+    return response
@@ -0,0 +1,214 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework import serializers
+
+#Moment when this process imported the application code
+PROCESS_STARTED_AT: float = time.time()
+
+#Report of the last warm-up, shared with the forked workers
+_REPORT: Dict[str, Any] = {}
+
+
+def _walk_patterns(patterns: List[Any]) -> List[URLPattern]:
+
+    """
+        This method return all the url patterns, including the nested ones
+
+        :param patterns: List of url patterns and resolvers
+        :type patterns: list
+
+        :return: Flat list of url patterns
+        :rtype: list
+    """
+
+    flat_patterns: List[URLPattern] = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            flat_patterns.extend(_walk_patterns(pattern.url_patterns))
+        else:
+            flat_patterns.append(pattern)
+
+    return flat_patterns
+
+def _warm_urls() -> int:
+
+    """
+        This method compile all the routes of the credicts app
+        and populate the reverse dictionaries of the root resolver
+
+        :return: Number of routes resolved
+        :rtype: int
+    """
+
+    from . import urls
+
+    resolver: URLResolver = get_resolver()
+    #Populate the reverse and namespace dictionaries of the whole project
+    resolver.reverse_dict
+    resolver.namespace_dict
+
+    patterns: List[URLPattern] = _walk_patterns(urls.urlpatterns)
+    for pattern in patterns:
+        #Compile the regex of the route and import its callback
+        pattern.pattern.regex
+        pattern.lookup_str
+
+    return len(patterns)
+
+def _warm_serializers() -> int:
+
+    """
+        This method instantiate all the serializers of the credicts app,
+        building their fields and the metadata of the models
+
+        :return: Number of serializers instantiated
+        :rtype: int
+    """
+
+    from . import doc_serializer
+    from . import serializers as credicts_serializers
+
+    total: int = 0
+    for module in (credicts_serializers, doc_serializer):
+        for value in vars(module).values():
+            if (
+                isinstance(value, type)
+                and issubclass(value, serializers.Serializer)
+                and value.__module__ == module.__name__
+            ):
+                value().fields
+                total += 1
+
+    return total
+
+def _warm_databases() -> int:
+
+    """
+        This method open a connection for every configured database
+
+        :return: Number of connections opened
+        :rtype: int
+    """
+
+    for alias in connections:
+        connection = connections[alias]
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    return len(connections.settings)
+
+def _warm_caches() -> int:
+
+    """
+        This method prime the configured caches and the content types cache
+
+        :return: Number of caches primed
+        :rtype: int
+    """
+
+    for alias in caches:
+        caches[alias].get("credicts:warmup")
+
+    ContentType.objects.get_for_models(*apps.get_app_config("credicts").get_models())
+
+    return len(caches.settings)
+
+PHASES: Dict[str, Callable[[], int]] = {
+    "urls": _warm_urls,
+    "serializers": _warm_serializers,
+    "databases": _warm_databases,
+    "caches": _warm_caches,
+}
+
+def warm_up(started_at: Optional[float] = None) -> Dict[str, Any]:
+
+    """
+        This method run all the phases of the warm-up and mark the process as ready
+
+        :param started_at: Timestamp when the server started, by default the import of this module
+        :type started_at: float
+
+        :return: Startup report
+        :rtype: dict
+    """
+
+    started_at: float = started_at or PROCESS_STARTED_AT
+    phases: Dict[str, Dict[str, float]] = {}
+
+    for name, phase in PHASES.items():
+        phase_started_at: float = time.perf_counter()
+        items: int = phase()
+        phases[name] = {
+            "items": items,
+            "seconds": round(time.perf_counter() - phase_started_at, 6)
+        }
+
+    _REPORT.clear()
+    _REPORT.update({
+        "ready": True,
+        "pid": os.getpid(),
+        "phases": phases,
+        "startup_seconds": round(time.time() - started_at, 6),
+    })
+
+    return report()
+
+def warm_worker() -> Dict[str, Any]:
+
+    """
+        This method open the connections of a forked worker,
+        the connections of the master process can not be shared
+
+        :return: Startup report
+        :rtype: dict
+    """
+
+    phase_started_at: float = time.perf_counter()
+    items: int = _warm_databases()
+    _REPORT["worker"] = {
+        "pid": os.getpid(),
+        "databases": {
+            "items": items,
+            "seconds": round(time.perf_counter() - phase_started_at, 6)
+        }
+    }
+
+    return report()
+
+def reset() -> None:
+
+    """
+        This method mark the process as not ready
+    """
+
+    _REPORT.clear()
+
+def is_ready() -> bool:
+
+    """
+        This method return if the warm-up of the process finished
+
+        :return: True when the process is ready
+        :rtype: bool
+    """
+
+    return bool(_REPORT.get("ready"))
+
+def report() -> Dict[str, Any]:
+
+    """
+        This method return a copy of the startup report
+
+        :return: Startup report
+        :rtype: dict
+    """
+
+    return dict(_REPORT, ready=is_ready())
@@ -0,0 +1,82 @@
+"""
+Gunicorn configuration for wearemo.
+
+The application is loaded once in the master process, warmed up and then
+forked into the workers, so the workers start serving with the routes,
+serializers and caches already initialized.
+
+Usage:
+    gunicorn --chdir wearemo -c wearemo/gunicorn.conf.py wearemo.wsgi
+"""
+
+import multiprocessing
+import os
+import shutil
+import time
+
+#Moment when the master process started
+STARTED_AT: float = time.time()
+
+bind: str = os.environ.get("WEAREMO_BIND", "0.0.0.0:5050")
+workers: int = int(os.environ.get("WEAREMO_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class: str = os.environ.get("WEAREMO_WORKER_CLASS", "sync")
+threads: int = int(os.environ.get("WEAREMO_THREADS", 1))
+timeout: int = int(os.environ.get("WEAREMO_TIMEOUT", 30))
+
+#Load the django application in the master before forking the workers
+preload_app: bool = True
+
+#The workers write their metrics in this directory, /metrics aggregate them
+#It must exist before the application is loaded
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join("/tmp", "wearemo-metrics"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server) -> None:
+
+    """
+        This method empty the directory of the metrics before the workers are forked,
+        the files of a previous run have the metrics of workers that do not exist anymore
+    """
+
+    directory: str = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def when_ready(server) -> None:
+
+    """
+        This method warm up the application in the master process,
+        before the workers are forked
+    """
+
+    from django.db import connections
+
+    from credicts import warmup
+
+    report = warmup.warm_up(started_at=STARTED_AT)
+    server.log.info("Wearemo warm-up finished: %s", report)
+
+    #The connections of the master can not be shared with the workers
+    connections.close_all()
+
+def post_fork(server, worker) -> None:
+
+    """
+        This method open the connections of the worker before it accepts requests
+    """
+
+    from credicts import warmup
+
+    report = warmup.warm_worker()
+    server.log.info("Wearemo worker %s ready: %s", worker.pid, report.get("worker"))
+
+def child_exit(server, worker) -> None:
+
+    """
+        This method remove the live metrics of a worker that exited
+    """
+
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
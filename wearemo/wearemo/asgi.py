@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wearemo.settings')
 
 application = get_asgi_application()
+
+from credicts.events import cancel_on_disconnect
+
+#The event streams are cancelled when the client disconnects
+application = cancel_on_disconnect(application)
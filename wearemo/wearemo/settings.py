@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'credicts.metrics.MetricsMiddleware',
+    'credicts.profiling.ProfilingMiddleware',
+    'credicts.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    #The static files of the admin and the swagger UI are served by the workers
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'credicts.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,6 +84,13 @@ WSGI_APPLICATION = 'wearemo.wsgi.application'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'credicts.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'credicts.renderers.CompactJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ]
 }
 
@@ -85,12 +99,61 @@ REST_FRAMEWORK = {
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#Engine of the databases: sqlite for the development, postgresql for the production
+WEAREMO_DB_ENGINE = os.environ.get('WEAREMO_DB_ENGINE', 'sqlite')
+
+if WEAREMO_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('WEAREMO_DB_NAME', 'wearemo'),
+            'USER': os.environ.get('WEAREMO_DB_USER', 'wearemo'),
+            'PASSWORD': os.environ.get('WEAREMO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('WEAREMO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('WEAREMO_DB_PORT', '5432'),
+            #Keep the connections opened by the warm-up between requests, None keep them forever
+            'CONN_MAX_AGE': int(os.environ['WEAREMO_CONN_MAX_AGE']) if os.environ.get('WEAREMO_CONN_MAX_AGE') else None,
+            #A persistent connection is checked before it is reused by a new request
+            'CONN_HEALTH_CHECKS': True,
+            #Behind a pooler in transaction mode (pgbouncer), a cursor can not live longer than its transaction
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('WEAREMO_DB_POOLER', '0') == '1',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('WEAREMO_DB_CONNECT_TIMEOUT', 5)),
+                'application_name': 'wearemo',
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            #Keep the connections opened by the warm-up between requests
+            'CONN_MAX_AGE': int(os.environ.get('WEAREMO_CONN_MAX_AGE', 60)),
+        }
+    }
+
+#Number of databases where the customers, loans and payments are distributed
+#The default database is the first shard, the others are shard_1 ... shard_N-1
+CREDICTS_SHARDS = int(os.environ.get('CREDICTS_SHARDS', 1))
+#Hosts of the PostgreSQL shards, separated by commas, by default the host of the default database
+WEAREMO_DB_SHARD_HOSTS = [host for host in os.environ.get('WEAREMO_DB_SHARD_HOSTS', '').split(',') if host]
+
+for shard_index in range(1, CREDICTS_SHARDS):
+    if WEAREMO_DB_ENGINE == 'postgresql':
+        DATABASES[f'shard_{shard_index}'] = {
+            **DATABASES['default'],
+            'NAME': f"{DATABASES['default']['NAME']}_shard_{shard_index}",
+            'HOST': WEAREMO_DB_SHARD_HOSTS[shard_index - 1] if len(WEAREMO_DB_SHARD_HOSTS) >= shard_index else DATABASES['default']['HOST'],
+        }
+    else:
+        DATABASES[f'shard_{shard_index}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db_shard_{shard_index}.sqlite3',
+            'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        }
+
+DATABASE_ROUTERS = ['credicts.routers.CustomerShardRouter']
 
 
 # Password validation
@@ -128,8 +191,138 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+#Collected by collectstatic when the image is built
+STATIC_ROOT = os.environ.get('WEAREMO_STATIC_ROOT', BASE_DIR / 'staticfiles')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+#The tests write the local files of the credicts in a temporary directory
+TEST_RUNNER = 'credicts.test_runner.SideStoresTestRunner'
+
+
+# Credicts
+
+#Attempts of the payment operations when a loan is updated concurrently
+CREDICTS_CONCURRENCY_RETRIES = int(os.environ.get('CREDICTS_CONCURRENCY_RETRIES', 5))
+#Attempts of the operations that failed on the lock of another writer (SQLite database is locked,
+#PostgreSQL serialization failure or deadlock), and first wait before the retry, doubled on every attempt
+CREDICTS_LOCK_RETRIES = int(os.environ.get('CREDICTS_LOCK_RETRIES', 10))
+CREDICTS_LOCK_BACKOFF_SECONDS = float(os.environ.get('CREDICTS_LOCK_BACKOFF_SECONDS', 0.02))
+CREDICTS_LOCK_BACKOFF_MAX_SECONDS = float(os.environ.get('CREDICTS_LOCK_BACKOFF_MAX_SECONDS', 0.5))
+
+#Budget of every token for every endpoint class, shared by all the workers
+CREDICTS_THROTTLE_RATES = {
+    'read': os.environ.get('CREDICTS_THROTTLE_READ_RATE', '1200/min'),
+    'write': os.environ.get('CREDICTS_THROTTLE_WRITE_RATE', '300/min'),
+}
+#Local file where the workers share the buckets of the throttle
+CREDICTS_THROTTLE_DB = os.environ.get('CREDICTS_THROTTLE_DB', BASE_DIR / 'throttle.sqlite3')
+
+#Write requests in progress in all the workers before the new writes are rejected, 0 disable it
+CREDICTS_MAX_PENDING_WRITES = int(os.environ.get('CREDICTS_MAX_PENDING_WRITES', 32))
+#Local file where the workers count the writes in progress
+CREDICTS_LOAD_SHEDDING_DB = os.environ.get('CREDICTS_LOAD_SHEDDING_DB', BASE_DIR / 'load_shedding.sqlite3')
+#Seconds after that a write of a worker that stopped is not counted
+CREDICTS_LOAD_SHEDDING_SLOT_SECONDS = float(os.environ.get('CREDICTS_LOAD_SHEDDING_SLOT_SECONDS', 60))
+#Seconds of the Retry-After header of the rejected writes
+CREDICTS_LOAD_SHEDDING_RETRY_AFTER = int(os.environ.get('CREDICTS_LOAD_SHEDDING_RETRY_AFTER', 1))
+
+#Seconds that a worker owns a job, the lease is renewed while the handler runs
+CREDICTS_JOB_LEASE_SECONDS = int(os.environ.get('CREDICTS_JOB_LEASE_SECONDS', 300))
+#Seconds between two polls of the queue when it is empty
+CREDICTS_JOB_POLL_SECONDS = float(os.environ.get('CREDICTS_JOB_POLL_SECONDS', 1))
+#Default number of workers of the run_worker command
+CREDICTS_JOB_CONCURRENCY = int(os.environ.get('CREDICTS_JOB_CONCURRENCY', 4))
+
+#Queue the payments and apply them in micro-batches with the run_payment_writer command
+CREDICTS_PAYMENT_PIPELINE = os.environ.get('CREDICTS_PAYMENT_PIPELINE', '') == '1'
+#Local file of the queue of the payment pipeline
+CREDICTS_PAYMENT_QUEUE_DB = os.environ.get('CREDICTS_PAYMENT_QUEUE_DB', BASE_DIR / 'payment_queue.sqlite3')
+#Maximum payments of a transaction, and milliseconds that a payment wait for its batch
+CREDICTS_PAYMENT_BATCH_SIZE = int(os.environ.get('CREDICTS_PAYMENT_BATCH_SIZE', 200))
+CREDICTS_PAYMENT_BATCH_DELAY_MS = int(os.environ.get('CREDICTS_PAYMENT_BATCH_DELAY_MS', 20))
+
+#Days after that the payments and the closed loans are moved to the archive tables
+CREDICTS_ARCHIVE_AFTER_DAYS = int(os.environ.get('CREDICTS_ARCHIVE_AFTER_DAYS', 365))
+#Rows moved or deleted in every transaction of the archive and the purge of customers
+CREDICTS_ARCHIVE_CHUNK_SIZE = int(os.environ.get('CREDICTS_ARCHIVE_CHUNK_SIZE', 1000))
+
+#Publish the changes of the balances to the event streams of the customers, CREDICTS_EVENTS=1 enable the streams
+CREDICTS_EVENTS = os.environ.get('CREDICTS_EVENTS', '') == '1'
+#Local file of the feed of changes, shared by the workers and the ASGI server of the streams
+CREDICTS_EVENTS_DB = os.environ.get('CREDICTS_EVENTS_DB', BASE_DIR / 'events.sqlite3')
+#Seconds between two reads of the feed, and seconds without changes before a heartbeat
+CREDICTS_EVENTS_POLL_SECONDS = float(os.environ.get('CREDICTS_EVENTS_POLL_SECONDS', 0.5))
+CREDICTS_EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('CREDICTS_EVENTS_HEARTBEAT_SECONDS', 15))
+#Seconds that a ticket of a stream can be used, for the clients that can not send the Authorization header
+CREDICTS_EVENTS_TICKET_SECONDS = int(os.environ.get('CREDICTS_EVENTS_TICKET_SECONDS', 30))
+
+#Payments of a statement rendered in one response, the larger statements are streamed
+CREDICTS_STATEMENT_STREAM_AFTER = int(os.environ.get('CREDICTS_STATEMENT_STREAM_AFTER', 1000))
+#Rows serialized in every chunk of a statement, the details are prefetched once per chunk
+CREDICTS_STATEMENT_CHUNK_SIZE = int(os.environ.get('CREDICTS_STATEMENT_CHUNK_SIZE', 500))
+
+#Maximum loans of a request of the bulk endpoints, and rows of every bulk insert or update
+CREDICTS_BULK_MAX_ROWS = int(os.environ.get('CREDICTS_BULK_MAX_ROWS', 1000))
+CREDICTS_BULK_BATCH_SIZE = int(os.environ.get('CREDICTS_BULK_BATCH_SIZE', 500))
+
+#Lines of a score file looked up and updated together
+CREDICTS_SCORE_BATCH_SIZE = int(os.environ.get('CREDICTS_SCORE_BATCH_SIZE', 1000))
+
+#Seconds a snapshot of the portfolio is reused by the simulations, and file shared by the processes
+CREDICTS_SIMULATION_SNAPSHOT_SECONDS = float(os.environ.get('CREDICTS_SIMULATION_SNAPSHOT_SECONDS', 300))
+CREDICTS_SIMULATION_SNAPSHOT_PATH = os.environ.get('CREDICTS_SIMULATION_SNAPSHOT_PATH', BASE_DIR / 'simulation.npz')
+#Maximum scenarios of a simulation
+CREDICTS_SIMULATION_MAX_SCENARIOS = int(os.environ.get('CREDICTS_SIMULATION_MAX_SCENARIOS', 100))
+#Maximum bytes of the matrices of a simulation, the scenarios are evaluated in groups that fit
+CREDICTS_SIMULATION_MAX_BYTES = int(os.environ.get('CREDICTS_SIMULATION_MAX_BYTES', 256 * 1024 * 1024))
+
+#Observe the latency and the queries of the requests, the metrics are served in /metrics
+#With PROMETHEUS_MULTIPROC_DIR the metrics of all the workers are aggregated in that directory
+CREDICTS_METRICS = os.environ.get('CREDICTS_METRICS', '1') == '1'
+#Token of Prometheus to read /metrics (Authorization: Bearer <token>), without it only the staff can read them
+CREDICTS_METRICS_TOKEN = os.environ.get('CREDICTS_METRICS_TOKEN', '')
+
+#Queries slower than these milliseconds are logged with their plan, 0 disable the log
+CREDICTS_SLOW_QUERY_MS = float(os.environ.get('CREDICTS_SLOW_QUERY_MS', 200))
+#Log of the slow queries shared by the processes, only the last rows are kept
+CREDICTS_SLOW_QUERY_DB = os.environ.get('CREDICTS_SLOW_QUERY_DB', BASE_DIR / 'slow_queries.sqlite3')
+CREDICTS_SLOW_QUERY_MAX_ROWS = int(os.environ.get('CREDICTS_SLOW_QUERY_MAX_ROWS', 10000))
+#Save the values of the parameters of the slow queries, by default only their types are saved
+CREDICTS_SLOW_QUERY_PARAMS = os.environ.get('CREDICTS_SLOW_QUERY_PARAMS', '') == '1'
+
+#Profiles of the requests, the oldest are deleted after this number of profiles or bytes
+CREDICTS_PROFILE_DIR = os.environ.get('CREDICTS_PROFILE_DIR', BASE_DIR / 'profiles')
+CREDICTS_PROFILE_MAX_FILES = int(os.environ.get('CREDICTS_PROFILE_MAX_FILES', 100))
+CREDICTS_PROFILE_MAX_BYTES = int(os.environ.get('CREDICTS_PROFILE_MAX_BYTES', 100 * 1024 * 1024))
+#Profile one of every N requests of every route, 0 only profile the requests asked by the staff
+CREDICTS_PROFILE_SAMPLE_EVERY = int(os.environ.get('CREDICTS_PROFILE_SAMPLE_EVERY', 0))
+
+#Annual rates of the daily accrual of the loans, the late interest is added after the maximum payment date
+CREDICTS_ACCRUAL_INTEREST_RATE = float(os.environ.get('CREDICTS_ACCRUAL_INTEREST_RATE', 0))
+CREDICTS_ACCRUAL_LATE_INTEREST_RATE = float(os.environ.get('CREDICTS_ACCRUAL_LATE_INTEREST_RATE', 0))
+#Fee charged once when a loan is late, and days after the maximum payment date before it is late
+CREDICTS_ACCRUAL_LATE_FEE = os.environ.get('CREDICTS_ACCRUAL_LATE_FEE', '0')
+CREDICTS_ACCRUAL_GRACE_DAYS = int(os.environ.get('CREDICTS_ACCRUAL_GRACE_DAYS', 0))
+#Loans read, calculated and written in every transaction of the accrual
+CREDICTS_ACCRUAL_CHUNK_SIZE = int(os.environ.get('CREDICTS_ACCRUAL_CHUNK_SIZE', 10000))
+
+#Compress the responses with brotli or gzip, the smaller responses are sent as they are
+CREDICTS_COMPRESSION = os.environ.get('CREDICTS_COMPRESSION', '1') == '1'
+CREDICTS_COMPRESSION_MIN_BYTES = int(os.environ.get('CREDICTS_COMPRESSION_MIN_BYTES', 1024))
+#Levels for the responses built in every request, the highest levels cost more than the transfer they save
+CREDICTS_COMPRESSION_GZIP_LEVEL = int(os.environ.get('CREDICTS_COMPRESSION_GZIP_LEVEL', 6))
+CREDICTS_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('CREDICTS_COMPRESSION_BROTLI_QUALITY', 4))
+#Content of a streamed response compressed before it is sent, 0 send every piece of the stream
+CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES = int(os.environ.get('CREDICTS_COMPRESSION_STREAM_FLUSH_BYTES', 16384))
+#Types of the responses that are compressed, the event streams and the pages (text/html, with the CSRF token) are not compressed
+CREDICTS_COMPRESSION_TYPES = os.environ.get(
+    'CREDICTS_COMPRESSION_TYPES',
+    'application/json,application/x-ndjson,text/plain,text/css,text/javascript,application/javascript'
+).split(',')
+
+#Rows read in every fetch of the long lists (loads, payments), with a server-side cursor in PostgreSQL
+CREDICTS_LIST_CHUNK_SIZE = int(os.environ.get('CREDICTS_LIST_CHUNK_SIZE', 2000))
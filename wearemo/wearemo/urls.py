@@ -22,6 +22,8 @@ from drf_yasg import openapi
 from django.contrib import admin
 from rest_framework.authtoken import views
 
+from credicts.metrics import metrics_view
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Wearemo API",
@@ -38,5 +40,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include("credicts.urls")),
     path('api-token-auth/', views.obtain_auth_token, name='api-token-auth'),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^swagger/$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui')
 ]